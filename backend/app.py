@@ -2,7 +2,9 @@ from flask import Flask, jsonify, send_from_directory, session
 from flask_cors import CORS
 from flask_session import Session
 from apscheduler.schedulers.background import BackgroundScheduler
+from datetime import datetime
 import os
+import time
 
 from routes.playlist_routes import playlist_bp
 from routes.channel_routes import channel_bp
@@ -11,10 +13,40 @@ from routes.stream_routes import stream_bp
 from routes.recording_routes import recording_bp
 from routes.auth_routes import auth_bp
 
+from leader import file_lock, run_as_leader
+
 app = Flask(__name__, static_folder="../frontend")
 
+def load_secret_key(path):
+    """Secret key from the environment, or one generated once and kept in the data dir.
+    
+    Every worker process must sign sessions with the same key, so a random
+    per-process key is not an option.
+    """
+    if os.environ.get("SECRET_KEY"):
+        return os.environ["SECRET_KEY"]
+    
+    try:
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    except FileExistsError:
+        pass
+    else:
+        with os.fdopen(fd, 'w') as f:
+            f.write(os.urandom(24).hex())
+    
+    with open(path) as f:
+        # Another worker may still be writing the file it just created
+        key = f.read().strip()
+    while not key:
+        time.sleep(0.05)
+        with open(path) as f:
+            key = f.read().strip()
+    return key
+
+os.makedirs('./data', exist_ok=True)
+
 # Session configuration
-app.config['SECRET_KEY'] = os.environ.get("SECRET_KEY", os.urandom(24).hex())
+app.config['SECRET_KEY'] = load_secret_key('./data/secret_key')
 app.config['SESSION_TYPE'] = 'filesystem'
 app.config['SESSION_FILE_DIR'] = './data/sessions'
 app.config['SESSION_PERMANENT'] = True
@@ -42,7 +74,10 @@ os.makedirs(app.config["PLAYLISTS_DIR"], exist_ok=True)
 os.makedirs(app.config["EPG_DIR"], exist_ok=True)
 
 from models.playlist import init_db, update_all_playlists
-init_db(app.config["DATABASE_PATH"])
+from models.epg import refresh_all_epg_sources
+# Workers start together; create tables and the default admin one at a time
+with file_lock(os.path.join(app.config["DATA_DIR"], "init.lock")):
+    init_db(app.config["DATABASE_PATH"])
 
 # Register blueprints
 app.register_blueprint(auth_bp, url_prefix="/api/auth")
@@ -53,17 +88,33 @@ app.register_blueprint(stream_bp, url_prefix="/api/stream")
 app.register_blueprint(recording_bp, url_prefix="/api/recordings")
 
 scheduler = BackgroundScheduler(daemon=True)
-if os.environ.get("AUTO_UPDATE_PLAYLISTS", "true").lower() == "true":
+
+def start_scheduler():
+    if os.environ.get("AUTO_UPDATE_PLAYLISTS", "true").lower() == "true":
+        scheduler.add_job(
+            func=lambda: update_all_playlists(app.config),
+            trigger="cron",
+            hour=6,
+            minute=0,
+            id="auto_update_playlists",
+            replace_existing=True,
+        )
+
+    # EPG sources are refreshed in the background (conditional GETs make
+    # unchanged guides cheap), starting right after boot
     scheduler.add_job(
-        func=lambda: update_all_playlists(app.config),
-        trigger="cron",
-        hour=6,
-        minute=0,
-        id="auto_update_playlists",
+        func=refresh_all_epg_sources,
+        trigger="interval",
+        hours=int(os.environ.get("EPG_REFRESH_HOURS", 12)),
+        next_run_time=datetime.now(),
+        id="refresh_epg_sources",
         replace_existing=True,
     )
     scheduler.start()
 
+# With several worker processes only the one holding the lock runs the jobs
+run_as_leader(os.path.join(app.config["DATA_DIR"], "scheduler.lock"), start_scheduler)
+
 @app.route("/")
 def index():
     return send_from_directory(app.static_folder, "index.html")
@@ -77,6 +128,7 @@ def health_check():
     return jsonify({"status": "healthy", "version": "1.0.0"})
 
 if __name__ == "__main__":
+    # Development server; production runs asgi.py under uvicorn (see Dockerfile)
     port = int(os.environ.get("PORT", 5000))
     print(f"Starting IPTV Player on port {port}...")
     app.run(host="0.0.0.0", port=port, debug=False, threaded=True)
@@ -0,0 +1,63 @@
+"""
+ASGI entrypoint with the asyncio streaming proxy.
+
+The HLS proxy routes (/api/stream/manifest and /api/stream/segment) are served
+on the event loop by async_proxy; every other route is the regular Flask app,
+run in worker threads. Start it with:
+
+    uvicorn asgi:application --app-dir backend --host 0.0.0.0 --port 5000
+"""
+
+import asyncio
+import os
+
+from asgiref.sync import ThreadSensitiveContext
+from asgiref.wsgi import WsgiToAsgi
+
+from app import app
+from async_proxy import StreamProxyApp
+
+# Flask requests handled at once per process; the database pool (DB_POOL_SIZE)
+# is sized to match
+WSGI_THREADS = int(os.environ.get("WSGI_THREADS", 32))
+
+class ThreadedWsgiToAsgi:
+    """WsgiToAsgi with requests running in parallel threads.
+
+    On its own WsgiToAsgi runs every request in one shared thread, so a slow
+    query or a long response held up all other API requests. Each request
+    here gets its own thread context, and at most WSGI_THREADS requests are
+    being handled at a time. A request gives up its slot once its response
+    starts, so long streamed responses (recording downloads, unpaged channel
+    lists) do not hold API requests back.
+    """
+
+    def __init__(self, wsgi_application, threads=WSGI_THREADS):
+        self.application = WsgiToAsgi(wsgi_application)
+        self.slots = asyncio.Semaphore(threads)
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.application(scope, receive, send)
+
+        await self.slots.acquire()
+        holding = True
+
+        def release():
+            nonlocal holding
+            if holding:
+                holding = False
+                self.slots.release()
+
+        async def send_and_release(message):
+            if message['type'] == 'http.response.start':
+                release()
+            await send(message)
+
+        try:
+            async with ThreadSensitiveContext():
+                await self.application(scope, receive, send_and_release)
+        finally:
+            release()
+
+application = StreamProxyApp(ThreadedWsgiToAsgi(app), app)
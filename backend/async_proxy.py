@@ -0,0 +1,583 @@
+"""
+Asyncio engine for the HLS proxy routes.
+
+Serves /api/stream/manifest and /api/stream/segment directly on the event
+loop (see asgi.py) instead of through Flask worker threads. One open segment
+stream costs a coroutine and a socket rather than an OS thread, upstream reads
+use large buffers that are forwarded as received, and a client disconnect
+cancels the upstream read that was feeding it.
+
+Behaviour matches the threaded routes, whose cache and prefetch policies it
+uses: playlists are rewritten and cached for half their target duration with
+single-flight fetches (manifest_cache), concurrent requests for one segment
+share a single upstream download kept under the same TTL and size limits
+(segment_cache.SegmentIndex), and the newest segments of live playlists being
+watched are prefetched (segment_prefetch.PrefetchChannels). Only the I/O is
+done differently here.
+With SEGMENT_CACHE_DIR set, finished segments are also published there and
+adopted on a miss, so worker processes share what each fetched (including
+/warm requests) while keeping their own in-memory copies.
+Restreamed TS channels (/api/stream/restream) are read from their shared ring
+buffer without a thread per viewer; like the Flask route, they require a
+logged-in session and a stored channel URL.
+"""
+
+import asyncio
+import json
+import time
+from urllib.parse import parse_qs, urlparse
+
+import aiohttp
+import flask
+
+from http_client import HTTP_CONNECT_RETRIES, HTTP_RETRY_BACKOFF
+from manifest_cache import ManifestCache, manifest_ttl
+from manifest_rewriter import rewrite_manifest
+from segment_cache import (
+    SEGMENT_CACHE_MAX_ENTRY_BYTES, SEGMENT_CACHE_TTL, SEGMENT_CACHE_DIR, KEPT_HEADERS,
+    SegmentFetchError, SegmentIndex, publish_segment, open_published, remove_published,
+)
+from segment_prefetch import PrefetchChannels, live_segment_urls
+from routes import stream_routes
+from routes.stream_routes import (
+    upstream_headers, stats_providers, warm_channel, is_restreamable,
+    playlist_targets, is_master_playlist, first_segment_url,
+)
+from zap_timing import zap_timings
+from upstream_limiter import upstream_limiter, UpstreamBusy
+from restream import restream_hub, RestreamBusy
+
+# Upstream read size; each chunk is forwarded to the client without re-buffering
+STREAM_CHUNK_SIZE = 256 * 1024
+
+MANIFEST_PATH = '/api/stream/manifest'
+SEGMENT_PATH = '/api/stream/segment'
+RESTREAM_PATH = '/api/stream/restream'
+
+class _Segment:
+    """A segment download shared by every request for its URL"""
+
+    def __init__(self, url):
+        self.url = url
+        self.buffer = bytearray()
+        self.status = None
+        self.headers = {}
+        self.error = None
+        self.done = False
+        # Too large to cache; readers pass the rest through from upstream
+        self.oversized = False
+        # (path, inode) of the copy published to SEGMENT_CACHE_DIR, removed with the entry
+        self.published = None
+        self.accounted = 0
+        self.created = time.monotonic()
+        self._changed = asyncio.Event()
+
+    def notify(self):
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def changed(self):
+        await self._changed.wait()
+
+class AsyncStreamProxy:
+    def __init__(self, flask_app=None):
+        # Owner of the login sessions checked for restreams
+        self.flask_app = flask_app
+        self.session = None
+        self.loop = None
+        self._manifests = ManifestCache()
+        self._segments = SegmentIndex(remove=self._remove_published)
+        self._prefetch = PrefetchChannels()
+        self._counters = {
+            'segment_hits': 0, 'segment_misses': 0, 'segment_coalesced': 0, 'segment_oversized': 0,
+            'segment_shared_hits': 0,
+            'streams_open': 0, 'disconnects': 0, 'errors': 0,
+        }
+
+    async def startup(self):
+        self.loop = asyncio.get_running_loop()
+        connector = aiohttp.TCPConnector(limit=0, ttl_dns_cache=300, enable_cleanup_closed=True)
+        self.session = aiohttp.ClientSession(
+            connector=connector,
+            timeout=aiohttp.ClientTimeout(total=None, sock_connect=15, sock_read=30),
+            cookie_jar=aiohttp.DummyCookieJar(),
+            read_bufsize=STREAM_CHUNK_SIZE,
+        )
+
+    async def shutdown(self):
+        if self.session is not None:
+            await self.session.close()
+
+    def stats(self):
+        return {
+            **self._counters,
+            'cached_segments': len(self._segments),
+            'cached_segment_bytes': self._segments.bytes,
+            'segment_evictions': self._segments.evictions,
+            'manifest_cache': self._manifests.stats(),
+            'segment_prefetch': self._prefetch.stats(),
+        }
+
+    # ---- upstream ----
+
+    async def _get(self, url, headers):
+        """GET with connect retries and exponential backoff, like http_client"""
+        for attempt in range(HTTP_CONNECT_RETRIES + 1):
+            try:
+                return await self.session.get(url, headers=headers, allow_redirects=True)
+            except aiohttp.ClientConnectorError:
+                if attempt == HTTP_CONNECT_RETRIES:
+                    raise
+                await asyncio.sleep(HTTP_RETRY_BACKOFF * (2 ** attempt))
+
+    # ---- playlists ----
+
+    async def manifest(self, url, queue=True):
+        self._prefetch.touch(url)
+        return await self._manifests.get_async(url, lambda: self._fetch_manifest(url, queue))
+
+    async def _fetch_manifest(self, url, queue=True):
+        print(f"[ASYNC-PROXY] Fetching manifest: {url}")
+        async with upstream_limiter.slot(url, queue):
+            resp = await self._get(url, upstream_headers(url))
+            try:
+                if resp.status >= 400:
+                    raise SegmentFetchError(f"Upstream returned {resp.status}", resp.status)
+                content = await resp.text(errors='replace')
+            finally:
+                resp.release()
+
+        self._schedule_prefetch(url, live_segment_urls(content, url))
+        return rewrite_manifest(content, url), manifest_ttl(content)
+
+    # ---- prefetch ----
+
+    def _schedule_prefetch(self, playlist_url, segment_urls):
+        channel = self._prefetch.schedule(playlist_url, segment_urls)
+        if channel is not None:
+            asyncio.ensure_future(self._run_prefetch(channel))
+
+    async def _run_prefetch(self, channel):
+        """Download a channel's queued segments one at a time until it goes idle"""
+        while True:
+            url = self._prefetch.next_url(channel)
+            if url is None:
+                return
+            if self._lookup_segment(url) is not None:
+                continue
+
+            # Prefetches only use spare provider connections
+            entry = self._start_segment(url, queue=False)
+            while not entry.done and entry.error is None and not entry.oversized:
+                await entry.changed()
+            self._prefetch.record(entry.done and entry.error is None)
+
+    # ---- warm-up ----
+
+    async def warm(self, url):
+        """Async counterpart of stream_routes.warm_channel, filling this engine's caches (and SEGMENT_CACHE_DIR).
+
+        Only uses spare provider connections; UpstreamBusy ends it when none is free.
+        """
+        started = time.monotonic()
+        content = await self.manifest(url, queue=False)
+
+        if is_master_playlist(content):
+            zap_timings.record('warm_master_manifest', time.monotonic() - started)
+            variants = playlist_targets(content)
+            if not variants:
+                return
+            phase_started = time.monotonic()
+            content = await self.manifest(variants[0], queue=False)
+        else:
+            phase_started = started
+        zap_timings.record('warm_media_manifest', time.monotonic() - phase_started)
+
+        segment = first_segment_url(content)
+        if segment:
+            phase_started = time.monotonic()
+            entry = self._lookup_segment(segment) or self._start_segment(segment, queue=False)
+            while not entry.done and entry.error is None and not entry.oversized:
+                await entry.changed()
+            zap_timings.record('warm_first_segment', time.monotonic() - phase_started)
+
+        zap_timings.record('warm_total', time.monotonic() - started)
+
+    def warm_blocking(self, url):
+        """Run warm() on the event loop from a worker thread (the Flask /warm route)"""
+        if self.loop is None:
+            return warm_channel(url)
+        asyncio.run_coroutine_threadsafe(self.warm(url), self.loop).result()
+
+    # ---- segments ----
+
+    def _lookup_segment(self, url):
+        return self._segments.lookup(url)
+
+    def _start_segment(self, url, queue=True):
+        entry = _Segment(url)
+        self._segments.add(entry)
+        asyncio.ensure_future(self._fetch_segment(entry, queue))
+        return entry
+
+    def open_segment(self, url):
+        entry = self._lookup_segment(url)
+        if entry is not None:
+            self._segments.touch(entry)
+            self._counters['segment_hits' if entry.done else 'segment_coalesced'] += 1
+            return entry
+
+        self._counters['segment_misses'] += 1
+        return self._start_segment(url)
+
+    async def _fetch_segment(self, entry, queue=True):
+        try:
+            if SEGMENT_CACHE_DIR and await self._adopt_segment(entry):
+                return
+
+            async with upstream_limiter.slot(entry.url, queue):
+                resp = await self._get(entry.url, upstream_headers(entry.url))
+                try:
+                    if resp.status >= 400:
+                        raise SegmentFetchError(f"Upstream returned {resp.status}", resp.status)
+
+                    entry.status = resp.status
+                    entry.headers = _kept_headers(resp.headers)
+                    entry.notify()
+
+                    if (resp.content_length or 0) > SEGMENT_CACHE_MAX_ENTRY_BYTES:
+                        return self._oversize_segment(entry)
+
+                    async for chunk in resp.content.iter_chunked(STREAM_CHUNK_SIZE):
+                        entry.buffer.extend(chunk)
+                        entry.notify()
+                        if len(entry.buffer) > SEGMENT_CACHE_MAX_ENTRY_BYTES:
+                            return self._oversize_segment(entry)
+                finally:
+                    resp.release()
+
+            self._finish_segment(entry)
+
+            if SEGMENT_CACHE_DIR:
+                await self._publish_segment(entry)
+
+        except Exception as e:
+            if isinstance(e, UpstreamBusy):
+                e = SegmentFetchError(str(e), e.status)
+            entry.error = e if isinstance(e, SegmentFetchError) else SegmentFetchError(str(e))
+            entry.notify()
+            self._counters['errors'] += 1
+            self._segments.drop(entry)
+
+    def _finish_segment(self, entry, age=0):
+        entry.done = True
+        entry.created = time.monotonic() - age
+        entry.notify()
+
+        self._segments.account(entry, len(entry.buffer))
+
+    async def _adopt_segment(self, entry):
+        """Load the copy of a segment another worker process published, if there is one"""
+        def read():
+            published = open_published(SEGMENT_CACHE_DIR, entry.url, SEGMENT_CACHE_TTL)
+            if published is None:
+                return None
+            with published.file as f:
+                return published, f.read()
+
+        found = await asyncio.to_thread(read)
+        if found is None:
+            return False
+        published, body = found
+        entry.status = published.status
+        entry.headers = published.headers
+        entry.buffer.extend(body)
+        self._counters['segment_shared_hits'] += 1
+        self._finish_segment(entry, published.age)
+        return True
+
+    async def _publish_segment(self, entry):
+        """Share a finished segment with the other worker processes"""
+        try:
+            entry.published = await asyncio.to_thread(
+                publish_segment, SEGMENT_CACHE_DIR, entry.url, entry.status, entry.headers, entry.buffer)
+        except OSError as e:
+            print(f"[ASYNC-PROXY] Could not publish segment: {e}")
+            return
+        if not self._segments.holds(entry):
+            # Dropped while it was being written
+            self._segments.drop(entry)
+
+    def _remove_published(self, path, inode):
+        asyncio.get_running_loop().run_in_executor(None, remove_published, path, inode)
+
+    def _oversize_segment(self, entry):
+        """Stop fetching a body too large to cache; its readers pass the rest through"""
+        entry.oversized = True
+        entry.notify()
+        self._counters['segment_oversized'] += 1
+        self._segments.drop(entry)
+        print(f"[ASYNC-PROXY] Too large to cache, passing through: {entry.url}")
+
+    async def _passthrough_segment(self, url):
+        """The rest of an oversized body, read straight from upstream (see SegmentCache._passthrough)"""
+        async with upstream_limiter.slot(url):
+            resp = await self._get(url, upstream_headers(url))
+            try:
+                if resp.status >= 400:
+                    raise SegmentFetchError(f"Upstream returned {resp.status}", resp.status)
+                async for chunk in resp.content.iter_chunked(STREAM_CHUNK_SIZE):
+                    yield chunk
+            finally:
+                resp.close()
+
+    async def wait_headers(self, entry):
+        while entry.status is None and entry.error is None:
+            await entry.changed()
+        if entry.error is not None:
+            raise entry.error
+        return entry.status, entry.headers
+
+    async def iter_segment(self, entry):
+        pos = 0
+        while True:
+            if len(entry.buffer) > pos:
+                with memoryview(entry.buffer) as view, view[pos:] as tail:
+                    chunk = bytes(tail)
+                pos += len(chunk)
+                yield chunk
+            elif entry.error is not None:
+                raise entry.error
+            elif entry.oversized:
+                async for chunk in self._passthrough_segment(entry.url):
+                    yield chunk
+                return
+            elif entry.done:
+                return
+            else:
+                await entry.changed()
+
+    async def iter_passthrough(self, resp):
+        """Forward an upstream body as it is read; closing aborts the upstream read"""
+        try:
+            async for chunk in resp.content.iter_chunked(STREAM_CHUNK_SIZE):
+                yield chunk
+        finally:
+            resp.close()
+
+    # ---- ASGI ----
+
+    async def handle(self, scope, receive, send):
+        send = _ResponseSender(send, head=scope['method'] == 'HEAD')
+        query = parse_qs(scope.get('query_string', b'').decode('latin-1'))
+        url = (query.get('url') or [None])[0]
+        if not url:
+            return await _send_json(send, 400, {"error": "URL parameter required"})
+
+        try:
+            if scope['path'] == RESTREAM_PATH:
+                return await self._restream(scope, receive, send, url)
+
+            if scope['path'] == MANIFEST_PATH or urlparse(url).path.endswith('.m3u8'):
+                return await _send_manifest(send, await self._viewer_manifest(url))
+
+            request_range = _header(scope, b'range')
+            if request_range:
+                return await self._send_range(scope, receive, send, url, request_range)
+
+            started = time.monotonic()
+            entry = self.open_segment(url)
+            status, headers = await self.wait_headers(entry)
+            if 'mpegurl' in headers.get('Content-Type', ''):
+                self._segments.drop(entry)
+                return await _send_manifest(send, await self._viewer_manifest(url))
+            zap_timings.record('segment_first_byte', time.monotonic() - started)
+
+            await self._stream(receive, send, status, headers, self.iter_segment(entry))
+
+        except (SegmentFetchError, UpstreamBusy, RestreamBusy) as e:
+            print(f"[ASYNC-PROXY] Error: {e}")
+            await _send_error(send, e.status, e)
+        except Exception as e:
+            print(f"[ASYNC-PROXY] Error: {e}")
+            self._counters['errors'] += 1
+            await _send_error(send, 500, e)
+
+    def _logged_in(self, scope):
+        """Whether the request carries a logged-in session of the Flask app"""
+        cookie = _header(scope, b'cookie')
+        if self.flask_app is None or not cookie:
+            return False
+        with self.flask_app.test_request_context(headers={'Cookie': cookie}):
+            return 'user_id' in flask.session
+
+    async def _restream(self, scope, receive, send, url):
+        # Sessions are files and channels are rows; look them up off the event loop
+        if not await asyncio.to_thread(self._logged_in, scope):
+            return await _send_json(send, 401, {"error": "Authentication required"})
+        if not await asyncio.to_thread(is_restreamable, url):
+            return await _send_json(send, 403, {"error": "Not a channel stream URL"})
+
+        headers = {'Content-Type': 'video/mp2t', 'Cache-Control': 'no-cache'}
+        if send.head:
+            # No need to start the channel for headers only
+            return await self._stream(receive, send, 200, headers, None)
+        channel = restream_hub.channel(url)
+        await self._stream(receive, send, 200, headers, channel.iter_chunks_async())
+
+    async def _viewer_manifest(self, url):
+        started = time.monotonic()
+        content = await self.manifest(url)
+        phase = 'master_manifest' if is_master_playlist(content) else 'media_manifest'
+        zap_timings.record(phase, time.monotonic() - started)
+        return content
+
+    async def _send_range(self, scope, receive, send, url, request_range):
+        headers = upstream_headers(url)
+        headers['Range'] = request_range
+        host = await upstream_limiter.acquire_async(url)
+        try:
+            resp = await self._get(url, headers)
+            if resp.status >= 400:
+                resp.release()
+                raise SegmentFetchError(f"Upstream returned {resp.status}", resp.status)
+        except BaseException:
+            upstream_limiter.release(host)
+            raise
+
+        kept = _kept_headers(resp.headers)
+        if 'Content-Range' in resp.headers:
+            kept['Content-Range'] = resp.headers['Content-Range']
+        try:
+            await self._stream(receive, send, resp.status, kept, self.iter_passthrough(resp))
+        finally:
+            # The body has ended or the client has gone
+            resp.close()
+            upstream_limiter.release(host)
+
+    async def _stream(self, receive, send, status, headers, chunks):
+        """Send a streamed body, cancelling it as soon as the client goes away"""
+        await send({
+            'type': 'http.response.start',
+            'status': status,
+            'headers': _encode_headers({
+                'Access-Control-Allow-Origin': '*',
+                'Cache-Control': 'public, max-age=3600',
+                **headers,
+            }),
+        })
+        if send.head:
+            if chunks is not None:
+                await chunks.aclose()
+            return await send({'type': 'http.response.body', 'body': b''})
+
+        async def pump():
+            try:
+                async for chunk in chunks:
+                    await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+                await send({'type': 'http.response.body', 'body': b'', 'more_body': False})
+            finally:
+                await chunks.aclose()
+
+        self._counters['streams_open'] += 1
+        body = asyncio.ensure_future(pump())
+        disconnect = asyncio.ensure_future(_wait_disconnect(receive))
+        try:
+            await asyncio.wait({body, disconnect}, return_when=asyncio.FIRST_COMPLETED)
+            if not body.done():
+                self._counters['disconnects'] += 1
+                body.cancel()
+            disconnect.cancel()
+            try:
+                await body
+            except asyncio.CancelledError:
+                pass
+        finally:
+            self._counters['streams_open'] -= 1
+
+class _ResponseSender:
+    """`send` of one request: records whether the response has started and drops the body of HEAD responses"""
+
+    def __init__(self, send, head=False):
+        self.send = send
+        self.head = head
+        self.started = False
+
+    async def __call__(self, message):
+        if message['type'] == 'http.response.start':
+            self.started = True
+        elif self.head:
+            message = {**message, 'body': b''}
+        await self.send(message)
+
+def _kept_headers(upstream):
+    headers = {h: upstream[h] for h in KEPT_HEADERS if h in upstream}
+    # aiohttp decodes Content-Encoding, so the upstream length no longer applies
+    if 'Content-Encoding' in upstream:
+        headers.pop('Content-Length', None)
+    return headers
+
+def _header(scope, name):
+    for key, value in scope.get('headers', []):
+        if key.lower() == name:
+            return value.decode('latin-1')
+    return None
+
+def _encode_headers(headers):
+    return [(k.lower().encode('latin-1'), str(v).encode('latin-1')) for k, v in headers.items()]
+
+async def _wait_disconnect(receive):
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return
+
+async def _send_body(send, status, body, content_type, extra=None):
+    headers = {'Content-Type': content_type, 'Content-Length': len(body), 'Access-Control-Allow-Origin': '*'}
+    headers.update(extra or {})
+    await send({'type': 'http.response.start', 'status': status, 'headers': _encode_headers(headers)})
+    await send({'type': 'http.response.body', 'body': body})
+
+async def _send_manifest(send, content):
+    await _send_body(send, 200, content.encode('utf-8'), 'application/vnd.apple.mpegurl',
+                     {'Cache-Control': 'no-cache'})
+
+async def _send_json(send, status, payload):
+    await _send_body(send, status, json.dumps(payload).encode('utf-8'), 'application/json')
+
+async def _send_error(send, status, error):
+    if send.started:
+        # Too late for an error response; returning without finishing the body
+        # makes the server close the connection, so the client sees it cut short
+        return
+    await _send_json(send, status, {"error": str(error)})
+
+class StreamProxyApp:
+    """ASGI app serving the proxy routes asynchronously and everything else through `fallback`"""
+
+    def __init__(self, fallback, flask_app=None):
+        self.fallback = fallback
+        self.proxy = AsyncStreamProxy(flask_app)
+        stats_providers['async_proxy'] = self.proxy.stats
+        stream_routes.channel_warmer = self.proxy.warm_blocking
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self._lifespan(receive, send)
+
+        if (scope['type'] == 'http' and scope['path'] in (MANIFEST_PATH, SEGMENT_PATH, RESTREAM_PATH)
+                and scope['method'] in ('GET', 'HEAD')):
+            return await self.proxy.handle(scope, receive, send)
+
+        await self.fallback(scope, receive, send)
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await self.proxy.startup()
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await self.proxy.shutdown()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
@@ -0,0 +1,184 @@
+"""
+Benchmark API latency while a large playlist refresh is writing.
+
+Reader threads page through /api/channels, load groups and search, and
+writer threads toggle favorites, first on an idle database and then while a
+refresh rewrites every channel of a large playlist. This runs once with
+database.create_sqlite_engine (WAL, pragmas, pooled connections) and once
+with the engine the app used to create (rollback journal, defaults), each on
+its own fresh database.
+
+Usage:
+    python backend/benchmarks/bench_db_concurrency.py [--channels 100000] [--readers 8] [--writers 2] [--think-ms 20]
+"""
+
+import argparse
+import contextlib
+import io
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+from flask import Flask
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import models.playlist as playlist_models
+from models.playlist import init_db, get_session, write_playlist_channels, Playlist
+from routes.channel_routes import channel_bp
+
+IDLE_SECONDS = 3
+
+def channels(count, generation):
+    for i in range(count):
+        yield {
+            'name': f'Channel {i} v{generation}',
+            'group_title': f'Group {i % 300}',
+            'tvg_id': f'ch{i}.example',
+            'tvg_name': f'Channel {i}',
+            'tvg_logo': f'http://logos.example.com/{i}.png',
+            'stream_url': f'http://provider.example.com/live/user/pass/{i}.ts',
+        }
+
+def make_app():
+    app = Flask(__name__)
+    app.secret_key = 'benchmark'
+    app.register_blueprint(channel_bp, url_prefix='/api/channels')
+    # Failed requests are counted as errors; their tracebacks would bury the report
+    app.logger.disabled = True
+    return app
+
+def logged_in_client(app):
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['user_id'] = 1
+    return client
+
+def setup_database(path, count, tuned):
+    with contextlib.redirect_stdout(io.StringIO()):
+        init_db(path)
+    session = get_session()
+    playlist = Playlist(name='Benchmark')
+    session.add(playlist)
+    session.commit()
+    playlist_id = playlist.id
+    session.close()
+    write_playlist_channels(playlist_id, channels(count, 0))
+
+    if not tuned:
+        # The previous setup: default engine on a rollback-journal database
+        playlist_models._engine.dispose()
+        conn = sqlite3.connect(path)
+        conn.execute("PRAGMA journal_mode=DELETE")
+        conn.close()
+        playlist_models._engine = create_engine(f"sqlite:///{path}")
+        playlist_models._SessionLocal = sessionmaker(bind=playlist_models._engine)
+    return playlist_id
+
+class Recorder:
+    def __init__(self):
+        self.samples = {}
+        self.errors = {}
+        self.lock = threading.Lock()
+
+    def add(self, kind, seconds, ok):
+        with self.lock:
+            self.samples.setdefault(kind, []).append(seconds * 1000)
+            self.errors[kind] = self.errors.get(kind, 0) + (not ok)
+
+    def report(self, label):
+        for kind, values in sorted(self.samples.items()):
+            values.sort()
+            p50 = values[len(values) // 2]
+            p95 = values[min(int(len(values) * 0.95), len(values) - 1)]
+            print(f"    {label:<8} {kind:<9} {len(values):6d} req  p50 {p50:8.1f} ms  "
+                  f"p95 {p95:8.1f} ms  max {values[-1]:8.1f} ms  errors {self.errors[kind]}")
+
+def reader(app, playlist_id, think, stop, recorder):
+    client = logged_in_client(app)
+    base = f'/api/channels?playlist_id={playlist_id}&limit=200&fields=id,name,tvg_logo,stream_url,is_favorite'
+    cursor = None
+    while not stop.is_set():
+        choice = random.random()
+        if choice < 0.7:
+            kind, url = 'page', base + (f'&cursor={cursor}' if cursor else '')
+        elif choice < 0.85:
+            kind, url = 'groups', f'/api/channels/groups?playlist_id={playlist_id}'
+        else:
+            kind, url = 'search', f'/api/channels/search?q=channel {random.randint(0, 9999)}&playlist_id={playlist_id}'
+        started = time.perf_counter()
+        response = client.get(url)
+        recorder.add(kind, time.perf_counter() - started, response.status_code == 200)
+        if kind == 'page':
+            cursor = response.headers.get('X-Next-Cursor') if response.status_code == 200 else None
+        time.sleep(think)
+
+def writer(app, count, stop, recorder):
+    client = logged_in_client(app)
+    while not stop.is_set():
+        started = time.perf_counter()
+        response = client.post(f'/api/channels/{random.randint(1, count)}/favorite')
+        recorder.add('favorite', time.perf_counter() - started, response.status_code == 200)
+        time.sleep(0.05)
+
+def run_load(app, playlist_id, count, args, duration=None, work=None):
+    """Run readers and writers for `duration` seconds or until `work()` returns"""
+    recorder = Recorder()
+    stop = threading.Event()
+    threads = [threading.Thread(target=reader, args=(app, playlist_id, args.think_ms / 1000, stop, recorder)) for _ in range(args.readers)]
+    threads += [threading.Thread(target=writer, args=(app, count, stop, recorder)) for _ in range(args.writers)]
+    for thread in threads:
+        thread.start()
+
+    started = time.perf_counter()
+    error = None
+    try:
+        if work is not None:
+            work()
+        else:
+            time.sleep(duration)
+    except Exception as e:
+        error = e
+    elapsed = time.perf_counter() - started
+
+    stop.set()
+    for thread in threads:
+        thread.join()
+    return recorder, elapsed, error
+
+def run(label, tuned, args):
+    path = os.path.join(tempfile.mkdtemp(), 'bench.db')
+    playlist_id = setup_database(path, args.channels, tuned)
+    app = make_app()
+    print(f"  {label}")
+
+    recorder, _, _ = run_load(app, playlist_id, args.channels, args, duration=IDLE_SECONDS)
+    recorder.report('idle')
+
+    refresh = lambda: write_playlist_channels(playlist_id, channels(args.channels, 1))
+    recorder, elapsed, error = run_load(app, playlist_id, args.channels, args, work=refresh)
+    recorder.report('refresh')
+    print(f"    refresh of {args.channels:,} channels: {elapsed:.1f} s" + (f" FAILED: {error}" if error else ""))
+
+    playlist_models._engine.dispose()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--channels', type=int, default=100000, help='channels in the refreshed playlist')
+    parser.add_argument('--readers', type=int, default=8, help='threads reading channel listings')
+    parser.add_argument('--think-ms', type=float, default=20, help='pause between requests of one reader')
+    parser.add_argument('--writers', type=int, default=2, help='threads toggling favorites')
+    args = parser.parse_args()
+
+    print(f"{args.channels:,} channels, {args.readers} readers, {args.writers} favorite writers")
+    run('create_sqlite_engine (WAL, pragmas, pool)', True, args)
+    run('default engine (rollback journal)', False, args)
+
+if __name__ == "__main__":
+    main()
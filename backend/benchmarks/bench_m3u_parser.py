@@ -0,0 +1,142 @@
+"""
+Benchmark M3U parsing throughput (lines/sec) on synthetic playlists.
+
+Compares the quote-split tokenizer used by M3UParser against frozen copies
+of the previous per-attribute regex implementations, including the separate
+parse_m3u the playlist ingest used to run. The old M3UParser also printed
+every channel, so it is timed with and without that print. Each timing is
+the best of --repeat runs.
+
+Usage:
+    python backend/benchmarks/bench_m3u_parser.py [--sizes 10000,100000,1000000] [--repeat 3]
+"""
+
+import argparse
+import contextlib
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from parsers.m3u_parser import M3UParser
+from models.playlist import CHANNEL_FIELDS
+
+def make_playlist(entries):
+    lines = ['#EXTM3U']
+    for i in range(entries):
+        lines.append(
+            f'#EXTINF:-1 tvg-id="ch{i}.uk" tvg-name="Channel {i}" tvg-chno="{i}" tvg-shift="0" '
+            f'tvg-logo="http://logos.example.com/{i}.png" group-title="Group {i % 50}" '
+            f'catchup="default" catchup-days="7",Channel {i} HD'
+        )
+        if i % 10 == 0:
+            lines.append('#EXTVLCOPT:http-user-agent=VLC/3.0')
+        lines.append(f'http://provider.example.com:8080/live/user/pass/{i}.ts')
+    return '\n'.join(lines) + '\n'
+
+def legacy_m3u_parser(content, log=True):
+    """M3UParser.parse before the quote-split tokenizer"""
+    patterns = {
+        'tvg-id': r'tvg-id="([^"]*)"',
+        'tvg-name': r'tvg-name="([^"]*)"',
+        'tvg-logo': r'tvg-logo="([^"]*)"',
+        'group-title': r'group-title="([^"]*)"',
+        'catchup': r'catchup="([^"]*)"',
+        'catchup-source': r'catchup-source="([^"]*)"',
+        'catchup-days': r'catchup-days="([^"]*)"'
+    }
+    channels = []
+    lines = content.strip().split('\n')
+    i = 0
+    while i < len(lines):
+        line = lines[i].strip()
+        if not line or (line.startswith('#') and not line.startswith('#EXTINF')):
+            i += 1
+            continue
+        if line.startswith('#EXTINF'):
+            channel = {'name': '', 'catchup_days': 0}
+            for key, pattern in patterns.items():
+                match = re.search(pattern, line, re.IGNORECASE)
+                if match:
+                    channel[key.replace('-', '_')] = match.group(1)
+            name_match = re.search(r',([^,]+)$', line)
+            if name_match:
+                channel['name'] = name_match.group(1).strip()
+            i += 1
+            while i < len(lines):
+                url_line = lines[i].strip()
+                if url_line and not url_line.startswith('#'):
+                    channel['stream_url'] = url_line
+                    channels.append(channel)
+                    if log:
+                        print(f"Parsed channel: {channel['name']}")
+                    break
+                i += 1
+        i += 1
+    return channels
+
+def legacy_parse_m3u(content):
+    """models.playlist.parse_m3u before the ingest went through M3UParser"""
+    channels = []
+    current_channel = {}
+    for line in content.split('\n'):
+        line = line.strip()
+        if line.startswith('#EXTINF:'):
+            current_channel = {}
+            for attr in ('tvg-id', 'tvg-name', 'tvg-logo', 'group-title'):
+                match = re.search(attr + r'="([^"]*)"', line)
+                if match:
+                    current_channel[attr.replace('-', '_')] = match.group(1)
+            name_part = line.split(',', 1)
+            if len(name_part) > 1:
+                current_channel['name'] = name_part[1].strip()
+        elif line and not line.startswith('#') and current_channel:
+            current_channel['stream_url'] = line
+            channels.append(current_channel)
+            current_channel = {}
+    return channels
+
+def ingest_rows(content):
+    """What the playlist refresh consumes: CHANNEL_FIELDS tuples"""
+    return list(M3UParser().iter_parse(content.split('\n'), fields=CHANNEL_FIELDS))
+
+def legacy_m3u_parser_quiet(content):
+    return legacy_m3u_parser(content, log=False)
+
+def run(label, func, content, line_count, repeat):
+    # Per-channel logging is part of the cost being measured, but not of the output
+    elapsed = float('inf')
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        for _ in range(repeat):
+            started = time.perf_counter()
+            channels = func(content)
+            elapsed = min(elapsed, time.perf_counter() - started)
+    print(f"  {label:<24} {elapsed:8.3f}s  {line_count / elapsed:>12,.0f} lines/s  ({len(channels)} channels)")
+    return elapsed
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', default='10000,100000,1000000',
+                        help='comma separated playlist sizes (entries)')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='runs per measurement; the fastest is reported')
+    args = parser.parse_args()
+
+    for size in (int(s) for s in args.sizes.split(',')):
+        content = make_playlist(size)
+        line_count = content.count('\n')
+        print(f"{size:,} entries / {line_count:,} lines / {len(content) / 1e6:.1f} MB")
+
+        legacy = run('legacy M3UParser', legacy_m3u_parser, content, line_count, args.repeat)
+        quiet = run('  without print', legacy_m3u_parser_quiet, content, line_count, args.repeat)
+        current = run('M3UParser', M3UParser().parse, content, line_count, args.repeat)
+        print(f"  {'speedup':<24} {legacy / current:8.2f}x  ({quiet / current:.2f}x without print)")
+
+        legacy = run('legacy parse_m3u', legacy_parse_m3u, content, line_count, args.repeat)
+        current = run('M3UParser (ingest rows)', ingest_rows, content, line_count, args.repeat)
+        print(f"  {'speedup':<24} {legacy / current:8.2f}x")
+
+if __name__ == "__main__":
+    main()
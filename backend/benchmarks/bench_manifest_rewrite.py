@@ -0,0 +1,107 @@
+"""
+Benchmark HLS playlist rewriting on long DVR/catchup style playlists.
+
+Compares manifest_rewriter against a frozen copy of the rewrite loop the
+stream routes used to run (urljoin and quote of the full URL per line, plus a
+log line per rewritten entry), on playlists with relative, root-relative and
+absolute segment URIs, key rotation and an init section.
+
+Usage:
+    python backend/benchmarks/bench_manifest_rewrite.py [--segments 5000,20000] [--repeat 20]
+"""
+
+import argparse
+import contextlib
+import os
+import sys
+import time
+from urllib.parse import urljoin
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from manifest_rewriter import ManifestRewriter, rewrite_manifest
+
+PLAYLIST_URL = 'http://provider.example.com:8080/timeshift/user/pass/120/2024-01-01:20-00/index.m3u8?token=abc'
+
+def make_playlist(segments, style):
+    lines = [
+        '#EXTM3U',
+        '#EXT-X-VERSION:7',
+        '#EXT-X-TARGETDURATION:6',
+        '#EXT-X-MEDIA-SEQUENCE:1000',
+        '#EXT-X-MAP:URI="init.mp4"',
+    ]
+    for i in range(segments):
+        if i % 100 == 0:
+            lines.append(f'#EXT-X-KEY:METHOD=AES-128,URI="keys/{i // 100}.key",IV=0x{i:032x}')
+        if i % 500 == 0:
+            lines.append(f'#EXT-X-PROGRAM-DATE-TIME:2024-01-01T20:{(i // 10) % 60:02d}:00.000Z')
+        lines.append('#EXTINF:6.000,')
+        if style == 'relative':
+            lines.append(f'segment_{1000 + i}.m4s')
+        elif style == 'root-relative':
+            lines.append(f'/hls/stream/120/segment_{1000 + i}.m4s?t=1704139200')
+        else:
+            lines.append(f'https://cdn{i % 4}.example.com/hls/120/segment_{1000 + i}.m4s')
+    lines.append('#EXT-X-ENDLIST')
+    return '\n'.join(lines) + '\n'
+
+def legacy_rewrite(content, url, log=True):
+    """routes/stream_routes.py rewrite loop before manifest_rewriter"""
+    base_url = url.rsplit('/', 1)[0] + '/'
+    new_lines = []
+    for line in content.split('\n'):
+        line = line.strip()
+        if line.startswith('#') or not line:
+            new_lines.append(line)
+            continue
+        if line.startswith('http://') or line.startswith('https://'):
+            absolute_url = line
+        else:
+            absolute_url = urljoin(base_url, line)
+        proxied_url = f"/hls-proxy/segment?url={requests.utils.quote(absolute_url, safe='')}"
+        new_lines.append(proxied_url)
+        if log:
+            print(f"[MANIFEST] Rewrite: {line} -> {proxied_url}")
+    return '\n'.join(new_lines)
+
+def legacy_rewrite_quiet(content, url):
+    """The same loop without the per-line log"""
+    return legacy_rewrite(content, url, log=False)
+
+def uncached_rewrite(content, url):
+    """manifest_rewriter without reusing the per-URL rewriter"""
+    return ManifestRewriter(url).rewrite(content)
+
+def run(label, func, content, repeat):
+    # Per-line logging is part of the legacy cost being measured, but not of the output
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        started = time.perf_counter()
+        for _ in range(repeat):
+            func(content, PLAYLIST_URL)
+        elapsed = (time.perf_counter() - started) / repeat
+    print(f"  {label:<28} {elapsed * 1000:8.2f} ms/playlist")
+    return elapsed
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--segments', default='5000,20000',
+                        help='comma separated playlist lengths (segments)')
+    parser.add_argument('--repeat', type=int, default=20, help='rewrites per measurement')
+    args = parser.parse_args()
+
+    for segments in (int(s) for s in args.segments.split(',')):
+        for style in ('relative', 'root-relative', 'absolute'):
+            content = make_playlist(segments, style)
+            print(f"{segments:,} segments, {style} URIs / {len(content) / 1e6:.2f} MB")
+
+            legacy = run('legacy (with log line)', legacy_rewrite, content, args.repeat)
+            run('legacy (no log line)', legacy_rewrite_quiet, content, args.repeat)
+            run('ManifestRewriter (new)', uncached_rewrite, content, args.repeat)
+            current = run('rewrite_manifest (cached)', rewrite_manifest, content, args.repeat)
+            print(f"  {'speedup':<28} {legacy / current:8.2f}x")
+
+if __name__ == "__main__":
+    main()
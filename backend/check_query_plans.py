@@ -0,0 +1,136 @@
+"""
+Check that the hot channel queries are served by indexes.
+
+Runs EXPLAIN QUERY PLAN for the queries behind the channel listing, search,
+group and favorite routes - built by the route code itself - and fails if one
+of them scans the channels table row by row, or sorts a paged listing instead
+of reading it in index order (which would make every page cost a full sort).
+
+Usage:
+    python backend/check_query_plans.py [database]
+
+Without a database a temporary one is created with the current schema and a
+synthetic playlist, so the planner sees realistic statistics. Exits with
+status 1 if a check fails.
+"""
+
+import os
+import re
+import sys
+import tempfile
+
+from sqlalchemy import select
+from sqlalchemy.dialects import sqlite
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from models.playlist import init_db, get_session, write_playlist_channels, Playlist, Channel
+from models.channel_search import ranked_search
+from routes.channel_routes import (
+    channel_filters, listing_query, count_query, groups_query, CHANNEL_COLUMNS, PAGE_KEY,
+)
+
+SYNTHETIC_CHANNELS = 20000
+
+# "SCAN channels" without an index is a row-by-row read of the whole table
+_FULL_SCAN_RE = re.compile(r'^SCAN (\w+)$')
+# Tables that grow with the playlists; small catalogues like channel_groups may be scanned
+LARGE_TABLES = {'channels', 'epg_channels', 'epg_programmes'}
+
+def populate(playlist_id, channels):
+    write_playlist_channels(playlist_id, (
+        {
+            'name': f'Channel {i}',
+            'group_title': f'Group {i % 200}',
+            'tvg_name': f'channel.{i}',
+            'stream_url': f'http://provider.example.com/live/{i}.ts',
+        }
+        for i in range(channels)
+    ))
+
+def hot_queries(playlist_id, group):
+    """(name, statement, paged) for the queries the channel routes run"""
+    fields = ['id', 'name', 'tvg_logo', 'stream_url', 'is_favorite']
+    columns = [CHANNEL_COLUMNS[f] for f in fields]
+    playlist = channel_filters({'playlist_id': playlist_id})
+    in_group = channel_filters({'playlist_id': playlist_id, 'group': group})
+    favorites = channel_filters({'favorites': 'true'})
+    searched = channel_filters({'playlist_id': playlist_id, 'search': 'channel 12'})
+    cursor = (playlist_id, 300, 300)
+
+    return [
+        ('listing, first page', listing_query(playlist, fields), True),
+        ('listing, next page', listing_query(playlist, fields, cursor, playlist_id), True),
+        ('group listing', listing_query(in_group, fields), True),
+        ('group listing, next page', listing_query(in_group, fields, cursor, playlist_id), True),
+        ('favorites', listing_query(favorites, fields), True),
+        ('favorites, next page', listing_query(favorites, fields, cursor), True),
+        ('favorites of a playlist', listing_query(playlist + favorites, fields), True),
+        # Matches come out of the full-text index by rowid and are sorted;
+        # the cost is bounded by the number of matches
+        ('search listing', listing_query(searched, fields), False),
+        ('playlist count', count_query(playlist), False),
+        ('group count', count_query(in_group), False),
+        ('groups of a playlist', groups_query(playlist_id), False),
+        ('groups of all playlists', groups_query(), False),
+        ('ranked search', ranked_search(columns, 'channel 12', playlist), False),
+        ('refresh diff', select(Channel.id, Channel.stream_url, Channel.content_hash, Channel.channel_number)
+            .where(Channel.playlist_id == playlist_id).order_by(*PAGE_KEY[1:]), True),
+    ]
+
+def query_plan(session, statement):
+    sql = str(statement.compile(dialect=sqlite.dialect(), compile_kwargs={'literal_binds': True}))
+    return [row[3] for row in session.connection().exec_driver_sql(f"EXPLAIN QUERY PLAN {sql}")]
+
+def problems(plan, paged):
+    found = []
+    for step in plan:
+        match = _FULL_SCAN_RE.match(step)
+        if match and match.group(1) in LARGE_TABLES:
+            found.append(f"full scan of {match.group(1)}")
+        if paged and step.startswith('USE TEMP B-TREE') and 'ORDER BY' in step:
+            found.append("sorts instead of reading in index order")
+    return found
+
+def main():
+    if len(sys.argv) > 1:
+        db_path = sys.argv[1]
+    else:
+        db_path = os.path.join(tempfile.mkdtemp(), 'plans.db')
+    synthetic = len(sys.argv) <= 1
+
+    init_db(db_path)
+    session = get_session()
+    try:
+        if synthetic:
+            playlist = Playlist(name='Query plan check')
+            session.add(playlist)
+            session.commit()
+            populate(playlist.id, SYNTHETIC_CHANNELS)
+            session.connection().exec_driver_sql("ANALYZE")
+
+        playlist_id = session.execute(select(Playlist.id).order_by(Playlist.id)).scalar() or 1
+        group = session.execute(
+            select(Channel.group_title).where(Channel.playlist_id == playlist_id).limit(1)
+        ).scalar() or ''
+
+        failures = 0
+        for name, statement, paged in hot_queries(playlist_id, group):
+            plan = query_plan(session, statement)
+            found = problems(plan, paged)
+            failures += bool(found)
+            print(f"{'FAIL' if found else 'ok  '} {name}")
+            for step in plan:
+                print(f"       {step}")
+            for problem in found:
+                print(f"       -> {problem}")
+    finally:
+        session.close()
+
+    if failures:
+        print(f"{failures} quer{'y' if failures == 1 else 'ies'} not served by an index")
+        sys.exit(1)
+    print("All hot queries use indexes")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""
+SQLite engine configuration.
+
+Every connection is set up the same way when it is opened:
+
+- WAL journal: readers keep reading while a playlist refresh or an EPG ingest
+  writes, and a writer does not wait for readers. (The journal mode is stored
+  in the database file; setting it again is a no-op.)
+- synchronous=NORMAL: with WAL this is still safe against corruption; only the
+  last transactions before a power loss may be rolled back.
+- busy_timeout: a writer that finds another write in progress waits for it
+  instead of failing with "database is locked".
+- A larger page cache and memory-mapped reads for the channel and guide tables.
+
+Connections are pooled and reused across requests (QueuePool), so this setup
+runs once per connection rather than per request. The pool is sized for the
+server's request threads (WSGI_THREADS in asgi.py) plus background jobs.
+"""
+
+import os
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.pool import QueuePool
+
+SQLITE_BUSY_TIMEOUT = float(os.environ.get("SQLITE_BUSY_TIMEOUT", 10))
+SQLITE_SYNCHRONOUS = os.environ.get("SQLITE_SYNCHRONOUS", "NORMAL")
+SQLITE_CACHE_MB = int(os.environ.get("SQLITE_CACHE_MB", 64))
+SQLITE_MMAP_MB = int(os.environ.get("SQLITE_MMAP_MB", 256))
+# Pooled connections per process, and extra ones opened under load
+DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", 32))
+DB_POOL_OVERFLOW = int(os.environ.get("DB_POOL_OVERFLOW", 8))
+
+SYNCHRONOUS_MODES = ("OFF", "NORMAL", "FULL", "EXTRA")
+
+def configure_connection(dbapi_connection, connection_record=None):
+    """Apply the journal mode and pragmas to a new SQLite connection"""
+    synchronous = SQLITE_SYNCHRONOUS.upper()
+    if synchronous not in SYNCHRONOUS_MODES:
+        synchronous = "NORMAL"
+
+    cursor = dbapi_connection.cursor()
+    try:
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute(f"PRAGMA synchronous={synchronous}")
+        cursor.execute(f"PRAGMA busy_timeout={int(SQLITE_BUSY_TIMEOUT * 1000)}")
+        # Negative sizes are in KiB
+        cursor.execute(f"PRAGMA cache_size=-{SQLITE_CACHE_MB * 1024}")
+        cursor.execute(f"PRAGMA mmap_size={SQLITE_MMAP_MB * 1024 * 1024}")
+    finally:
+        cursor.close()
+
+def create_sqlite_engine(db_path):
+    """Engine for the application database with pooled, configured connections"""
+    engine = create_engine(
+        f"sqlite:///{db_path}",
+        poolclass=QueuePool,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_POOL_OVERFLOW,
+        connect_args={
+            # Pooled connections move between request threads
+            "check_same_thread": False,
+            "timeout": SQLITE_BUSY_TIMEOUT,
+        },
+    )
+    event.listen(engine, "connect", configure_connection)
+    return engine
@@ -0,0 +1,99 @@
+"""
+Process-wide pooled HTTP client.
+
+Every outbound request (HLS proxy, playlist and EPG downloads, Xtream and
+Stalker APIs) goes through one requests.Session, so connections to a provider
+or CDN are kept alive and reused instead of paying a TCP + TLS handshake per
+segment. Connection pools are counted per host so reuse can be monitored.
+"""
+
+from collections import defaultdict
+from http.cookiejar import DefaultCookiePolicy
+import os
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.util.retry import Retry
+
+# Number of per-host pools kept around, and keep-alive connections per host
+HTTP_POOL_HOSTS = int(os.environ.get("HTTP_POOL_HOSTS", 32))
+HTTP_POOL_SIZE = int(os.environ.get("HTTP_POOL_SIZE", 16))
+# Connection attempts are retried with exponential backoff (0.3s, 0.6s, 1.2s, ...)
+HTTP_CONNECT_RETRIES = int(os.environ.get("HTTP_CONNECT_RETRIES", 3))
+HTTP_RETRY_BACKOFF = float(os.environ.get("HTTP_RETRY_BACKOFF", 0.3))
+
+_stats_lock = threading.Lock()
+_pool_stats = defaultdict(lambda: {'requests': 0, 'new_connections': 0})
+
+def _count(host, key):
+    with _stats_lock:
+        _pool_stats[host][key] += 1
+
+class _CountingPoolMixin:
+    """Counts connection checkouts and how many of them had to open a new socket"""
+
+    def _get_conn(self, timeout=None):
+        _count(self.host, 'requests')
+        return super()._get_conn(timeout)
+
+    def _new_conn(self):
+        _count(self.host, 'new_connections')
+        return super()._new_conn()
+
+class CountingHTTPConnectionPool(_CountingPoolMixin, HTTPConnectionPool):
+    pass
+
+class CountingHTTPSConnectionPool(_CountingPoolMixin, HTTPSConnectionPool):
+    pass
+
+class PooledAdapter(HTTPAdapter):
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': CountingHTTPConnectionPool,
+            'https': CountingHTTPSConnectionPool,
+        }
+
+def create_session():
+    """Build a session with keep-alive pools and connect retries"""
+    retry = Retry(
+        total=None,
+        connect=HTTP_CONNECT_RETRIES,
+        read=0,
+        status=0,
+        other=0,
+        backoff_factor=HTTP_RETRY_BACKOFF,
+    )
+    adapter = PooledAdapter(pool_connections=HTTP_POOL_HOSTS, pool_maxsize=HTTP_POOL_SIZE,
+                            max_retries=retry)
+
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    # The session is shared by every user and provider; never carry cookies between requests
+    session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+    return session
+
+http_session = create_session()
+
+def pool_stats():
+    """Connection reuse counters, overall and per upstream host"""
+    with _stats_lock:
+        hosts = {host: dict(counts) for host, counts in _pool_stats.items()}
+
+    for counts in hosts.values():
+        counts['reused'] = counts['requests'] - counts['new_connections']
+
+    total = sum(c['requests'] for c in hosts.values())
+    reused = sum(c['reused'] for c in hosts.values())
+    return {
+        'requests': total,
+        'pool_hits': reused,
+        'pool_misses': total - reused,
+        'hit_rate': round(reused / total, 3) if total else None,
+        'pool_size': HTTP_POOL_SIZE,
+        'max_hosts': HTTP_POOL_HOSTS,
+        'hosts': hosts,
+    }
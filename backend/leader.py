@@ -0,0 +1,69 @@
+"""
+Coordination between worker processes sharing one data directory.
+
+Production runs several server processes (see the Dockerfile). Work that must
+happen once per deployment - the background scheduler, database setup - is
+guarded by advisory file locks in the data directory. Where fcntl is not
+available (e.g. Windows development) every process simply acts as the leader.
+"""
+
+from contextlib import contextmanager
+import os
+import threading
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# How often a follower checks whether the leader has gone away
+LEADER_RETRY_SECONDS = int(os.environ.get("LEADER_RETRY_SECONDS", 30))
+
+# Lock files held for the lifetime of the process
+_held = []
+
+@contextmanager
+def file_lock(path):
+    """Hold an exclusive lock on `path` for the duration of the block (blocking)"""
+    with open(path, 'a') as f:
+        if fcntl:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+def _try_acquire(path):
+    f = open(path, 'a')
+    if fcntl:
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            f.close()
+            return False
+    # Keep the descriptor (and therefore the lock) until the process exits
+    _held.append(f)
+    return True
+
+def run_as_leader(path, start):
+    """Call `start()` in exactly one process holding the lock at `path`.
+
+    Processes that lose the race keep retrying in the background, so another
+    worker takes over if the leader exits. Returns True if this process leads.
+    """
+    if _try_acquire(path):
+        print(f"[LEADER] Process {os.getpid()} is the leader")
+        start()
+        return True
+
+    def wait_for_leadership():
+        stop = threading.Event()
+        while not stop.wait(LEADER_RETRY_SECONDS):
+            if _try_acquire(path):
+                print(f"[LEADER] Process {os.getpid()} took over as leader")
+                start()
+                return
+
+    threading.Thread(target=wait_for_leadership, daemon=True).start()
+    return False
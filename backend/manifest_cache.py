@@ -0,0 +1,156 @@
+"""
+Short-lived cache for proxied HLS playlists.
+
+Every hls.js client reloads a live media playlist once per target duration,
+so N viewers of a channel would otherwise cost N upstream fetches (and N
+rewrites) every few seconds. Rewritten playlists are cached per upstream URL
+for a TTL derived from #EXT-X-TARGETDURATION, and concurrent misses for the
+same URL share a single upstream fetch. The asyncio engine (async_proxy) uses
+the same cache through get_async().
+"""
+
+import asyncio
+from collections import OrderedDict
+import os
+import re
+import threading
+import time
+
+MANIFEST_CACHE_MAX_ENTRIES = int(os.environ.get("MANIFEST_CACHE_MAX_ENTRIES", 1000))
+# Master playlists and finished (VOD) playlists change rarely
+MANIFEST_STATIC_TTL = int(os.environ.get("MANIFEST_STATIC_TTL", 30))
+
+_TARGET_DURATION_RE = re.compile(r'#EXT-X-TARGETDURATION:\s*(\d+(?:\.\d+)?)')
+
+def manifest_ttl(content):
+    """Seconds a playlist stays fresh.
+
+    A live media playlist is cached for half its target duration, which is
+    how often the HLS spec lets a server update it; clients therefore never
+    see a playlist older than they would by polling the origin directly.
+    """
+    if '#EXT-X-ENDLIST' in content or '#EXT-X-STREAM-INF' in content:
+        return MANIFEST_STATIC_TTL
+
+    match = _TARGET_DURATION_RE.search(content)
+    if not match:
+        return 1.0
+    return max(float(match.group(1)) / 2, 0.5)
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.content = None
+        self.error = None
+
+class ManifestCache:
+    def __init__(self, max_entries=MANIFEST_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # url -> (expires_at, content)
+        self._inflight = {}
+        self._async_inflight = {}
+        self._lock = threading.Lock()
+        self._counters = {'hits': 0, 'misses': 0, 'coalesced': 0, 'errors': 0}
+
+    def get(self, url, fetch):
+        """Return the cached playlist for `url`, calling fetch() -> (content, ttl) on a miss.
+
+        Only one fetch per URL runs at a time; other callers wait for its result.
+        """
+        with self._lock:
+            content = self._lookup_locked(url)
+            if content is not None:
+                return content
+
+            flight = self._inflight.get(url)
+            leader = flight is None
+            if leader:
+                flight = self._inflight[url] = _Flight()
+                self._counters['misses'] += 1
+            else:
+                self._counters['coalesced'] += 1
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.content
+
+        try:
+            content, ttl = fetch()
+            flight.content = content
+            with self._lock:
+                self._store_locked(url, content, ttl)
+            return content
+
+        except Exception as e:
+            flight.error = e
+            with self._lock:
+                self._counters['errors'] += 1
+            raise
+
+        finally:
+            with self._lock:
+                self._inflight.pop(url, None)
+            flight.done.set()
+
+    async def get_async(self, url, fetch):
+        """get() for the event loop, where `fetch` is a coroutine function.
+
+        The fetch runs as its own task, so a caller that is cancelled (a
+        viewer going away) does not cancel it for the others waiting on it.
+        """
+        with self._lock:
+            content = self._lookup_locked(url)
+            if content is not None:
+                return content
+
+            flight = self._async_inflight.get(url)
+            if flight is None:
+                flight = self._async_inflight[url] = asyncio.ensure_future(self._fetch_async(url, fetch))
+                self._counters['misses'] += 1
+            else:
+                self._counters['coalesced'] += 1
+
+        return await asyncio.shield(flight)
+
+    async def _fetch_async(self, url, fetch):
+        try:
+            content, ttl = await fetch()
+            with self._lock:
+                self._store_locked(url, content, ttl)
+            return content
+
+        except Exception:
+            with self._lock:
+                self._counters['errors'] += 1
+            raise
+
+        finally:
+            with self._lock:
+                self._async_inflight.pop(url, None)
+
+    def _lookup_locked(self, url):
+        cached = self._entries.get(url)
+        if cached is None or cached[0] <= time.monotonic():
+            return None
+        self._entries.move_to_end(url)
+        self._counters['hits'] += 1
+        return cached[1]
+
+    def _store_locked(self, url, content, ttl):
+        self._entries[url] = (time.monotonic() + ttl, content)
+        self._entries.move_to_end(url)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            lookups = self._counters['hits'] + self._counters['coalesced'] + self._counters['misses']
+            return {
+                **self._counters,
+                'hit_rate': round((lookups - self._counters['misses']) / lookups, 3) if lookups else None,
+                'entries': len(self._entries),
+            }
+
+manifest_cache = ManifestCache()
@@ -0,0 +1,116 @@
+"""
+Rewriting of HLS playlists so everything the player fetches goes through the
+segment proxy.
+
+Besides segment and variant lines this covers the URI="..." attribute of
+tags naming a resource: encryption keys (#EXT-X-KEY), init sections
+(#EXT-X-MAP), alternate renditions (#EXT-X-MEDIA), I-frame playlists and
+low-latency parts. Left pointing upstream, those fail on CORS or referer
+checks even when the segments work.
+
+Entries of a playlist share a handful of directories (the playlist's own, a
+CDN's), so the proxied, quoted form of each directory is built once and kept
+with the rewriter for the playlist URL. An entry then costs one quote() of its
+file name instead of a urljoin and a quote of the whole URL; quoting with no
+safe characters works character by character, so the two halves can be quoted
+separately. DVR and catchup playlists run to thousands of entries and live
+ones are rewritten every few seconds.
+"""
+
+from functools import lru_cache
+import re
+from urllib.parse import quote, urljoin, urlsplit
+
+PROXY_SEGMENT_PREFIX = "/hls-proxy/segment?url="
+
+# Tags whose URI attribute names something the player fetches
+URI_TAGS = (
+    '#EXT-X-KEY', '#EXT-X-SESSION-KEY', '#EXT-X-MAP', '#EXT-X-MEDIA:',
+    '#EXT-X-I-FRAME-STREAM-INF', '#EXT-X-PART:', '#EXT-X-PRELOAD-HINT',
+    '#EXT-X-RENDITION-REPORT',
+)
+
+_URI_ATTR_RE = re.compile(r'URI="([^"]*)"')
+# Any URI scheme; only http(s) can be proxied (skd://, data: etc. are left alone)
+_SCHEME_RE = re.compile(r'[A-Za-z][A-Za-z0-9+.-]*:')
+# Quoted directory prefixes kept per rewriter
+MAX_DIRECTORY_PREFIXES = 64
+
+class ManifestRewriter:
+    """Rewrites playlists fetched from one upstream URL"""
+
+    def __init__(self, url):
+        parts = urlsplit(url)
+        self.url = url
+        self._origin = f"{parts.scheme}://{parts.netloc}"
+        self._directory = self._origin + parts.path.rsplit('/', 1)[0]
+        self._prefixes = {}
+
+    def proxied(self, uri):
+        """Proxy URL for a URI found in the playlist, or None if it cannot be proxied"""
+        if '/.' in uri or uri[0] in '.?#':
+            return self._joined(uri)
+
+        if uri.startswith(('http://', 'https://')):
+            return self._quoted(uri)
+
+        if uri[0] == '/':
+            if uri.startswith('//'):
+                return self._joined(uri)
+            return self._quoted(self._origin + uri)
+
+        if _SCHEME_RE.match(uri):
+            return None
+
+        # Plain relative path; a bare file name needs no splitting
+        if '/' not in uri:
+            return self._prefix(self._directory) + quote(uri, safe='')
+        return self._quoted(f"{self._directory}/{uri}")
+
+    def _joined(self, uri):
+        """Relative forms that need full RFC 3986 resolution (dot segments, query-only, ...)"""
+        absolute_url = urljoin(self.url, uri)
+        if not absolute_url.startswith(('http://', 'https://')):
+            return None
+        return self._quoted(absolute_url)
+
+    def _quoted(self, absolute_url):
+        directory, _, name = absolute_url.rpartition('/')
+        return self._prefix(directory) + quote(name, safe='')
+
+    def _prefix(self, directory):
+        prefix = self._prefixes.get(directory)
+        if prefix is None:
+            if len(self._prefixes) >= MAX_DIRECTORY_PREFIXES:
+                self._prefixes.clear()
+            prefix = self._prefixes[directory] = PROXY_SEGMENT_PREFIX + quote(directory + '/', safe='')
+        return prefix
+
+    def _proxied_attribute(self, match):
+        proxied = self.proxied(match.group(1)) if match.group(1) else None
+        return f'URI="{proxied}"' if proxied else match.group(0)
+
+    def rewrite(self, content):
+        new_lines = []
+        for line in content.split('\n'):
+            line = line.strip()
+
+            if not line:
+                new_lines.append(line)
+            elif line[0] == '#':
+                if line.startswith(URI_TAGS):
+                    line = _URI_ATTR_RE.sub(self._proxied_attribute, line)
+                new_lines.append(line)
+            else:
+                new_lines.append(self.proxied(line) or line)
+
+        return '\n'.join(new_lines)
+
+@lru_cache(maxsize=1024)
+def manifest_rewriter(url):
+    """Shared rewriter for a playlist URL; live playlists are rewritten again on every reload"""
+    return ManifestRewriter(url)
+
+def rewrite_manifest(content, url):
+    """Point every URI of a playlist fetched from `url` at our segment proxy"""
+    return manifest_rewriter(url).rewrite(content)
@@ -3,23 +3,46 @@ import os
 
 DB_PATH = os.environ.get("DATABASE_PATH", "./data/database.db")
 
-def migrate():
+# (table, column, DDL type) for columns added after the initial schema
+COLUMNS = [
+    ("playlists", "channel_count", "INTEGER DEFAULT 0"),
+    ("channels", "content_hash", "VARCHAR(40)"),
+    ("epg_sources", "etag", "VARCHAR(255)"),
+    ("epg_sources", "last_modified", "VARCHAR(255)"),
+    ("epg_sources", "generation", "INTEGER DEFAULT 0"),
+    ("epg_sources", "last_checked", "DATETIME"),
+    ("epg_sources", "last_accessed", "DATETIME"),
+    ("epg_sources", "last_refresh_duration", "FLOAT"),
+    ("epg_sources", "last_refresh_bytes", "INTEGER"),
+    ("epg_sources", "programme_count", "INTEGER DEFAULT 0"),
+    ("epg_sources", "evicted", "BOOLEAN DEFAULT 0"),
+    ("epg_sources", "priority", "INTEGER DEFAULT 0"),
+    ("epg_sources", "refresh_started", "DATETIME"),
+    ("epg_channels", "generation", "INTEGER DEFAULT 0"),
+    ("epg_programmes", "generation", "INTEGER DEFAULT 0"),
+]
+
+def migrate(db_path=DB_PATH):
     """Add missing columns to existing database"""
-    conn = sqlite3.connect(DB_PATH)
+    conn = sqlite3.connect(db_path)
     cursor = conn.cursor()
     
     try:
-        # Check if channel_count column exists
-        cursor.execute("PRAGMA table_info(playlists)")
-        columns = [col[1] for col in cursor.fetchall()]
-        
-        if 'channel_count' not in columns:
-            print("Adding channel_count column...")
-            cursor.execute("ALTER TABLE playlists ADD COLUMN channel_count INTEGER DEFAULT 0")
-            conn.commit()
-            print("✓ Added channel_count column")
+        added = 0
+        for table, column, ddl in COLUMNS:
+            cursor.execute(f"PRAGMA table_info({table})")
+            columns = [col[1] for col in cursor.fetchall()]
+            
+            # Tables that do not exist yet are created with the column by create_all
+            if columns and column not in columns:
+                print(f"Adding {table}.{column} column...")
+                cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}")
+                conn.commit()
+                print(f"✓ Added {table}.{column} column")
+                added += 1
         
-        print("✓ Database migration complete")
+        if added:
+            print("✓ Database migration complete")
         
     except Exception as e:
         print(f"Migration error: {e}")
@@ -0,0 +1,116 @@
+from sqlalchemy import text, select, table, column, literal_column, func, or_
+import re
+
+from models.playlist import Channel
+
+# Full-text index over the searchable channel columns. It is an external
+# content table: the text stays in `channels` and the index is kept in step by
+# triggers, so playlist ingest, channel deletes and playlist deletes all
+# maintain it without extra code. unicode61 folds case and, with
+# remove_diacritics, accents ("cafe" finds "Café"); the prefix indexes make
+# search-as-you-type prefixes of 2 and 3 characters cheap.
+FTS_TABLE = 'channels_fts'
+
+FTS_SCHEMA = [
+    f"""CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(
+        name, tvg_name, group_title,
+        content='channels', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+    )""",
+    f"""CREATE TRIGGER IF NOT EXISTS channels_fts_insert AFTER INSERT ON channels BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, name, tvg_name, group_title)
+        VALUES (new.id, new.name, new.tvg_name, new.group_title);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS channels_fts_delete AFTER DELETE ON channels BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, name, tvg_name, group_title)
+        VALUES ('delete', old.id, old.name, old.tvg_name, old.group_title);
+    END""",
+    # Refreshes rewrite unchanged names too; only real changes touch the index
+    f"""CREATE TRIGGER IF NOT EXISTS channels_fts_update AFTER UPDATE OF name, tvg_name, group_title ON channels
+    WHEN old.name IS NOT new.name OR old.tvg_name IS NOT new.tvg_name OR old.group_title IS NOT new.group_title
+    BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, name, tvg_name, group_title)
+        VALUES ('delete', old.id, old.name, old.tvg_name, old.group_title);
+        INSERT INTO {FTS_TABLE}(rowid, name, tvg_name, group_title)
+        VALUES (new.id, new.name, new.tvg_name, new.group_title);
+    END""",
+]
+
+# Lightweight handle for queries; the table itself is created by FTS_SCHEMA
+channels_fts = table(FTS_TABLE, column('rowid'), column('name'), column('tvg_name'), column('group_title'))
+
+# bm25 weights of name, tvg_name and group_title: a hit in the name counts most
+RANK_WEIGHTS = (10.0, 5.0, 1.0)
+
+# Upper bound for ranked search results in a single request
+MAX_SEARCH_RESULTS = 200
+
+# Whether this SQLite build has FTS5; set by init_channel_search
+fts_available = False
+
+def init_channel_search(engine):
+    """Create the full-text index and its triggers, indexing existing channels once"""
+    global fts_available
+
+    try:
+        with engine.begin() as conn:
+            exists = conn.execute(
+                text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"),
+                {"name": FTS_TABLE},
+            ).first()
+            for statement in FTS_SCHEMA:
+                conn.execute(text(statement))
+            if not exists:
+                print("Building channel search index...")
+                conn.execute(text(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')"))
+                print("✓ Channel search index built")
+        fts_available = True
+    except Exception as e:
+        # SQLite built without FTS5: search falls back to LIKE
+        print(f"Channel search index unavailable, using LIKE search: {e}")
+        fts_available = False
+
+    return fts_available
+
+def match_query(search):
+    """FTS5 query for user input: every word must match, the last one as a prefix.
+
+    Words are quoted, so FTS5 operators and punctuation in the input are
+    searched as text. Returns None if the input has no words.
+    """
+    words = re.findall(r'\w+', search)
+    if not words:
+        return None
+    terms = [f'"{word}"' for word in words[:-1]] + [f'"{words[-1]}"*']
+    return ' '.join(terms)
+
+def _matches(query):
+    return literal_column(FTS_TABLE).op('MATCH')(query)
+
+def _like_filter(search):
+    like = f"%{search}%"
+    return or_(Channel.name.like(like), Channel.tvg_name.like(like))
+
+def search_filter(search):
+    """WHERE clause on Channel selecting the channels matching `search`"""
+    query = match_query(search) if fts_available else None
+    if query is None:
+        return _like_filter(search)
+
+    return Channel.id.in_(select(channels_fts.c.rowid).where(_matches(query)))
+
+def ranked_search(columns, search, filters=(), limit=50):
+    """SELECT of `columns` for the best matches of `search`, best first"""
+    limit = min(max(limit, 1), MAX_SEARCH_RESULTS)
+    query = match_query(search) if fts_available else None
+    if query is None:
+        return select(*columns).where(_like_filter(search), *filters).order_by(Channel.playlist_id, Channel.channel_number).limit(limit)
+
+    return (
+        select(*columns)
+        .select_from(channels_fts)
+        .join(Channel, Channel.id == channels_fts.c.rowid)
+        .where(_matches(query), *filters)
+        .order_by(func.bm25(literal_column(FTS_TABLE), *RANK_WEIGHTS), Channel.channel_number)
+        .limit(limit)
+    )
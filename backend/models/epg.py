@@ -0,0 +1,559 @@
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Text, Index, select, insert, delete, update, func, or_
+from bisect import bisect_left
+from datetime import datetime, timedelta
+import os
+import threading
+import time
+
+from http_client import http_session
+from models.playlist import Base, EPGSource, get_session
+from parsers.xmltv_parser import XMLTVParser
+from parsers.streams import open_response_stream
+
+# Rows are flushed to SQLite in batches of this size while streaming a guide
+INGEST_BATCH_SIZE = 5000
+
+# Upper bound for bulk now/next lookups in a single request
+MAX_BULK_CHANNELS = 1000
+# Guide span merged to find a channel's next programme; widened when nothing starts in it
+NOW_NEXT_WINDOW = timedelta(hours=3)
+
+# Sources whose programmes have not been looked up for this long are evicted
+# from the store until one of their channels is requested again
+EPG_EVICT_AFTER_DAYS = int(os.environ.get("EPG_EVICT_AFTER_DAYS", 14))
+
+class EPGChannel(Base):
+    __tablename__ = 'epg_channels'
+
+    id = Column(Integer, primary_key=True)
+    source_id = Column(Integer, ForeignKey('epg_sources.id', ondelete='CASCADE'), nullable=False)
+    generation = Column(Integer, default=0, nullable=False)
+    channel_id = Column(String(255), nullable=False)
+    display_name = Column(String(255))
+    icon = Column(Text)
+
+    __table_args__ = (
+        Index('ix_epg_channels_source_channel', 'source_id', 'channel_id'),
+        Index('ix_epg_channels_channel', 'channel_id'),
+    )
+
+class EPGProgramme(Base):
+    __tablename__ = 'epg_programmes'
+
+    id = Column(Integer, primary_key=True)
+    source_id = Column(Integer, ForeignKey('epg_sources.id', ondelete='CASCADE'), nullable=False)
+    generation = Column(Integer, default=0, nullable=False)
+    channel = Column(String(255), nullable=False)
+    start = Column(DateTime, nullable=False)
+    stop = Column(DateTime, nullable=False)
+    title = Column(Text)
+    desc = Column(Text)
+    category = Column(Text)
+    icon = Column(Text)
+
+    __table_args__ = (
+        Index('ix_epg_programmes_channel_source_start', 'channel', 'source_id', 'generation', 'start'),
+        Index('ix_epg_programmes_source', 'source_id', 'generation'),
+    )
+
+# A refresh claim older than this is considered abandoned (e.g. the worker died)
+REFRESH_CLAIM_TIMEOUT = timedelta(hours=1)
+
+# Last lookup time per source in this process, flushed to EPGSource.last_accessed.
+# Request threads record lookups while another thread may be flushing.
+_access_times = {}
+_access_lock = threading.Lock()
+ACCESS_FLUSH_SECONDS = 300
+_last_access_flush = time.monotonic()
+
+def programme_to_dict(p):
+    """Serialize an EPGProgramme row for the API"""
+    return {
+        "channel": p.channel,
+        "start": p.start.isoformat() if p.start else None,
+        "stop": p.stop.isoformat() if p.stop else None,
+        "title": p.title,
+        "desc": p.desc,
+        "category": p.category,
+        "icon": p.icon,
+    }
+
+def source_to_dict(s):
+    """Serialize an EPGSource including its refresh statistics"""
+    return {
+        "id": s.id,
+        "name": s.name,
+        "url": s.url,
+        "enabled": s.enabled,
+        "priority": s.priority or 0,
+        "evicted": bool(s.evicted),
+        "last_updated": s.last_updated.isoformat() if s.last_updated else None,
+        "last_checked": s.last_checked.isoformat() if s.last_checked else None,
+        "last_accessed": s.last_accessed.isoformat() if s.last_accessed else None,
+        "last_refresh_duration": s.last_refresh_duration,
+        "last_refresh_bytes": s.last_refresh_bytes,
+        "programme_count": s.programme_count or 0,
+    }
+
+def ingest_xmltv(source_id: int, fileobj):
+    """Stream an XMLTV document into the on-disk EPG store for one source.
+
+    Rows are written under a new generation number in batched commits, so
+    readers are never blocked for the whole download. Once the document has
+    been parsed completely the source is switched to the new generation in one
+    small transaction and the previous rows are dropped; a failed download
+    leaves the old guide in place.
+    """
+    session = get_session()
+    parser = XMLTVParser()
+
+    try:
+        source = session.get(EPGSource, source_id)
+        if not source:
+            raise ValueError(f"EPG source {source_id} not found")
+
+        current = source.generation or 0
+        generation = current + 1
+
+        # Remove leftovers of an interrupted ingest
+        session.execute(delete(EPGProgramme).where(
+            EPGProgramme.source_id == source_id, EPGProgramme.generation != current))
+        session.execute(delete(EPGChannel).where(
+            EPGChannel.source_id == source_id, EPGChannel.generation != current))
+        session.commit()
+
+        programmes = []
+        channels = []
+        programme_count = 0
+        channel_count = 0
+
+        for kind, item in parser.iterparse(fileobj):
+            if kind == 'channel':
+                channels.append({
+                    'source_id': source_id,
+                    'generation': generation,
+                    'channel_id': item['id'],
+                    'display_name': item['display_name'],
+                    'icon': item['icon'],
+                })
+                if len(channels) >= INGEST_BATCH_SIZE:
+                    session.execute(insert(EPGChannel), channels)
+                    session.commit()
+                    channel_count += len(channels)
+                    channels = []
+                continue
+
+            # Programmes without a usable time range cannot be indexed
+            if not item['channel'] or item['start'] is None or item['stop'] is None:
+                continue
+
+            item['source_id'] = source_id
+            item['generation'] = generation
+            programmes.append(item)
+            if len(programmes) >= INGEST_BATCH_SIZE:
+                session.execute(insert(EPGProgramme), programmes)
+                session.commit()
+                programme_count += len(programmes)
+                programmes = []
+
+        if channels:
+            session.execute(insert(EPGChannel), channels)
+            channel_count += len(channels)
+        if programmes:
+            session.execute(insert(EPGProgramme), programmes)
+            programme_count += len(programmes)
+
+        # Atomic swap: readers only see rows of the source's current generation
+        session.execute(
+            update(EPGSource)
+            .where(EPGSource.id == source_id)
+            .values(
+                generation=generation,
+                last_updated=datetime.utcnow(),
+                programme_count=programme_count,
+                evicted=False,
+            )
+        )
+        session.commit()
+
+        session.execute(delete(EPGProgramme).where(
+            EPGProgramme.source_id == source_id, EPGProgramme.generation != generation))
+        session.execute(delete(EPGChannel).where(
+            EPGChannel.source_id == source_id, EPGChannel.generation != generation))
+        session.commit()
+
+        print(f"[EPG] Stored source {source_id}: {channel_count} channels, {programme_count} programmes")
+        return programme_count
+
+    except Exception as e:
+        session.rollback()
+        print(f"[EPG] Error ingesting source {source_id}: {e}")
+        raise e
+    finally:
+        session.close()
+
+def refresh_epg_source(source_id: int, force=False):
+    """Download an EPG source and stream it into the store.
+
+    Uses ETag / Last-Modified conditional requests unless `force` is set, and
+    transparently handles gzip/xz compressed guides. Returns True if a new
+    guide was stored, False if the source was unchanged or already refreshing.
+    """
+    if not _claim_refresh(source_id):
+        return False
+
+    session = get_session()
+    try:
+        source = session.get(EPGSource, source_id)
+        if not source:
+            return False
+
+        headers = {}
+        if not force and not source.evicted and source.generation:
+            if source.etag:
+                headers['If-None-Match'] = source.etag
+            if source.last_modified:
+                headers['If-Modified-Since'] = source.last_modified
+
+        started = time.monotonic()
+        response = http_session.get(source.url, headers=headers, stream=True, timeout=60)
+
+        try:
+            if response.status_code == 304:
+                source.last_checked = datetime.utcnow()
+                session.commit()
+                print(f"[EPG] Source '{source.name}' not modified")
+                return False
+
+            response.raise_for_status()
+            ingest_xmltv(source_id, open_response_stream(response))
+            received = response.raw.tell()
+        finally:
+            response.close()
+
+        # The ingest committed the new generation through its own session
+        session.expire(source)
+        source.etag = response.headers.get('ETag')
+        source.last_modified = response.headers.get('Last-Modified')
+        source.last_checked = datetime.utcnow()
+        source.last_refresh_duration = round(time.monotonic() - started, 3)
+        source.last_refresh_bytes = received
+        session.commit()
+
+        print(f"[EPG] Refreshed '{source.name}' in {source.last_refresh_duration}s ({received} bytes)")
+        return True
+
+    except Exception as e:
+        session.rollback()
+        raise e
+    finally:
+        session.close()
+        _release_refresh(source_id)
+
+def _claim_refresh(source_id):
+    """Atomically mark a source as refreshing, so the scheduler and on-demand
+    loads in any worker process never ingest the same source twice at once"""
+    now = datetime.utcnow()
+    session = get_session()
+    try:
+        result = session.execute(
+            update(EPGSource)
+            .where(EPGSource.id == source_id)
+            .where(or_(EPGSource.refresh_started == None,
+                       EPGSource.refresh_started < now - REFRESH_CLAIM_TIMEOUT))
+            .values(refresh_started=now)
+        )
+        session.commit()
+        return result.rowcount == 1
+    finally:
+        session.close()
+
+def _release_refresh(source_id):
+    session = get_session()
+    try:
+        session.execute(update(EPGSource).where(EPGSource.id == source_id).values(refresh_started=None))
+        session.commit()
+    except Exception as e:
+        session.rollback()
+        print(f"[EPG] Error releasing refresh of source {source_id}: {e}")
+    finally:
+        session.close()
+
+def refresh_epg_source_async(source_id: int, force=False):
+    """Refresh a source on a background thread (e.g. right after it was added)"""
+    def run():
+        try:
+            refresh_epg_source(source_id, force=force)
+        except Exception as e:
+            print(f"[EPG] Failed to refresh source {source_id}: {e}")
+
+    threading.Thread(target=run, daemon=True).start()
+
+def flush_access_times():
+    """Persist in-memory lookup times so eviction survives restarts.
+    
+    Each worker process keeps its own times; the stored value only moves forward.
+    """
+    global _last_access_flush
+    with _access_lock:
+        _last_access_flush = time.monotonic()
+        pending = dict(_access_times)
+        _access_times.clear()
+    if not pending:
+        return
+
+    session = get_session()
+    try:
+        for source_id, accessed in pending.items():
+            session.execute(
+                update(EPGSource)
+                .where(EPGSource.id == source_id)
+                .where(or_(EPGSource.last_accessed == None, EPGSource.last_accessed < accessed))
+                .values(last_accessed=accessed)
+            )
+        session.commit()
+    except Exception as e:
+        session.rollback()
+        print(f"[EPG] Error saving access times: {e}")
+    finally:
+        session.close()
+
+def evict_idle_sources(max_idle=None):
+    """Drop the programmes of sources nobody has looked up for `max_idle`.
+
+    The channel directory is kept, so a later lookup for one of the source's
+    channels brings the source back through a background refresh.
+    """
+    cutoff = datetime.utcnow() - (max_idle or timedelta(days=EPG_EVICT_AFTER_DAYS))
+    session = get_session()
+    try:
+        idle = session.query(EPGSource).filter(
+            EPGSource.evicted != True,
+            EPGSource.generation > 0,
+            func.coalesce(EPGSource.last_accessed, EPGSource.last_updated) < cutoff,
+        ).all()
+
+        for source in idle:
+            session.execute(delete(EPGProgramme).where(EPGProgramme.source_id == source.id))
+            source.evicted = True
+            source.programme_count = 0
+            print(f"[EPG] Evicted idle source '{source.name}'")
+
+        session.commit()
+        return len(idle)
+    except Exception as e:
+        session.rollback()
+        print(f"[EPG] Error evicting sources: {e}")
+        return 0
+    finally:
+        session.close()
+
+def refresh_all_epg_sources():
+    """Scheduler job: refresh every enabled, non-evicted source"""
+    flush_access_times()
+    evict_idle_sources()
+
+    session = get_session()
+    try:
+        source_ids = [s.id for s in session.query(EPGSource).filter(
+            EPGSource.enabled == True,
+            EPGSource.evicted != True,
+        ).all()]
+    finally:
+        session.close()
+
+    for source_id in source_ids:
+        try:
+            refresh_epg_source(source_id)
+        except Exception as e:
+            print(f"[EPG] Failed to refresh source {source_id}: {e}")
+
+def _reload_evicted_for(channel_id):
+    """Schedule a refresh of evicted sources that provide `channel_id`"""
+    session = get_session()
+    try:
+        source_ids = session.scalars(
+            select(EPGChannel.source_id)
+            .join(EPGSource, EPGSource.id == EPGChannel.source_id)
+            .where(
+                EPGChannel.channel_id == channel_id,
+                EPGSource.evicted == True,
+                EPGSource.enabled == True,
+            )
+            .distinct()
+        ).all()
+    finally:
+        session.close()
+
+    for source_id in source_ids:
+        refresh_epg_source_async(source_id)
+
+def _touch(programmes):
+    now = datetime.utcnow()
+    with _access_lock:
+        for p in programmes:
+            if p is not None:
+                _access_times[p.source_id] = now
+        due = time.monotonic() - _last_access_flush > ACCESS_FLUSH_SECONDS
+    
+    # Only the leader process runs the scheduler; other workers flush as they go
+    if due:
+        flush_access_times()
+
+def _active_sources(session):
+    """(id, generation) of published, enabled sources in merge priority order.
+
+    Lower `priority` values win; ties are broken by id so the order is stable.
+    """
+    return session.execute(
+        select(EPGSource.id, EPGSource.generation)
+        .where(EPGSource.enabled == True, EPGSource.generation > 0, EPGSource.evicted != True)
+        .order_by(EPGSource.priority, EPGSource.id)
+    ).all()
+
+def _source_stmt(channel_id, source_id, generation):
+    # Every lookup is an exact seek on the (channel, source, generation, start) index
+    return select(EPGProgramme).where(
+        EPGProgramme.channel == channel_id,
+        EPGProgramme.source_id == source_id,
+        EPGProgramme.generation == generation,
+    )
+
+def merge_programmes(ranked):
+    """Merge per-source programme lists into one de-duplicated timeline.
+
+    `ranked` holds one start-ordered list per source, best source first. A
+    programme is kept unless it overlaps a programme already taken from a
+    higher priority source, so lower priority sources only fill the gaps.
+    """
+    starts, stops, merged = [], [], []
+
+    for progs in ranked:
+        for p in progs:
+            pos = bisect_left(starts, p.start)
+            if pos > 0 and stops[pos - 1] > p.start:
+                continue
+            if pos < len(starts) and starts[pos] < p.stop:
+                continue
+            starts.insert(pos, p.start)
+            stops.insert(pos, p.stop)
+            merged.insert(pos, p)
+
+    return merged
+
+def _source_window(session, channel_id, source_id, generation, start_time, end_time):
+    """One source's programmes overlapping [start_time, end_time], ordered by start"""
+    base = _source_stmt(channel_id, source_id, generation)
+    # Start the range scan at the programme airing at start_time
+    first_start = session.scalar(
+        base.with_only_columns(func.max(EPGProgramme.start))
+        .where(EPGProgramme.start <= start_time)
+    )
+    return session.scalars(
+        base.where(
+            EPGProgramme.start >= (first_start or start_time),
+            EPGProgramme.start <= end_time,
+            EPGProgramme.stop >= start_time,
+        )
+        .order_by(EPGProgramme.start)
+    ).all()
+
+def _window(session, sources, channel_id, start_time, end_time):
+    """Merged programmes overlapping [start_time, end_time], as merging the whole guide would keep them.
+
+    Whether a programme survives depends on the higher priority programmes
+    overlapping it, which may reach outside the window. Sources are read
+    lowest priority first, each over the span of everything read so far.
+    """
+    ranked = []
+    lo, hi = start_time, end_time
+    for source_id, generation in reversed(sources):
+        progs = _source_window(session, channel_id, source_id, generation, lo, hi)
+        if progs:
+            lo = min(lo, progs[0].start)
+            hi = max(hi, max(p.stop for p in progs))
+        ranked.append(progs)
+    ranked.reverse()
+
+    return [p for p in merge_programmes(ranked) if p.start <= end_time and p.stop >= start_time]
+
+def _next_start(session, sources, channel_id, after):
+    """Earliest programme start after `after` in any source, or None"""
+    starts = [
+        session.scalar(
+            _source_stmt(channel_id, source_id, generation)
+            .with_only_columns(func.min(EPGProgramme.start))
+            .where(EPGProgramme.start > after)
+        )
+        for source_id, generation in sources
+    ]
+    return min((s for s in starts if s is not None), default=None)
+
+def _now_next(session, sources, channel_id, at):
+    """Programme airing at `at` and the one after it, both from the merged timeline.
+
+    A lower priority source's programme only counts where merge_programmes
+    would keep it, so the window starting at `at` is merged and widened
+    until a programme starts in it or no source has anything later.
+    """
+    end = at + NOW_NEXT_WINDOW
+    while True:
+        merged = _window(session, sources, channel_id, at, end)
+        current = next((p for p in merged if p.start <= at < p.stop), None)
+        upcoming = next((p for p in merged if p.start > at), None)
+        if upcoming is not None:
+            return current, upcoming
+
+        later = _next_start(session, sources, channel_id, end)
+        if later is None:
+            return current, None
+        end = later + NOW_NEXT_WINDOW
+
+def get_programmes(channel_id, start_time, end_time):
+    """Merged programmes of a channel overlapping [start_time, end_time], ordered by start"""
+    session = get_session()
+    try:
+        progs = _window(session, _active_sources(session), channel_id, start_time, end_time)
+    finally:
+        session.close()
+
+    if not progs:
+        _reload_evicted_for(channel_id)
+    _touch(progs)
+    return [programme_to_dict(p) for p in progs]
+
+def get_current_programme(channel_id, at=None):
+    """Programme airing on a channel at `at` (defaults to now), or None"""
+    at = at or datetime.utcnow()
+    session = get_session()
+    try:
+        current, _ = _now_next(session, _active_sources(session), channel_id, at)
+    finally:
+        session.close()
+
+    if current is None:
+        _reload_evicted_for(channel_id)
+    _touch([current])
+    return programme_to_dict(current) if current else None
+
+def get_now_next(channel_ids, at=None):
+    """Current and next programme for many channels using one session.
+
+    Returns {channel_id: {"now": dict|None, "next": dict|None}}. Each lookup is
+    an index seek per source, so the cost is O(len(channel_ids) * sources * log n).
+    """
+    at = at or datetime.utcnow()
+    session = get_session()
+    try:
+        sources = _active_sources(session)
+        result = {}
+        for channel_id in channel_ids:
+            current, upcoming = _now_next(session, sources, channel_id, at)
+            _touch([current, upcoming])
+            result[channel_id] = {
+                "now": programme_to_dict(current) if current else None,
+                "next": programme_to_dict(upcoming) if upcoming else None,
+            }
+        return result
+    finally:
+        session.close()
@@ -1,9 +1,23 @@
-from sqlalchemy import create_engine, Column, Integer, String, Boolean, DateTime, ForeignKey, Text
+from sqlalchemy import Column, Integer, String, Boolean, DateTime, ForeignKey, Text, Float, Index, text
+from sqlalchemy import MetaData, Table, select, insert, update, delete, func, literal
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, relationship
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-import requests
-import re
+from urllib.parse import urlparse
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+
+from database import create_sqlite_engine
+from http_client import http_session
+from parsers.m3u_parser import M3UParser
+from parsers.xtream_parser import XtreamParser, xtream_from_export_url
+from parsers.stalker_parser import StalkerParser
 
 Base = declarative_base()
 
@@ -26,6 +40,7 @@ class Playlist(Base):
     last_updated = Column(DateTime)
     
     channels = relationship("Channel", back_populates="playlist", cascade="all, delete-orphan")
+    groups = relationship("ChannelGroup", cascade="all, delete-orphan")
 
 class Channel(Base):
     __tablename__ = 'channels'
@@ -43,8 +58,37 @@ class Channel(Base):
     catchup_days = Column(Integer)
     is_favorite = Column(Boolean, default=False)
     channel_number = Column(Integer)
+    # Digest of the parsed entry, used to skip unchanged rows on refresh
+    content_hash = Column(String(40))
     
     playlist = relationship("Playlist", back_populates="channels")
+    
+    # Channel queries are scoped to a playlist and read in listing order
+    # (channel_number, id), which every index ends with so keyset pages can
+    # seek to their cursor; check_query_plans.py verifies the routes use them
+    __table_args__ = (
+        # Listings and their pages, refresh diffs
+        Index('ix_channels_playlist_number', 'playlist_id', 'channel_number', 'id'),
+        # Group listings, group names and counts of a playlist
+        Index('ix_channels_playlist_group', 'playlist_id', 'group_title', 'channel_number', 'id'),
+        # Favorites are few; a partial index keeps it small
+        Index('ix_channels_favorites', 'playlist_id', 'channel_number', 'id', sqlite_where=text('is_favorite = 1')),
+    )
+
+class ChannelGroup(Base):
+    """Group catalogue of a playlist, rebuilt from its channels when they change"""
+    __tablename__ = 'channel_groups'
+    
+    id = Column(Integer, primary_key=True)
+    playlist_id = Column(Integer, ForeignKey('playlists.id', ondelete='CASCADE'), nullable=False)
+    name = Column(String(255), nullable=False)
+    channel_count = Column(Integer, nullable=False, default=0)
+    # Channel number of the group's first channel, i.e. playlist order
+    sort_order = Column(Integer, nullable=False, default=0)
+    
+    __table_args__ = (
+        Index('ix_channel_groups_playlist_order', 'playlist_id', 'sort_order'),
+    )
 
 class EPGSource(Base):
     __tablename__ = 'epg_sources'
@@ -53,8 +97,31 @@ class EPGSource(Base):
     name = Column(String(255), nullable=False)
     url = Column(Text, nullable=False)
     enabled = Column(Boolean, default=True)
+    # Merge order when several sources describe the same channel (lowest first)
+    priority = Column(Integer, default=0)
     last_updated = Column(DateTime)
     created_at = Column(DateTime, default=datetime.utcnow)
+    
+    # Refresh bookkeeping for the background EPG scheduler
+    etag = Column(String(255))
+    last_modified = Column(String(255))
+    generation = Column(Integer, default=0)
+    last_checked = Column(DateTime)
+    last_accessed = Column(DateTime)
+    last_refresh_duration = Column(Float)
+    last_refresh_bytes = Column(Integer)
+    programme_count = Column(Integer, default=0)
+    evicted = Column(Boolean, default=False)
+    # Set while a worker process is downloading the source
+    refresh_started = Column(DateTime)
+
+class AppState(Base):
+    """Small JSON values shared by all worker processes"""
+    __tablename__ = 'app_state'
+    
+    key = Column(String(100), primary_key=True)
+    value = Column(Text)
+    updated_at = Column(DateTime, default=datetime.utcnow)
 
 # Global engine and session
 _engine = None
@@ -64,12 +131,29 @@ def init_db(db_path: str):
     """Initialize database with all tables"""
     global _engine, _SessionLocal
     
-    _engine = create_engine(f"sqlite:///{db_path}")
+    # WAL, pragmas and a connection pool sized for the request threads
+    _engine = create_sqlite_engine(db_path)
     _SessionLocal = sessionmaker(bind=_engine)
     
+    # Register the EPG store and recording tables on the shared metadata
+    import models.epg
+    import models.recording
+    
     # Create all tables
     Base.metadata.create_all(_engine)
     
+    # Add columns introduced after the tables were first created
+    from migrate_db import migrate
+    migrate(db_path)
+    
+    # Indexes and versioned upgrades
+    from schema import upgrade
+    upgrade(_engine)
+    
+    # Full-text channel search index, built on first start
+    from models.channel_search import init_channel_search
+    init_channel_search(_engine)
+    
     # Import User model and create its table
     try:
         from models.user import User, Base as UserBase
@@ -106,47 +190,25 @@ def get_session():
         raise RuntimeError("Database not initialized. Call init_db() first.")
     return _SessionLocal()
 
-def parse_m3u(content: str):
-    """Parse M3U/M3U8 content"""
-    channels = []
-    lines = content.split('\n')
-    
-    current_channel = {}
-    
-    for line in lines:
-        line = line.strip()
-        
-        if line.startswith('#EXTINF:'):
-            # Parse EXTINF line
-            current_channel = {}
-            
-            # Extract attributes
-            tvg_id_match = re.search(r'tvg-id="([^"]*)"', line)
-            tvg_name_match = re.search(r'tvg-name="([^"]*)"', line)
-            tvg_logo_match = re.search(r'tvg-logo="([^"]*)"', line)
-            group_match = re.search(r'group-title="([^"]*)"', line)
-            
-            if tvg_id_match:
-                current_channel['tvg_id'] = tvg_id_match.group(1)
-            if tvg_name_match:
-                current_channel['tvg_name'] = tvg_name_match.group(1)
-            if tvg_logo_match:
-                current_channel['tvg_logo'] = tvg_logo_match.group(1)
-            if group_match:
-                current_channel['group_title'] = group_match.group(1)
-            
-            # Extract channel name (after last comma)
-            name_part = line.split(',', 1)
-            if len(name_part) > 1:
-                current_channel['name'] = name_part[1].strip()
-            
-        elif line and not line.startswith('#') and current_channel:
-            # This is the stream URL
-            current_channel['stream_url'] = line
-            channels.append(current_channel)
-            current_channel = {}
-    
-    return channels
+def set_app_state(key, value):
+    """Store a JSON-serializable value visible to every worker process"""
+    session = get_session()
+    try:
+        session.merge(AppState(key=key, value=json.dumps(value), updated_at=datetime.utcnow()))
+        session.commit()
+    except Exception as e:
+        session.rollback()
+        raise e
+    finally:
+        session.close()
+
+def get_app_state(key, default=None):
+    session = get_session()
+    try:
+        state = session.get(AppState, key)
+        return json.loads(state.value) if state and state.value else default
+    finally:
+        session.close()
 
 def add_playlist(name, playlist_type, source_type, source_url=None, file_path=None, 
                 user_agent=None, xtream_username=None, xtream_password=None, 
@@ -202,87 +264,370 @@ def delete_playlist_by_id(playlist_id: int):
     finally:
         session.close()
 
-def update_playlist_channels(playlist):
-    """Update channels for a playlist"""
+# Parsed fields stored on a Channel row; their digest decides whether a row changed
+CHANNEL_FIELDS = (
+    'name', 'group_title', 'tvg_id', 'tvg_name', 'tvg_logo',
+    'stream_url', 'catchup', 'catchup_source', 'catchup_days',
+)
+
+# Rows per executemany / IN (...) statement during a refresh
+WRITE_BATCH_SIZE = 5000
+DELETE_BATCH_SIZE = 500
+
+# Columns a refresh writes for a new or changed channel
+PENDING_FIELDS = CHANNEL_FIELDS + ('channel_number', 'content_hash')
+
+# Per-connection spool for the new and changed channels of a refresh; id is
+# the row to update, NULL for a new channel
+_pending_channels = Table(
+    'pending_channels', MetaData(),
+    Column('id', Integer),
+    *(Column(name, Channel.__table__.c[name].type) for name in PENDING_FIELDS),
+    prefixes=['TEMPORARY'],
+)
+
+def channel_hash(values):
+    """Stable digest of the stored fields of a parsed channel, in CHANNEL_FIELDS order"""
+    text = '\x1f'.join('' if v is None else str(v) for v in values)
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+def refresh_channel_groups(session, playlist_ids):
+    """Rebuild the group catalogue of playlists from their channels.
+
+    Runs in the transaction of `session` (or a Connection), so the catalogue
+    changes together with the channels.
+    """
+    for playlist_id in set(playlist_ids):
+        session.execute(delete(ChannelGroup).where(ChannelGroup.playlist_id == playlist_id))
+        session.execute(insert(ChannelGroup).from_select(
+            ['playlist_id', 'name', 'channel_count', 'sort_order'],
+            select(Channel.playlist_id, Channel.group_title, func.count(), func.min(Channel.channel_number))
+            .where(Channel.playlist_id == playlist_id, Channel.group_title != '')
+            .group_by(Channel.group_title)
+        ))
+
+def write_playlist_channels(playlist_id, parsed_channels):
+    """Apply parsed channels to a playlist as a diff, in one transaction.
+
+    `parsed_channels` may be any iterable of channel dicts or of tuples in
+    CHANNEL_FIELDS order, including a generator streaming from the source
+    (see M3UParser.iter_parse); new and changed rows are spooled every WRITE_BATCH_SIZE
+    entries, so memory is bounded by the batch rather than the playlist.
+    Rows are matched on stream URL (and occurrence, for duplicated URLs), so
+    channel ids and favorites of unchanged channels survive the refresh. Only
+    new, changed and vanished entries are written.
+    
+    The spool is a TEMP table, which does not lock the database: parsing and
+    diffing run while other requests keep writing (favorites, EPG), and the
+    database write lock is held only for the few set-based statements that
+    apply the spool at the end.
+    """
     session = get_session()
     
     try:
-        # Get playlist content
-        if playlist.source_type == 'url' and playlist.source_url:
-            headers = {}
-            if playlist.user_agent:
-                headers['User-Agent'] = playlist.user_agent
-            
-            response = requests.get(playlist.source_url, headers=headers, timeout=30)
-            content = response.text
-            
-        elif playlist.source_type == 'file' and playlist.file_path:
-            with open(playlist.file_path, 'r', encoding='utf-8') as f:
-                content = f.read()
-        else:
-            raise ValueError("No valid source for playlist")
+        existing = session.execute(
+            select(Channel.id, Channel.stream_url, Channel.content_hash, Channel.channel_number)
+            .where(Channel.playlist_id == playlist_id)
+            .order_by(Channel.channel_number, Channel.id)
+        ).all()
         
-        # Parse channels
-        parsed_channels = parse_m3u(content)
+        occurrences = Counter()
+        by_key = {}
+        for row in existing:
+            key = (row.stream_url, occurrences[row.stream_url])
+            occurrences[row.stream_url] += 1
+            by_key[key] = (row.id, row.content_hash, row.channel_number)
+        del existing
         
-        # Store favorite status before deleting channels
-        # Use stream_url as the primary key for matching channels
-        old_channels = session.query(Channel).filter_by(playlist_id=playlist.id).all()
-        favorites_map = {}
-        for old_ch in old_channels:
-            if old_ch.is_favorite and old_ch.stream_url:
-                favorites_map[old_ch.stream_url] = True
+        # A failed refresh may have left its spool on this pooled connection
+        session.execute(text("DROP TABLE IF EXISTS temp.pending_channels"))
+        _pending_channels.create(session.connection())
         
-        # Delete old channels
-        session.query(Channel).filter_by(playlist_id=playlist.id).delete()
+        pending = []
+        inserted = updated = channel_count = 0
+        occurrences = Counter()
         
-        # Add new channels, restoring favorite status
-        for idx, ch_data in enumerate(parsed_channels, start=1):
-            stream_url = ch_data.get('stream_url', '')
-            is_favorite = favorites_map.get(stream_url, False)
+        for number, ch_data in enumerate(parsed_channels, start=1):
+            if not isinstance(ch_data, tuple):
+                ch_data = tuple(ch_data.get(f) for f in CHANNEL_FIELDS)
+            row = dict(zip(CHANNEL_FIELDS, ch_data))
+            row['name'] = row['name'] or 'Unknown'
+            row['stream_url'] = row['stream_url'] or ''
+            row['channel_number'] = number
+            row['content_hash'] = channel_hash(row[f] for f in CHANNEL_FIELDS)
+            channel_count = number
+            
+            key = (row['stream_url'], occurrences[row['stream_url']])
+            occurrences[row['stream_url']] += 1
             
-            channel = Channel(
-                playlist_id=playlist.id,
-                name=ch_data.get('name', 'Unknown'),
-                group_title=ch_data.get('group_title'),
-                tvg_id=ch_data.get('tvg_id'),
-                tvg_name=ch_data.get('tvg_name'),
-                tvg_logo=ch_data.get('tvg_logo'),
-                stream_url=stream_url,
-                channel_number=idx,
-                is_favorite=is_favorite
+            old = by_key.pop(key, None)
+            if old is None:
+                row['id'] = None
+                inserted += 1
+            elif old[1] != row['content_hash'] or old[2] != number:
+                row['id'] = old[0]
+                updated += 1
+            else:
+                continue
+            
+            pending.append(row)
+            if len(pending) >= WRITE_BATCH_SIZE:
+                session.execute(insert(_pending_channels), pending)
+                pending = []
+        
+        if pending:
+            session.execute(insert(_pending_channels), pending)
+            pending = []
+        
+        # Apply the spool; from here on the refresh holds the write lock
+        spooled = _pending_channels.c
+        if updated:
+            session.execute(
+                update(Channel)
+                .where(Channel.id == spooled.id)
+                .values({name: spooled[name] for name in PENDING_FIELDS})
+                .execution_options(synchronize_session=False)
             )
-            session.add(channel)
+        if inserted:
+            session.execute(insert(Channel).from_select(
+                ['playlist_id', *PENDING_FIELDS],
+                select(literal(playlist_id), *(spooled[name] for name in PENDING_FIELDS))
+                .where(spooled.id.is_(None))
+                .order_by(spooled.channel_number)
+            ))
         
-        # Update playlist
-        playlist.channel_count = len(parsed_channels)
-        playlist.last_updated = datetime.utcnow()
+        stale_ids = [old[0] for old in by_key.values()]
+        for i in range(0, len(stale_ids), DELETE_BATCH_SIZE):
+            batch = stale_ids[i:i + DELETE_BATCH_SIZE]
+            session.execute(delete(Channel).where(Channel.id.in_(batch)))
         
-        session.commit()
+        if inserted or updated or stale_ids:
+            refresh_channel_groups(session, [playlist_id])
+        
+        session.execute(
+            update(Playlist)
+            .where(Playlist.id == playlist_id)
+            .values(channel_count=channel_count, last_updated=datetime.utcnow())
+        )
+        _pending_channels.drop(session.connection())
         
-        favorites_count = sum(1 for ch in parsed_channels if favorites_map.get(ch.get('stream_url', ''), False))
-        print(f"Updated playlist '{playlist.name}' with {len(parsed_channels)} channels ({favorites_count} favorites preserved)")
+        session.commit()
         
+        return {
+            'channels': channel_count,
+            'inserted': inserted,
+            'updated': updated,
+            'deleted': len(stale_ids),
+            'unchanged': channel_count - inserted - updated,
+        }
+    
     except Exception as e:
         session.rollback()
-        print(f"Error updating playlist channels: {e}")
         raise e
     finally:
         session.close()
 
+# Scheduled refresh: playlists are downloaded and parsed in parallel, at most
+# PLAYLIST_UPDATE_PER_HOST at a time against one provider host
+PLAYLIST_UPDATE_WORKERS = int(os.environ.get("PLAYLIST_UPDATE_WORKERS", 4))
+PLAYLIST_UPDATE_PER_HOST = int(os.environ.get("PLAYLIST_UPDATE_PER_HOST", 1))
+
+# SQLite has a single writer; the DB write phase of refreshes is serialized
+_write_lock = threading.Lock()
+
+# AppState key holding the per-playlist timings of the last update_all_playlists run
+UPDATE_REPORT_KEY = 'playlist_update_report'
+
+# Chunk size used when spooling a playlist download to disk
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+
+# Pages requested in parallel from a Stalker portal during a refresh
+STALKER_PAGE_WORKERS = int(os.environ.get("STALKER_PAGE_WORKERS", 4))
+
+# Refresh M3U playlists that are Xtream get.php exports through the much smaller
+# player API. Opt-in: panels format export stream URLs differently, and channels
+# are matched on stream URL, so a format change replaces every channel on the
+# next refresh (new ids, favorites lost)
+XTREAM_EXPORT_VIA_API = os.environ.get("XTREAM_EXPORT_VIA_API", "false").lower() == "true"
+
+def _json_api_parser(playlist):
+    """Parser for playlists served by a JSON API (Xtream / Stalker), or None for M3U"""
+    if playlist.playlist_type == 'xtream':
+        return XtreamParser(playlist.source_url, playlist.xtream_username, playlist.xtream_password,
+                            user_agent=playlist.user_agent)
+    if playlist.playlist_type == 'stalker':
+        return StalkerParser(playlist.source_url, playlist.stalker_mac, workers=STALKER_PAGE_WORKERS)
+    if playlist.source_type == 'url' and XTREAM_EXPORT_VIA_API:
+        return xtream_from_export_url(playlist.source_url, user_agent=playlist.user_agent)
+    return None
+
+def _spool_rows(channels):
+    """Write parsed channels as CHANNEL_FIELDS JSON lines to a temporary file"""
+    fd, path = tempfile.mkstemp(prefix='playlist-', suffix='.jsonl')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as out:
+            for ch in channels:
+                out.write(json.dumps([ch.get(f) for f in CHANNEL_FIELDS]))
+                out.write('\n')
+    except Exception:
+        os.remove(path)
+        raise
+    return path
+
+def fetch_playlist_source(playlist):
+    """Make a playlist's content available as a local file.
+    
+    URL sources are streamed to a temporary file chunk by chunk, so the
+    download never sits in memory and can run outside the write lock.
+    Xtream and Stalker playlists are read from their JSON APIs and spooled
+    as parsed rows. Returns (path, format, bytes, is_temporary), where format
+    is 'm3u' or 'rows'.
+    """
+    parser = _json_api_parser(playlist)
+    if parser is not None:
+        try:
+            path = _spool_rows(parser.iter_channels() if isinstance(parser, StalkerParser)
+                               else parser.iter_live_streams())
+            return path, 'rows', parser.bytes_received, True
+        except Exception as e:
+            if playlist.playlist_type in ('xtream', 'stalker'):
+                raise
+            print(f"Xtream API unavailable for '{playlist.name}', downloading the M3U export: {e}")
+    
+    if playlist.source_type == 'url' and playlist.source_url:
+        headers = {}
+        if playlist.user_agent:
+            headers['User-Agent'] = playlist.user_agent
+            
+        size = 0
+        fd, path = tempfile.mkstemp(prefix='playlist-', suffix='.m3u')
+        try:
+            with http_session.get(playlist.source_url, headers=headers, stream=True, timeout=30) as response:
+                response.raise_for_status()
+                with os.fdopen(fd, 'wb') as out:
+                    for chunk in response.iter_content(DOWNLOAD_CHUNK_SIZE):
+                        out.write(chunk)
+                        size += len(chunk)
+        except Exception:
+            os.remove(path)
+            raise
+        return path, 'm3u', size, True
+        
+    elif playlist.source_type == 'file' and playlist.file_path:
+        return playlist.file_path, 'm3u', os.path.getsize(playlist.file_path), False
+    
+    raise ValueError("No valid source for playlist")
+        
+def iter_playlist_file(path, fmt='m3u'):
+    """Stream CHANNEL_FIELDS tuples out of a fetched playlist source"""
+    if fmt == 'rows':
+        return _iter_spooled_rows(path)
+    # Possibly gzip/xz compressed M3U
+    return M3UParser().iter_parse_file(path, fields=CHANNEL_FIELDS)
+
+def _iter_spooled_rows(path):
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            yield tuple(json.loads(line))
+
+def _discard_source(path, is_temporary):
+    if is_temporary:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        
+def update_playlist_channels(playlist):
+    """Update channels for a playlist"""
+    try:
+        path, fmt, _, is_temporary = fetch_playlist_source(playlist)
+        try:
+            with _write_lock:
+                stats = write_playlist_channels(playlist.id, iter_playlist_file(path, fmt))
+        finally:
+            _discard_source(path, is_temporary)
+        
+        # Keep the caller's object in sync with what was stored
+        playlist.channel_count = stats['channels']
+        playlist.last_updated = datetime.utcnow()
+        
+        print(f"Updated playlist '{playlist.name}' with {stats['channels']} channels "
+              f"({stats['inserted']} new, {stats['updated']} changed, {stats['deleted']} removed)")
+        return stats
+    
+    except Exception as e:
+        print(f"Error updating playlist channels: {e}")
+        raise e
+
+def _playlist_host(playlist):
+    if playlist.source_type == 'url' and playlist.source_url:
+        return urlparse(playlist.source_url).hostname or playlist.source_url
+    return 'local'
+
+def _refresh_one(playlist, host_limits):
+    """Fetch, parse and store one playlist, returning its report entry"""
+    report = {
+        'playlist_id': playlist.id,
+        'name': playlist.name,
+        'host': _playlist_host(playlist),
+        'status': 'ok',
+    }
+    started = time.monotonic()
+    
+    try:
+        with host_limits[report['host']]:
+            fetch_started = time.monotonic()
+            path, fmt, size, is_temporary = fetch_playlist_source(playlist)
+        report['wait_seconds'] = round(fetch_started - started, 3)
+        report['fetch_seconds'] = round(time.monotonic() - fetch_started, 3)
+        report['bytes'] = size
+        
+        try:
+            write_started = time.monotonic()
+            with _write_lock:
+                report.update(write_playlist_channels(playlist.id, iter_playlist_file(path, fmt)))
+            report['write_seconds'] = round(time.monotonic() - write_started, 3)
+        finally:
+            _discard_source(path, is_temporary)
+    
+    except Exception as e:
+        report['status'] = 'error'
+        report['error'] = str(e)
+        print(f"Failed to update playlist {playlist.name}: {e}")
+    
+    report['total_seconds'] = round(time.monotonic() - started, 3)
+    return report
+
 def update_all_playlists(config):
-    """Update all playlists that have auto_update enabled"""
+    """Update all playlists that have auto_update enabled.
+    
+    Downloads run concurrently on a worker pool with a per-host limit; only
+    the database write phase is serialized. Returns a per-playlist report.
+    """
     session = get_session()
     
     try:
         playlists = session.query(Playlist).filter_by(auto_update=True).all()
-        
-        for playlist in playlists:
-            try:
-                print(f"Auto-updating playlist: {playlist.name}")
-                update_playlist_channels(playlist)
-            except Exception as e:
-                print(f"Failed to update playlist {playlist.name}: {e}")
-        
     finally:
         session.close()
+    
+    if not playlists:
+        return []
+    
+    host_limits = {
+        host: threading.BoundedSemaphore(PLAYLIST_UPDATE_PER_HOST)
+        for host in {_playlist_host(p) for p in playlists}
+    }
+    
+    print(f"Auto-updating {len(playlists)} playlists with {PLAYLIST_UPDATE_WORKERS} workers")
+    with ThreadPoolExecutor(max_workers=PLAYLIST_UPDATE_WORKERS) as pool:
+        report = list(pool.map(lambda p: _refresh_one(p, host_limits), playlists))
+    
+    report.sort(key=lambda r: r['total_seconds'], reverse=True)
+    for entry in report:
+        print(f"  {entry['name']} [{entry['host']}]: {entry['status']} in {entry['total_seconds']}s "
+              f"(fetch {entry.get('fetch_seconds', '-')}s, write {entry.get('write_seconds', '-')}s, "
+              f"{entry.get('bytes', 0)} bytes, {entry.get('channels', 0)} channels)")
+    
+    set_app_state(UPDATE_REPORT_KEY, report)
+    return report
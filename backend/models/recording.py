@@ -0,0 +1,33 @@
+from sqlalchemy import Column, Integer, String, DateTime, Text
+from datetime import datetime
+
+from models.playlist import Base
+
+class Recording(Base):
+    """An ffmpeg recording job.
+
+    Kept in the database rather than in process memory so every worker
+    process can list and stop recordings started by any other one.
+    """
+    __tablename__ = 'recordings'
+
+    id = Column(String(255), primary_key=True)
+    channel_name = Column(String(255))
+    stream_url = Column(Text)
+    filename = Column(String(255))
+    output_path = Column(Text)
+    duration = Column(Integer)
+    pid = Column(Integer)
+    status = Column(String(20), default='recording')
+    started_at = Column(DateTime, default=datetime.utcnow)
+    finished_at = Column(DateTime)
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "channel": self.channel_name,
+            "filename": self.filename,
+            "status": self.status,
+            "started_at": self.started_at.isoformat() if self.started_at else None,
+            "duration": self.duration,
+        }
@@ -1,6 +1,77 @@
+import os
 import re
-import requests
-from urllib.parse import urljoin
+from operator import itemgetter
+
+from http_client import http_session
+from parsers.streams import open_decompressed, open_response_stream, iter_text_lines
+
+# Every key="value" attribute of an #EXTINF line, matched in a single scan
+_ATTR_RE = re.compile(r'\s([\w-]+)="([^"]*)"')
+_DURATION_RE = re.compile(r'\s*([^\s,]*)')
+# Duration and attributes: everything up to the first comma outside quotes
+_HEAD_RE = re.compile(r'[^,"]*(?:"[^"]*"[^,"]*)*')
+# Attribute key as written before its quoted value
+_ATTR_KEY_RE = re.compile(r'\s([\w-]+)=$')
+
+# Text between two quoted values (' tvg-logo=', '-1 tvg-id=') -> lower-cased
+# attribute key, or '' if it does not end in one; playlists repeat a handful
+_attr_keys = {}
+ATTR_KEY_CACHE_SIZE = 4096
+
+def _attr_key(raw):
+    match = _ATTR_KEY_RE.search(raw)
+    key = match.group(1).lower() if match else ''
+    if len(_attr_keys) < ATTR_KEY_CACHE_SIZE:
+        _attr_keys[raw] = key
+    return key
+
+def parse_extinf(line):
+    """Tokenize an #EXTINF line into (duration, attributes, name).
+    
+    All key="value" pairs before the name, known or not (tvg-chno,
+    tvg-shift, ...), are collected; keys are lower-cased. The name is the
+    text after the first comma that follows them, so commas inside quoted
+    values and commas or quotes inside the name itself are kept.
+    """
+    body = line[line.find(':') + 1:]
+    return (_DURATION_RE.match(body).group(1),) + _extinf_attrs(body)
+
+def _extinf_attrs(body):
+    """(attributes, name) of the #EXTINF text after the colon"""
+    # Usual shape: balanced quotes, and the only comma outside them starts the
+    # name. Splitting on quotes then alternates keys and values, which is much
+    # cheaper than a regex scan of the line.
+    parts = body.split('"')
+    outside = parts[0:-1:2]
+    tail = parts[-1]
+    comma = tail.find(',')
+    if len(parts) % 2 and comma != -1 and ',' not in ''.join(outside):
+        attrs = dict(zip(map(_attr_keys.get, outside), parts[1::2]))
+        if None in attrs:
+            attrs = dict(zip(map(_attr_key, outside), parts[1::2]))
+        attrs.pop('', None)
+        return attrs, tail[comma + 1:].strip()
+    
+    # Quotes in the name, unbalanced quotes or no name at all
+    end = _HEAD_RE.match(body).end()
+    attrs = {key.lower(): value for key, value in _ATTR_RE.findall(body, 0, end)}
+    
+    comma = body.find(',', end)
+    name = body[comma + 1:].strip() if comma != -1 else ''
+    
+    return attrs, name
+
+# Channel keys a row can take straight from the #EXTINF attributes
+_ROW_ATTRS = {
+    'tvg_id': 'tvg-id',
+    'tvg_name': 'tvg-name',
+    'tvg_logo': 'tvg-logo',
+    'group_title': 'group-title',
+    'catchup': 'catchup',
+    'catchup_source': 'catchup-source',
+    'catchup_days': 'catchup-days',
+}
+_ROW_DEFAULTS = {**{key: '' for key in _ROW_ATTRS.values()}, 'catchup-days': 0}
 
 class M3UParser:
     def __init__(self, user_agent=None):
@@ -17,118 +88,152 @@ class M3UParser:
         lines = content.strip().split('\n')
         print(f"Parsing M3U file with {len(lines)} lines")
         
-        i = 0
-        while i < len(lines):
-            line = lines[i].strip()
+        channels = list(self.iter_parse(lines))
+        
+        print(f"Total channels parsed: {len(channels)}")
+        return channels
+    
+    def iter_parse(self, lines, fields=None):
+        """Yield channel dictionaries from any iterable of lines.
+        
+        Works on a list, an open text file or a streamed HTTP body, so callers
+        can consume channels incrementally without holding the playlist.
+        When `fields` (a sequence of channel keys) is given, each channel is
+        yielded as a tuple of those values instead, ready for bulk inserts.
+        """
+        if fields and all(f in _ROW_ATTRS or f in ('name', 'stream_url') for f in fields):
+            return self._iter_rows(lines, fields)
+        return self._iter_channels(lines, fields)
+    
+    def _iter_rows(self, lines, fields):
+        """iter_parse for fields that are all attributes, name or URL: rows are
+        read from the attribute dict without building a channel dict first"""
+        output = self._row_getter([_ROW_ATTRS.get(f, f) for f in fields])
+        attrs = None
+        for line in lines:
+            line = line.strip()
+            if not line:
+                continue
             
-            # Skip empty lines and comments that aren't EXTINF
-            if not line or (line.startswith('#') and not line.startswith('#EXTINF')):
-                i += 1
+            if line[0] == '#':
+                if line.startswith('#EXTINF'):
+                    attrs, name = _extinf_attrs(line[line.find(':') + 1:])
+                elif attrs is not None and line.startswith('#EXTGRP:') and not attrs.get('group-title'):
+                    attrs['group-title'] = line[8:].strip()
                 continue
             
-            if line.startswith('#EXTINF'):
-                try:
+            if attrs is not None:
+                name = name or attrs.get('tvg-name', '')
+                if name:
+                    catchup_days = attrs.get('catchup-days')
+                    if catchup_days is not None:
+                        try:
+                            attrs['catchup-days'] = int(catchup_days) if catchup_days else 0
+                        except ValueError:
+                            attrs['catchup-days'] = 0
+                    row = {**_ROW_DEFAULTS, **attrs}
+                    row['name'] = name
+                    row['stream_url'] = line
+                    yield output(row)
+                attrs = None
+    
+    def _iter_channels(self, lines, fields):
+        output = self._row_getter(fields)
+        channel = None
+        for line in lines:
+            line = line.strip()
+            if not line:
+                continue
+            
+            if line[0] == '#':
+                if line.startswith('#EXTINF'):
                     channel = self._parse_extinf_line(line)
+                elif channel is not None:
+                    self._apply_directive(channel, line)
+                continue
                     
-                    # Move to next non-comment line to get the URL
-                    i += 1
-                    while i < len(lines):
-                        url_line = lines[i].strip()
-                        if url_line and not url_line.startswith('#'):
-                            channel['stream_url'] = url_line
-                            if channel.get('name') and channel.get('stream_url'):
-                                channels.append(channel)
-                                print(f"Parsed channel: {channel['name']}")
-                            else:
-                                print(f"Skipped incomplete channel: {channel}")
-                            break
-                        i += 1
-                except Exception as e:
-                    print(f"Error parsing line {i}: {line[:100]} - {e}")
-                    
-            i += 1
-        
-        print(f"Total channels parsed: {len(channels)}")
-        return channels
+            # First non-comment line after #EXTINF is the stream URL
+            if channel is not None:
+                if channel['name']:
+                    channel['stream_url'] = line
+                    yield output(channel) if output else channel
+                channel = None
+    
+    @staticmethod
+    def _row_getter(fields):
+        if not fields:
+            return None
+        if len(fields) == 1:
+            return lambda channel: (channel[fields[0]],)
+        return itemgetter(*fields)
     
     def _parse_extinf_line(self, line):
         """Parse a single #EXTINF line and extract metadata"""
-        channel = {
-            'name': '',
-            'tvg_id': '',
-            'tvg_name': '',
-            'tvg_logo': '',
-            'group_title': '',
-            'catchup': '',
-            'catchup_source': '',
-            'catchup_days': 0
-        }
+        duration, attrs, name = parse_extinf(line)
         
-        # Define patterns for common M3U attributes
-        patterns = {
-            'tvg-id': r'tvg-id="([^"]*)"',
-            'tvg-name': r'tvg-name="([^"]*)"',
-            'tvg-logo': r'tvg-logo="([^"]*)"',
-            'group-title': r'group-title="([^"]*)"',
-            'catchup': r'catchup="([^"]*)"',
-            'catchup-source': r'catchup-source="([^"]*)"',
-            'catchup-days': r'catchup-days="([^"]*)"'
+        channel = {
+            'name': name or attrs.get('tvg-name', ''),
+            'tvg_id': attrs.pop('tvg-id', ''),
+            'tvg_name': attrs.pop('tvg-name', ''),
+            'tvg_logo': attrs.pop('tvg-logo', ''),
+            'group_title': attrs.pop('group-title', ''),
+            'catchup': attrs.pop('catchup', ''),
+            'catchup_source': attrs.pop('catchup-source', ''),
+            'catchup_days': 0,
+            'duration': duration,
+            # Remaining attributes (tvg-chno, tvg-shift, ...) are kept verbatim
+            'attrs': attrs,
         }
         
-        # Extract attributes
-        for key, pattern in patterns.items():
-            match = re.search(pattern, line, re.IGNORECASE)
-            if match:
-                field_name = key.replace('-', '_')
-                channel[field_name] = match.group(1)
-        
-        # Extract channel name (everything after the last comma)
-        # Format: #EXTINF:-1 tvg-id="..." tvg-name="..." ...,Channel Name
-        name_match = re.search(r',([^,]+)$', line)
-        if name_match:
-            channel['name'] = name_match.group(1).strip()
-        else:
-            # Fallback: try to get anything after EXTINF:-1 or EXTINF:0
-            fallback = re.search(r'#EXTINF:[^,]*,(.+)$', line)
-            if fallback:
-                channel['name'] = fallback.group(1).strip()
-        
-        # Convert catchup_days to integer
-        if channel['catchup_days']:
+        catchup_days = attrs.pop('catchup-days', '')
+        if catchup_days:
             try:
-                channel['catchup_days'] = int(channel['catchup_days'])
-            except (ValueError, TypeError):
+                channel['catchup_days'] = int(catchup_days)
+            except ValueError:
                 channel['catchup_days'] = 0
         
         return channel
     
+    def _apply_directive(self, channel, line):
+        """Fold #EXTGRP / #EXTVLCOPT lines between #EXTINF and the URL into the channel"""
+        if line.startswith('#EXTGRP:'):
+            if not channel['group_title']:
+                channel['group_title'] = line[8:].strip()
+        elif line.startswith('#EXTVLCOPT:'):
+            key, _, value = line[11:].partition('=')
+            channel.setdefault('vlc_opts', {})[key.strip()] = value.strip()
+    
+    def iter_parse_url(self, url, fields=None):
+        """Stream an M3U (optionally gzip/xz compressed) from a URL, yielding channels"""
+        headers = {'User-Agent': self.user_agent}
+        response = http_session.get(url, headers=headers, stream=True, timeout=30)
+        
+        try:
+            response.raise_for_status()
+            yield from self.iter_parse(iter_text_lines(open_response_stream(response)), fields)
+        finally:
+            response.close()
+    
+    def iter_parse_file(self, file_path, fields=None):
+        """Stream an M3U (optionally gzip/xz compressed) file, yielding channels"""
+        with open(file_path, 'rb') as f:
+            yield from self.iter_parse(iter_text_lines(open_decompressed(f)), fields)
+    
     def parse_from_url(self, url):
         """Download and parse M3U from URL"""
         print(f"Downloading M3U from: {url}")
-        headers = {'User-Agent': self.user_agent}
-        response = requests.get(url, headers=headers, timeout=30)
-        response.raise_for_status()
-        return self.parse(response.text)
+        channels = list(self.iter_parse_url(url))
+        print(f"Total channels parsed: {len(channels)}")
+        return channels
     
     def parse_from_file(self, file_path):
         """Parse M3U file with encoding tolerance"""
         print(f"Reading M3U file: {file_path}")
         
-        # Try multiple encodings
-        encodings = ['utf-8', 'latin-1', 'iso-8859-1', 'cp1252']
-        content = None
+        if not os.path.isfile(file_path):
+            raise ValueError(f"Could not read file {file_path}")
         
-        for encoding in encodings:
-            try:
-                with open(file_path, 'r', encoding=encoding) as f:
-                    content = f.read()
-                print(f"Successfully read file with {encoding} encoding")
-                break
-            except (UnicodeDecodeError, FileNotFoundError) as e:
-                print(f"Failed to read with {encoding}: {e}")
-                continue
-        
-        if content is None:
-            raise ValueError(f"Could not read file {file_path} with any supported encoding")
-        
-        return self.parse(content)
+        # Lines are decoded one by one with a UTF-8 -> cp1252 -> latin-1 fallback
+        channels = list(self.iter_parse_file(file_path))
+        print(f"Total channels parsed: {len(channels)}")
+        return channels
@@ -1,13 +1,17 @@
-import requests
 import hashlib
 import time
 import random
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from http_client import http_session
 
 class StalkerParser:
-    def __init__(self, portal_url, mac_address):
+    def __init__(self, portal_url, mac_address, workers=4):
         self.portal_url = portal_url.rstrip('/')
         self.mac_address = mac_address
         self.token = None
+        self.workers = workers
+        self.bytes_received = 0
     
     def _get_token(self):
         headers = {
@@ -17,26 +21,28 @@ class StalkerParser:
         }
         
         url = f"{self.portal_url}/portal.php?type=stb&action=handshake&token=&JsHttpRequest=1-xml"
-        response = requests.get(url, headers=headers, timeout=30)
+        response = http_session.get(url, headers=headers, timeout=30)
         response.raise_for_status()
         
         data = response.json()
         self.token = data.get('js', {}).get('token', '')
         return self.token
     
-    def get_genres(self):
-        if not self.token:
-            self._get_token()
-        
-        headers = {
+    def _headers(self):
+        return {
             'User-Agent': 'Mozilla/5.0 (QtEmbedded; U; Linux; C) AppleWebKit/533.3 (KHTML, like Gecko) MAG200 stbapp ver: 2 rev: 250 Safari/533.3',
             'Authorization': f'Bearer {self.token}',
             'Cookie': f'mac={self.mac_address}'
         }
         
+    def get_genres(self):
+        if not self.token:
+            self._get_token()
+        
         url = f"{self.portal_url}/portal.php?type=itv&action=get_genres&JsHttpRequest=1-xml"
-        response = requests.get(url, headers=headers, timeout=30)
+        response = http_session.get(url, headers=self._headers(), timeout=30)
         response.raise_for_status()
+        self.bytes_received += len(response.content)
         
         return response.json()
     
@@ -44,14 +50,8 @@ class StalkerParser:
         if not self.token:
             self._get_token()
         
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (QtEmbedded; U; Linux; C) AppleWebKit/533.3 (KHTML, like Gecko) MAG200 stbapp ver: 2 rev: 250 Safari/533.3',
-            'Authorization': f'Bearer {self.token}',
-            'Cookie': f'mac={self.mac_address}'
-        }
-        
         url = f"{self.portal_url}/portal.php?type=itv&action=get_all_channels&genre={genre}&JsHttpRequest=1-xml"
-        response = requests.get(url, headers=headers, timeout=30)
+        response = http_session.get(url, headers=self._headers(), timeout=30)
         response.raise_for_status()
         
         data = response.json()
@@ -70,18 +70,85 @@ class StalkerParser:
         
         return channels
     
-    def create_link(self, cmd):
+    def get_ordered_list(self, genre, page=1):
+        """One page of a genre's channel list: returns (channels, total_items, page_size)"""
+        url = (f"{self.portal_url}/portal.php?type=itv&action=get_ordered_list"
+               f"&genre={genre}&p={page}&JsHttpRequest=1-xml")
+        response = http_session.get(url, headers=self._headers(), timeout=30)
+        response.raise_for_status()
+        self.bytes_received += len(response.content)
+        
+        js = response.json().get('js') or {}
+        data = js.get('data') or []
+        return data, int(js.get('total_items') or 0), int(js.get('max_page_items') or len(data) or 1)
+    
+    def iter_channels(self):
+        """Yield every live channel of the portal, grouped by genre.
+        
+        The handshake token is fetched once and shared; after the genre list,
+        the first page of every genre and then the remaining pages are fetched
+        concurrently. Channels are yielded in a stable genre/page order as soon
+        as the pages ahead of them have arrived.
+        """
+        self.bytes_received = 0
         if not self.token:
             self._get_token()
         
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (QtEmbedded; U; Linux; C) AppleWebKit/533.3 (KHTML, like Gecko) MAG200 stbapp ver: 2 rev: 250 Safari/533.3',
-            'Authorization': f'Bearer {self.token}',
-            'Cookie': f'mac={self.mac_address}'
+        genres = [
+            (str(g.get('id')), g.get('title', ''))
+            for g in (self.get_genres().get('js') or [])
+            if str(g.get('id')) != '*'
+        ] or [('*', '')]
+        
+        pages = {}       # (genre index, page) -> channel data
+        page_counts = {}  # genre index -> number of pages
+        seen = set()
+        cursor = (0, 1)
+        
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            pending = {pool.submit(self.get_ordered_list, genre_id, 1): (i, 1)
+                       for i, (genre_id, _) in enumerate(genres)}
+            
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    key = pending.pop(future)
+                    data, total, page_size = future.result()
+                    pages[key] = data
+                    
+                    index, page = key
+                    if page == 1:
+                        page_counts[index] = max(1, -(-total // page_size))
+                        for extra in range(2, page_counts[index] + 1):
+                            pending[pool.submit(self.get_ordered_list, genres[index][0], extra)] = (index, extra)
+                
+                # Emit contiguous pages in order
+                while cursor in pages:
+                    index, page = cursor
+                    for ch in pages.pop(cursor):
+                        if ch.get('id') in seen:
+                            continue
+                        seen.add(ch.get('id'))
+                        yield self._channel(ch, genres[index][1])
+                    cursor = (index, page + 1) if page < page_counts[index] else (index + 1, 1)
+    
+    def _channel(self, ch, genre_title):
+        return {
+            'name': ch.get('name', ''),
+            'stream_url': ch.get('cmd', ''),
+            'tvg_id': ch.get('xmltv_id') or str(ch.get('id', '')),
+            'tvg_name': ch.get('name', ''),
+            'tvg_logo': ch.get('logo', ''),
+            'group_title': genre_title,
+            'channel_number': ch.get('number', 0)
         }
+    
+    def create_link(self, cmd):
+        if not self.token:
+            self._get_token()
         
         url = f"{self.portal_url}/portal.php?type=itv&action=create_link&cmd={cmd}&JsHttpRequest=1-xml"
-        response = requests.get(url, headers=headers, timeout=30)
+        response = http_session.get(url, headers=self._headers(), timeout=30)
         response.raise_for_status()
         
         data = response.json()
@@ -0,0 +1,94 @@
+from io import BufferedReader
+import codecs
+import gzip
+import json
+import lzma
+
+GZIP_MAGIC = b'\x1f\x8b'
+XZ_MAGIC = b'\xfd7zXZ\x00'
+
+# Read size used when wrapping raw sockets and files
+STREAM_BUFFER_SIZE = 256 * 1024
+
+def open_decompressed(fileobj):
+    """Wrap a binary stream so gzip/xz compressed payloads are decompressed on the fly"""
+    buffered = BufferedReader(fileobj, buffer_size=STREAM_BUFFER_SIZE)
+    head = buffered.peek(len(XZ_MAGIC))[:len(XZ_MAGIC)]
+
+    if head.startswith(GZIP_MAGIC):
+        return gzip.GzipFile(fileobj=buffered)
+    if head.startswith(XZ_MAGIC):
+        return lzma.LZMAFile(buffered)
+    return buffered
+
+def open_response_stream(response):
+    """Binary stream over a `requests` response opened with stream=True.
+
+    Content-Encoding is decoded by urllib3; compressed payloads (e.g. a .m3u.gz
+    or .xml.xz file) are handled by open_decompressed.
+    """
+    response.raw.decode_content = True
+    # Keep the stream "open" at EOF so buffered readers can drain it
+    response.raw.auto_close = False
+    return open_decompressed(response.raw)
+
+def iter_text_lines(stream):
+    """Yield decoded lines (without line endings) from a binary stream.
+
+    Lines are decoded individually as UTF-8 with a cp1252/latin-1 fallback, so a
+    playlist with a few mis-encoded names does not need to be read twice.
+    """
+    for raw in stream:
+        try:
+            line = raw.decode('utf-8')
+        except UnicodeDecodeError:
+            try:
+                line = raw.decode('cp1252')
+            except UnicodeDecodeError:
+                line = raw.decode('latin-1')
+        yield line.rstrip('\r\n')
+
+def iter_json_array(stream, chunk_size=STREAM_BUFFER_SIZE):
+    """Yield the elements of a top-level JSON array read from a binary stream.
+    
+    Elements are decoded one at a time as their text arrives, so a 100 MB
+    provider listing is never held as a single string or list. Raises
+    ValueError when the document is empty or not an array (e.g. an
+    authentication error object).
+    """
+    decoder = json.JSONDecoder()
+    text = codecs.getincrementaldecoder('utf-8')(errors='replace')
+    buf = ''
+    pos = 0
+    opened = False
+    eof = False
+    
+    while True:
+        while pos < len(buf) and buf[pos] in ' \t\r\n,':
+            pos += 1
+        
+        if pos < len(buf):
+            if not opened:
+                if buf[pos] != '[':
+                    raise ValueError("Expected a JSON array")
+                opened = True
+                pos += 1
+                continue
+            if buf[pos] == ']':
+                return
+            try:
+                item, pos = decoder.raw_decode(buf, pos)
+            except json.JSONDecodeError:
+                # Element split across chunks; read more unless the input is exhausted
+                if eof:
+                    raise
+            else:
+                yield item
+                continue
+        elif eof:
+            raise ValueError("Truncated JSON array" if opened else "Empty JSON document")
+        
+        chunk = stream.read(chunk_size)
+        eof = not chunk
+        buf = buf[pos:] + text.decode(chunk, final=eof)
+        pos = 0
@@ -1,6 +1,9 @@
 import xml.etree.ElementTree as ET
 from datetime import datetime
-import requests
+from io import BytesIO
+
+from http_client import http_session
+from parsers.streams import open_decompressed
 
 class XMLTVParser:
     def __init__(self):
@@ -8,52 +11,84 @@ class XMLTVParser:
         self.programmes = []
     
     def parse(self, content):
-        root = ET.fromstring(content)
+        if isinstance(content, str):
+            content = content.encode('utf-8')
         
-        for channel in root.findall('channel'):
-            channel_id = channel.get('id')
-            display_name = channel.find('display-name')
-            icon = channel.find('icon')
-            
-            self.channels[channel_id] = {
-                'id': channel_id,
-                'display_name': display_name.text if display_name is not None else '',
-                'icon': icon.get('src') if icon is not None else ''
-            }
+        for kind, item in self.iterparse(BytesIO(content)):
+            if kind == 'channel':
+                self.channels[item['id']] = item
+            else:
+                self.programmes.append(item)
         
-        for programme in root.findall('programme'):
-            prog_data = {
-                'channel': programme.get('channel'),
-                'start': self._parse_time(programme.get('start')),
-                'stop': self._parse_time(programme.get('stop')),
-                'title': '',
-                'desc': '',
-                'category': '',
-                'icon': ''
-            }
-            
-            title = programme.find('title')
-            if title is not None:
-                prog_data['title'] = title.text
-            
-            desc = programme.find('desc')
-            if desc is not None:
-                prog_data['desc'] = desc.text
-            
-            category = programme.find('category')
-            if category is not None:
-                prog_data['category'] = category.text
+        return {
+            'channels': self.channels,
+            'programmes': self.programmes
+        }
+    
+    def iterparse(self, source):
+        """Stream an XMLTV document, yielding ('channel', dict) and ('programme', dict).
+        
+        `source` is a filename or binary file object. Elements are cleared as soon
+        as they have been converted, so memory stays flat regardless of guide size.
+        """
+        root = None
+        
+        for event, elem in ET.iterparse(source, events=('start', 'end')):
+            if event == 'start':
+                if root is None:
+                    root = elem
+                continue
             
-            icon = programme.find('icon')
-            if icon is not None:
-                prog_data['icon'] = icon.get('src')
+            if elem.tag == 'channel':
+                yield 'channel', self._channel_from_element(elem)
+            elif elem.tag == 'programme':
+                yield 'programme', self._programme_from_element(elem)
+            else:
+                continue
             
-            self.programmes.append(prog_data)
+            # Drop the converted element and its (now empty) reference from the root
+            elem.clear()
+            if root is not None:
+                root.clear()
+    
+    def _channel_from_element(self, channel):
+        display_name = channel.find('display-name')
+        icon = channel.find('icon')
         
         return {
-            'channels': self.channels,
-            'programmes': self.programmes
+            'id': channel.get('id'),
+            'display_name': display_name.text if display_name is not None else '',
+            'icon': icon.get('src') if icon is not None else ''
+        }
+    
+    def _programme_from_element(self, programme):
+        prog_data = {
+            'channel': programme.get('channel'),
+            'start': self._parse_time(programme.get('start')),
+            'stop': self._parse_time(programme.get('stop')),
+            'title': '',
+            'desc': '',
+            'category': '',
+            'icon': ''
         }
+        
+        title = programme.find('title')
+        if title is not None:
+            prog_data['title'] = title.text
+        
+        desc = programme.find('desc')
+        if desc is not None:
+            prog_data['desc'] = desc.text
+        
+        category = programme.find('category')
+        if category is not None:
+            prog_data['category'] = category.text
+        
+        icon = programme.find('icon')
+        if icon is not None:
+            prog_data['icon'] = icon.get('src')
+        
+        return prog_data
     
     def _parse_time(self, time_str):
         if not time_str:
@@ -65,13 +100,13 @@ class XMLTVParser:
             return None
     
     def parse_from_url(self, url):
-        response = requests.get(url, timeout=60)
+        response = http_session.get(url, timeout=60)
         response.raise_for_status()
         return self.parse(response.content)
     
     def parse_from_file(self, file_path):
         with open(file_path, 'rb') as f:
-            content = f.read()
+            content = open_decompressed(f).read()
         return self.parse(content)
     
     def get_current_programme(self, channel_id):
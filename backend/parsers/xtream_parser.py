@@ -1,39 +1,84 @@
-import requests
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse, parse_qs
+
+from http_client import http_session
+from parsers.streams import iter_json_array, open_response_stream
 
 class XtreamParser:
-    def __init__(self, base_url, username, password):
+    def __init__(self, base_url, username, password, stream_extension='m3u8', user_agent=None):
         self.base_url = base_url.rstrip('/')
         self.username = username
         self.password = password
         self.player_api_url = f"{self.base_url}/player_api.php"
+        # Live stream URLs end in .m3u8 (HLS) or .ts (MPEG-TS)
+        self.stream_extension = stream_extension
+        self.headers = {'User-Agent': user_agent} if user_agent else {}
     
-    def get_live_streams(self):
-        params = {
+    def _params(self, action, **extra):
+        return {
             'username': self.username,
             'password': self.password,
-            'action': 'get_live_streams'
+            'action': action,
+            **extra
         }
         
-        response = requests.get(self.player_api_url, params=params, timeout=30)
+    def get_live_categories(self):
+        response = http_session.get(self.player_api_url, params=self._params('get_live_categories'),
+                                    headers=self.headers, timeout=30)
         response.raise_for_status()
-        streams = response.json()
+        return response.json() or []
+        
+    def iter_live_streams(self):
+        """Yield live channels as they are decoded from the player API.
+        
+        Categories and the stream list are requested concurrently; the stream
+        list is decoded element by element off the socket, so even very large
+        providers never sit in memory as one JSON document.
+        """
+        self.bytes_received = 0
+        
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            categories = pool.submit(self.get_live_categories)
+            response = http_session.get(self.player_api_url, params=self._params('get_live_streams'),
+                                    headers=self.headers, stream=True, timeout=30)
+            try:
+                response.raise_for_status()
+                category_names = {
+                    str(c.get('category_id')): c.get('category_name', '')
+                    for c in categories.result() if isinstance(c, dict)
+                }
+            except Exception:
+                response.close()
+                raise
+        
+        try:
+            for stream in iter_json_array(open_response_stream(response)):
+                yield self._live_channel(stream, category_names)
+        finally:
+            self.bytes_received = response.raw.tell()
+            response.close()
+    
+    def _live_channel(self, stream, category_names):
+        try:
+            archive_days = int(stream.get('tv_archive_duration') or 0)
+        except (TypeError, ValueError):
+            archive_days = 0
+        archived = str(stream.get('tv_archive', '0')) == '1'
         
-        channels = []
-        for stream in streams:
-            channel = {
-                'name': stream.get('name', ''),
-                'stream_id': stream.get('stream_id'),
-                'stream_url': f"{self.base_url}/live/{self.username}/{self.password}/{stream.get('stream_id')}.m3u8",
-                'tvg_id': stream.get('epg_channel_id', ''),
-                'tvg_name': stream.get('name', ''),
-                'tvg_logo': stream.get('stream_icon', ''),
-                'group_title': stream.get('category_name', ''),
-                'catchup': 'default' if stream.get('tv_archive') == 1 else '',
-                'catchup_days': stream.get('tv_archive_duration', 0)
-            }
-            channels.append(channel)
+        return {
+            'name': stream.get('name', ''),
+            'stream_id': stream.get('stream_id'),
+            'stream_url': f"{self.base_url}/live/{self.username}/{self.password}/{stream.get('stream_id')}.{self.stream_extension}",
+            'tvg_id': stream.get('epg_channel_id') or '',
+            'tvg_name': stream.get('name', ''),
+            'tvg_logo': stream.get('stream_icon') or '',
+            'group_title': stream.get('category_name') or category_names.get(str(stream.get('category_id')), ''),
+            'catchup': 'default' if archived else '',
+            'catchup_days': archive_days if archived else 0
+        }
         
-        return channels
+    def get_live_streams(self):
+        return list(self.iter_live_streams())
     
     def get_vod_streams(self):
         params = {
@@ -42,7 +87,7 @@ class XtreamParser:
             'action': 'get_vod_streams'
         }
         
-        response = requests.get(self.player_api_url, params=params, timeout=30)
+        response = http_session.get(self.player_api_url, params=params, timeout=30)
         response.raise_for_status()
         return response.json()
     
@@ -53,7 +98,7 @@ class XtreamParser:
             'action': 'get_series'
         }
         
-        response = requests.get(self.player_api_url, params=params, timeout=30)
+        response = http_session.get(self.player_api_url, params=params, timeout=30)
         response.raise_for_status()
         return response.json()
     
@@ -65,6 +110,25 @@ class XtreamParser:
             'stream_id': stream_id
         }
         
-        response = requests.get(self.player_api_url, params=params, timeout=30)
+        response = http_session.get(self.player_api_url, params=params, timeout=30)
         response.raise_for_status()
         return response.json()
+
+def xtream_from_export_url(url, user_agent=None):
+    """Return an XtreamParser for an Xtream `get.php?username=..&password=..` M3U export URL, or None.
+    
+    Stream URLs keep the export's `output` format: MPEG-TS unless it asks for HLS.
+    """
+    parsed = urlparse(url or '')
+    if not parsed.path.endswith('/get.php'):
+        return None
+    
+    query = parse_qs(parsed.query)
+    if not query.get('username') or not query.get('password'):
+        return None
+    
+    base_url = f"{parsed.scheme}://{parsed.netloc}{parsed.path[:-len('/get.php')]}"
+    output = (query.get('output') or ['ts'])[0].lower()
+    extension = 'm3u8' if output in ('m3u8', 'hls') else 'ts'
+    return XtreamParser(base_url, query['username'][0], query['password'][0],
+                        stream_extension=extension, user_agent=user_agent)
@@ -0,0 +1,461 @@
+"""
+Restreaming of raw MPEG-TS channels.
+
+A channel URL that is a plain TS stream (not HLS) used to cost one upstream
+connection per viewer, which runs into provider connection caps at once. A
+restreamed channel is pulled from upstream once, either natively or through
+ffmpeg (RESTREAM_ENGINE), into a ring buffer; every viewer reads from the
+buffer at its own position. Optionally ffmpeg also cuts the stream into a
+local HLS playlist for players that only speak HLS.
+
+The pull starts with the first viewer and stops once the channel has had no
+viewers for RESTREAM_IDLE_SECONDS. At most RESTREAM_MAX_CHANNELS channels run
+at once per process, since each one holds a buffer, a pull thread and possibly
+ffmpeg processes.
+
+Each server process keeps its own channels. The HLS output lives in the shared
+data directory instead, so any process can serve it: a lock file per channel
+makes sure only one process runs the segmenter, and its modification time
+records HLS viewer activity for whichever process that is.
+"""
+
+import asyncio
+import hashlib
+import os
+import shutil
+import subprocess
+import threading
+import time
+from urllib.parse import urlsplit
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from http_client import http_session
+from upstream_limiter import upstream_limiter
+
+# "native" reads the upstream over HTTP; "ffmpeg" also handles other protocols and reconnects
+RESTREAM_ENGINE = os.environ.get("RESTREAM_ENGINE", "native")
+# Stream history kept per channel; viewers further behind skip ahead
+RESTREAM_BUFFER_MB = int(os.environ.get("RESTREAM_BUFFER_MB", 16))
+# How much history a new viewer starts with, so its player can buffer at once
+RESTREAM_JOIN_KB = int(os.environ.get("RESTREAM_JOIN_KB", 1024))
+RESTREAM_IDLE_SECONDS = int(os.environ.get("RESTREAM_IDLE_SECONDS", 30))
+RESTREAM_HLS_DIR = os.environ.get("RESTREAM_HLS_DIR", "./data/restream")
+# Upstream reconnect attempts in a row before a channel gives up
+RESTREAM_MAX_RETRIES = int(os.environ.get("RESTREAM_MAX_RETRIES", 5))
+# Channels restreamed at once per server process
+RESTREAM_MAX_CHANNELS = int(os.environ.get("RESTREAM_MAX_CHANNELS", 8))
+
+READ_CHUNK_SIZE = 64 * 1024
+TS_PACKET_SIZE = 188
+TS_SYNC_BYTE = 0x47
+HLS_LOCK_FILE = ".lock"
+# Protocols ffmpeg may open for an upstream; without this it also reads local files
+FFMPEG_PROTOCOLS = "http,https,tcp,tls"
+
+class RestreamBusy(Exception):
+    """RESTREAM_MAX_CHANNELS channels are already running"""
+    status = 503
+
+def hls_directory(key):
+    return os.path.abspath(os.path.join(RESTREAM_HLS_DIR, key))
+
+def mark_hls_viewed(key):
+    """Record HLS viewer activity for the process running the channel's segmenter"""
+    try:
+        os.utime(os.path.join(hls_directory(key), HLS_LOCK_FILE))
+    except OSError:
+        pass
+
+def _try_lock(path):
+    """Open and exclusively lock `path` without blocking; None if another process holds it"""
+    f = open(path, 'a')
+    if fcntl:
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            f.close()
+            return None
+    return f
+
+def hls_segmented_elsewhere(key):
+    """Whether some process already runs the segmenter for this channel"""
+    path = os.path.join(hls_directory(key), HLS_LOCK_FILE)
+    if not os.path.exists(path):
+        return False
+    lock = _try_lock(path)
+    if lock is None:
+        return True
+    lock.close()
+    return False
+
+def wait_for_hls(key, channel=None, timeout=20):
+    """Wait for the channel's HLS playlist to appear; False on timeout or if the channel stopped"""
+    playlist = os.path.join(hls_directory(key), "index.m3u8")
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if os.path.exists(playlist):
+            return True
+        if channel is not None:
+            if channel.stopped:
+                return False
+            channel.touch()
+            if channel.hls_dir is None:
+                # Take over once the process segmenting it lets go of the lock
+                channel.start_hls()
+        else:
+            mark_hls_viewed(key)
+        time.sleep(0.2)
+    return False
+
+class RingBuffer:
+    """Fixed-size stream history addressed by absolute byte offsets"""
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        # Allocated with the first write, so a channel that never connects costs nothing
+        self._data = None
+        self.end = 0
+
+    @property
+    def start(self):
+        return max(self.end - self.capacity, 0)
+
+    def write(self, chunk):
+        if self._data is None:
+            self._data = bytearray(self.capacity)
+        if len(chunk) > self.capacity:
+            self.end += len(chunk) - self.capacity
+            chunk = chunk[-self.capacity:]
+
+        offset = self.end % self.capacity
+        first = min(len(chunk), self.capacity - offset)
+        self._data[offset:offset + first] = chunk[:first]
+        self._data[:len(chunk) - first] = chunk[first:]
+        self.end += len(chunk)
+
+    def read(self, pos, limit):
+        size = min(self.end - pos, limit)
+        if size <= 0:
+            return b''
+        offset = pos % self.capacity
+        first = min(size, self.capacity - offset)
+        return bytes(self._data[offset:offset + first]) + bytes(self._data[:size - first])
+
+class RestreamChannel:
+    def __init__(self, url, key, hls=False, engine=RESTREAM_ENGINE):
+        self.url = url
+        self.key = key
+        self.engine = engine
+        self.buffer = RingBuffer(RESTREAM_BUFFER_MB * 1024 * 1024)
+        self.cond = threading.Condition()
+        self.viewers = 0
+        self.last_activity = time.monotonic()
+        self.started = time.monotonic()
+        self.stopped = False
+        self.error = None
+        self.restarts = 0
+        self.skips = 0
+        self.hls_dir = None
+        self._hls_lock = None
+        self._async_events = {}
+        self._process = None
+
+        threading.Thread(target=self._pull, daemon=True).start()
+        if hls:
+            self.start_hls()
+
+    # ---- upstream ----
+
+    def _idle(self):
+        if self.viewers:
+            return False
+        idle = time.monotonic() - self.last_activity
+        if self._hls_lock is not None:
+            try:
+                idle = min(idle, time.time() - os.path.getmtime(self._hls_lock.name))
+            except OSError:
+                pass
+        return idle > RESTREAM_IDLE_SECONDS
+
+    def _pull(self):
+        print(f"[RESTREAM] Starting {self.engine} pull: {self.url}")
+        failures = 0
+        try:
+            while not self._idle():
+                try:
+                    with upstream_limiter.slot(self.url):
+                        for chunk in self._read_upstream():
+                            self._write(chunk)
+                            failures = 0
+                            if self._idle():
+                                return
+                except Exception as e:
+                    self.error = str(e)
+                    print(f"[RESTREAM] Upstream error: {e}")
+
+                failures += 1
+                if failures > RESTREAM_MAX_RETRIES:
+                    return
+                self.restarts += 1
+                time.sleep(min(2 ** failures, 30))
+        finally:
+            self._stop()
+
+    def _read_upstream(self):
+        if self.engine == "ffmpeg":
+            self._process = subprocess.Popen(
+                ["ffmpeg", "-loglevel", "error", "-reconnect", "1", "-reconnect_streamed", "1",
+                 "-protocol_whitelist", FFMPEG_PROTOCOLS, "-i", self.url, "-c", "copy", "-f", "mpegts", "pipe:1"],
+                stdout=subprocess.PIPE,
+                stderr=subprocess.DEVNULL,
+            )
+            try:
+                for chunk in iter(lambda: self._process.stdout.read1(READ_CHUNK_SIZE), b''):
+                    yield chunk
+            finally:
+                self._process.kill()
+                self._process.wait()
+            return
+
+        with http_session.get(self.url, stream=True, timeout=(10, 30)) as resp:
+            resp.raise_for_status()
+            for chunk in resp.iter_content(chunk_size=READ_CHUNK_SIZE):
+                if chunk:
+                    yield chunk
+
+    def _write(self, chunk):
+        with self.cond:
+            self.buffer.write(chunk)
+            self.cond.notify_all()
+        self._wake_async()
+
+    def _wake_async(self):
+        """Wake the readers waiting on event loops"""
+        with self.cond:
+            events = list(self._async_events.items())
+        for loop, event in events:
+            try:
+                loop.call_soon_threadsafe(event.set)
+            except RuntimeError:
+                # The loop has been closed
+                with self.cond:
+                    self._async_events.pop(loop, None)
+
+    def _stop(self):
+        with self.cond:
+            self.stopped = True
+            self.cond.notify_all()
+        self._wake_async()
+        print(f"[RESTREAM] Stopped: {self.url}")
+
+    # ---- viewers ----
+
+    def touch(self):
+        self.last_activity = time.monotonic()
+
+    def _attach(self):
+        """Register a viewer and return its starting offset"""
+        with self.cond:
+            self.viewers += 1
+            self.touch()
+            return self._sync_locked(max(self.buffer.end - RESTREAM_JOIN_KB * 1024, self.buffer.start))
+
+    def _detach(self):
+        with self.cond:
+            self.viewers -= 1
+            self.touch()
+
+    def _sync_locked(self, pos):
+        """First TS packet boundary at or after `pos`, so a player never starts mid-packet"""
+        window = self.buffer.read(pos, TS_PACKET_SIZE * 3)
+        for i in range(min(TS_PACKET_SIZE, len(window))):
+            if all(window[j] == TS_SYNC_BYTE for j in range(i, len(window), TS_PACKET_SIZE)):
+                return pos + i
+        return pos
+
+    def _next_chunk_locked(self, pos):
+        """(new position, chunk) for a reader at `pos`, skipping ahead if it fell out of the buffer"""
+        if pos < self.buffer.start:
+            self.skips += 1
+            pos = self._sync_locked(self.buffer.start + READ_CHUNK_SIZE)
+        return pos, self.buffer.read(pos, READ_CHUNK_SIZE)
+
+    def iter_chunks(self):
+        """The live stream for one viewer, from a worker thread"""
+        pos = self._attach()
+        try:
+            while True:
+                with self.cond:
+                    self.cond.wait_for(lambda: self.buffer.end > pos or self.stopped)
+                    pos, chunk = self._next_chunk_locked(pos)
+                    stopped = self.stopped
+                if chunk:
+                    pos += len(chunk)
+                    yield chunk
+                elif stopped:
+                    return
+        finally:
+            self._detach()
+
+    async def iter_chunks_async(self):
+        """The live stream for one viewer, on the event loop"""
+        loop = asyncio.get_running_loop()
+        with self.cond:
+            event = self._async_events.setdefault(loop, asyncio.Event())
+        pos = self._attach()
+        try:
+            while True:
+                with self.cond:
+                    pos, chunk = self._next_chunk_locked(pos)
+                    stopped = self.stopped
+                if chunk:
+                    pos += len(chunk)
+                    yield chunk
+                    continue
+                if stopped:
+                    return
+
+                # Re-check after clearing: a write in between has already set the event again
+                event.clear()
+                with self.cond:
+                    ready = self.buffer.end > pos or self.stopped
+                if not ready:
+                    await event.wait()
+        finally:
+            self._detach()
+
+    # ---- local HLS ----
+
+    def start_hls(self):
+        """Cut the stream into a local HLS playlist with ffmpeg, fed from the ring buffer.
+
+        Does nothing while another process holds the channel's lock; calling
+        again (wait_for_hls does) takes over once that process stops.
+        """
+        with self.cond:
+            if self.hls_dir:
+                return
+        hls_dir = hls_directory(self.key)
+        os.makedirs(hls_dir, exist_ok=True)
+
+        lock = _try_lock(os.path.join(hls_dir, HLS_LOCK_FILE))
+        if lock is None:
+            return
+        with self.cond:
+            self._hls_lock = lock
+            self.hls_dir = hls_dir
+        print(f"[RESTREAM] Segmenting {self.key} into HLS")
+        # Leftovers of a process that did not shut down cleanly
+        for name in os.listdir(self.hls_dir):
+            if name != HLS_LOCK_FILE:
+                os.remove(os.path.join(self.hls_dir, name))
+        threading.Thread(target=self._segment, daemon=True).start()
+
+    @property
+    def hls_playlist(self):
+        return os.path.join(self.hls_dir, "index.m3u8")
+
+    def _segment(self):
+        try:
+            process = subprocess.Popen(
+                ["ffmpeg", "-loglevel", "error", "-f", "mpegts", "-i", "pipe:0", "-c", "copy",
+                 "-f", "hls", "-hls_time", "4", "-hls_list_size", "6",
+                 "-hls_flags", "delete_segments+omit_endlist",
+                 "-hls_segment_filename", os.path.join(self.hls_dir, "seg_%05d.ts"),
+                 self.hls_playlist],
+                stdin=subprocess.PIPE,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+            )
+        except OSError as e:
+            self.error = f"HLS segmenter failed to start: {e}"
+            print(f"[RESTREAM] {self.error}")
+            self._hls_lock.close()
+            self._hls_lock = None
+            return
+
+        # The segmenter reads like a viewer but does not keep the channel alive;
+        # HLS viewers do that by fetching playlists and segments (touch)
+        with self.cond:
+            pos = self._sync_locked(self.buffer.start)
+        try:
+            while True:
+                with self.cond:
+                    self.cond.wait_for(lambda: self.buffer.end > pos or self.stopped)
+                    pos, chunk = self._next_chunk_locked(pos)
+                    if not chunk and self.stopped:
+                        break
+                pos += len(chunk)
+                process.stdin.write(chunk)
+        except (BrokenPipeError, OSError) as e:
+            print(f"[RESTREAM] HLS segmenter stopped: {e}")
+        finally:
+            try:
+                process.stdin.close()
+            except OSError:
+                pass
+            process.wait()
+            if self.stopped:
+                shutil.rmtree(self.hls_dir, ignore_errors=True)
+            self._hls_lock.close()
+            self._hls_lock = None
+
+    def stats(self):
+        return {
+            'viewers': self.viewers,
+            'engine': self.engine,
+            'hls': self._hls_lock is not None,
+            'bytes': self.buffer.end,
+            'uptime': round(time.monotonic() - self.started),
+            'restarts': self.restarts,
+            'skips': self.skips,
+            'error': self.error,
+        }
+
+class RestreamHub:
+    def __init__(self):
+        self._channels = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def channel_key(url):
+        return hashlib.sha1(url.encode('utf-8')).hexdigest()[:16]
+
+    def channel(self, url, hls=False):
+        """The running restream of `url`, started on first use; raises RestreamBusy when full"""
+        key = self.channel_key(url)
+        with self._lock:
+            channel = self._channels.get(key)
+            if channel is None or channel.stopped:
+                running = sum(1 for c in self._channels.values() if not c.stopped)
+                if running >= RESTREAM_MAX_CHANNELS:
+                    raise RestreamBusy(f"Too many restreamed channels ({running})")
+                channel = self._channels[key] = RestreamChannel(url, key, hls=hls)
+                return channel
+        channel.touch()
+        if hls:
+            channel.start_hls()
+        return channel
+
+    def get(self, key):
+        with self._lock:
+            channel = self._channels.get(key)
+        return channel if channel is not None and not channel.stopped else None
+
+    def running(self, url):
+        """Whether `url` is being restreamed by this process"""
+        channel = self.get(self.channel_key(url))
+        return channel is not None and channel.url == url
+
+    def stats(self):
+        with self._lock:
+            for key in [k for k, c in self._channels.items() if c.stopped]:
+                del self._channels[key]
+            # Channel URLs often carry account credentials; report the host only
+            return {key: {'host': urlsplit(c.url).netloc, **c.stats()} for key, c in self._channels.items()}
+
+restream_hub = RestreamHub()
@@ -1,17 +1,14 @@
 from flask import Blueprint, request, jsonify, session
 from datetime import datetime
 import os
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from models.playlist import get_session
 from models.user import User
 
 auth_bp = Blueprint("auth", __name__)
 
 def get_user_session():
-    db_path = os.environ.get("DATABASE_PATH", "./data/database.db")
-    engine = create_engine(f"sqlite:///{db_path}")
-    Session = sessionmaker(bind=engine)
-    return Session()
+    # The shared engine; building one per request also built a new connection pool
+    return get_session()
 
 @auth_bp.route("/login", methods=["POST"])
 def login():
@@ -1,68 +1,209 @@
 from flask import Blueprint, request, jsonify, Response
 import requests
-from urllib.parse import urlparse, urljoin
+from urllib.parse import urlparse, urljoin, urlencode
+import base64
+import json
 import re
-from sqlalchemy import or_
-from models.playlist import get_session, Channel
+from sqlalchemy import select, func, tuple_
+from models.playlist import get_session, Channel, ChannelGroup, refresh_channel_groups
+from models.channel_search import search_filter, ranked_search
 from middleware.auth_middleware import login_required, password_change_required
 
 channel_bp = Blueprint("channel", __name__)
 
+# Columns a listing may ask for with ?fields=, in response order
+CHANNEL_COLUMNS = {
+    "id": Channel.id,
+    "playlist_id": Channel.playlist_id,
+    "name": Channel.name,
+    "group_title": Channel.group_title,
+    "tvg_id": Channel.tvg_id,
+    "tvg_name": Channel.tvg_name,
+    "tvg_logo": Channel.tvg_logo,
+    "stream_url": Channel.stream_url,
+    "catchup": Channel.catchup,
+    "catchup_source": Channel.catchup_source,
+    "catchup_days": Channel.catchup_days,
+    "is_favorite": Channel.is_favorite,
+    "channel_number": Channel.channel_number,
+}
+# Listing order, and the key pages continue from
+PAGE_KEY = (Channel.playlist_id, Channel.channel_number, Channel.id)
+MAX_PAGE_SIZE = 1000
+# Rows fetched from the database at a time while streaming an unpaged listing
+STREAM_BATCH_SIZE = 1000
+
+def encode_cursor(row):
+    """Opaque cursor for the page after `row`"""
+    key = f"{row.playlist_id}:{row.channel_number}:{row.id}"
+    return base64.urlsafe_b64encode(key.encode("ascii")).decode("ascii").rstrip("=")
+
+def decode_cursor(cursor):
+    try:
+        key = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode("ascii")
+        values = tuple(int(part) for part in key.split(":"))
+    except ValueError:
+        values = ()
+    if len(values) != len(PAGE_KEY):
+        raise ValueError("Invalid cursor")
+    return values
+
+def channel_filters(args):
+    """WHERE clauses for the playlist_id, group, search and favorites listing parameters"""
+    filters = []
+    if args.get("playlist_id"):
+        filters.append(Channel.playlist_id == int(args["playlist_id"]))
+    if args.get("group"):
+        filters.append(Channel.group_title == args["group"])
+    if args.get("search"):
+        filters.append(search_filter(args["search"]))
+    if args.get("favorites", "").lower() == "true":
+        filters.append(Channel.is_favorite == True)
+    return filters
+
+def requested_fields(args):
+    """Names of the columns to return (?fields=a,b,c), all of them by default"""
+    fields = [f.strip() for f in args.get("fields", "").split(",") if f.strip()]
+    unknown = [f for f in fields if f not in CHANNEL_COLUMNS]
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+    return fields or list(CHANNEL_COLUMNS)
+
+def listing_query(filters, fields, cursor=None, playlist_id=None):
+    """SELECT of the requested columns plus the page key, in listing order
+
+    Within one playlist the cursor compares (channel_number, id) only, which
+    the playlist's indexes (group and favorites included) can seek to.
+    """
+    columns = [CHANNEL_COLUMNS[f] for f in fields]
+    columns += [c for c in PAGE_KEY if c.key not in fields]
+    query = select(*columns).where(*filters).order_by(*PAGE_KEY)
+    if cursor and playlist_id is not None:
+        query = query.where(tuple_(*PAGE_KEY[1:]) > tuple_(*cursor[1:]))
+    elif cursor:
+        query = query.where(tuple_(*PAGE_KEY) > tuple_(*cursor))
+    return query
+
+def count_query(filters):
+    return select(func.count()).select_from(Channel).where(*filters)
+
+def groups_query(playlist_id=None):
+    """Group names and channel counts in playlist order, from the group catalogue"""
+    if playlist_id:
+        return (
+            select(ChannelGroup.name, ChannelGroup.channel_count)
+            .where(ChannelGroup.playlist_id == playlist_id)
+            .order_by(ChannelGroup.sort_order)
+        )
+    # Groups of the same name in several playlists are merged
+    return (
+        select(ChannelGroup.name, func.sum(ChannelGroup.channel_count).label("channel_count"))
+        .group_by(ChannelGroup.name)
+        .order_by(func.min(ChannelGroup.playlist_id), func.min(ChannelGroup.sort_order))
+    )
+
 @channel_bp.route("", methods=["GET"])
 @login_required
 def get_channels():
-    """Get channels - REQUIRES AUTH"""
+    """Get channels - REQUIRES AUTH
+
+    With ?limit= the listing is returned a page at a time in channel number
+    order: the response carries X-Next-Cursor (and a Link header) while more
+    rows follow, to be passed back as ?cursor=, and the first page carries
+    X-Total-Count. ?fields= selects the columns returned. Without a limit
+    every matching channel is streamed.
+    """
+    try:
+        filters = channel_filters(request.args)
+        fields = requested_fields(request.args)
+        limit = int(request.args["limit"]) if request.args.get("limit") else None
+        cursor = decode_cursor(request.args["cursor"]) if request.args.get("cursor") else None
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    # Plain rows of only the requested columns
+    query = listing_query(filters, fields, cursor, request.args.get("playlist_id"))
+    if limit is None:
+        return _stream_channels(query, fields)
+    limit = min(max(limit, 1), MAX_PAGE_SIZE)
     session = get_session()
     try:
-        playlist_id = request.args.get("playlist_id")
-        group = request.args.get("group")
-        search = request.args.get("search")
-        favorites = request.args.get("favorites")
-
-        query = session.query(Channel)
-        if playlist_id:
-            query = query.filter(Channel.playlist_id == int(playlist_id))
-        if group:
-            query = query.filter(Channel.group_title == group)
-        if search:
-            like = f"%{search}%"
-            query = query.filter(or_(Channel.name.like(like), Channel.tvg_name.like(like)))
-        if favorites and favorites.lower() == "true":
-            query = query.filter(Channel.is_favorite == True)
-
-        rows = query.all()
-        return jsonify([{
-            "id": c.id,
-            "playlist_id": c.playlist_id,
-            "name": c.name,
-            "group_title": c.group_title,
-            "tvg_id": c.tvg_id,
-            "tvg_name": c.tvg_name,
-            "tvg_logo": c.tvg_logo,
-            "stream_url": c.stream_url,
-            "catchup": c.catchup,
-            "catchup_source": c.catchup_source,
-            "catchup_days": c.catchup_days,
-            "is_favorite": c.is_favorite,
-            "channel_number": c.channel_number,
-        } for c in rows])
+        rows = session.execute(query.limit(limit + 1)).all()
+        total = None
+        if cursor is None:
+            total = session.execute(count_query(filters)).scalar()
+    finally:
+        session.close()
+    response = jsonify([{f: getattr(row, f) for f in fields} for row in rows[:limit]])
+    if len(rows) > limit:
+        next_cursor = encode_cursor(rows[limit - 1])
+        args = request.args.to_dict()
+        args["cursor"] = next_cursor
+        response.headers["X-Next-Cursor"] = next_cursor
+        response.headers["Link"] = f'<{request.base_url}?{urlencode(args)}>; rel="next"'
+    if total is not None:
+        response.headers["X-Total-Count"] = str(total)
+    return response
+
+def _stream_channels(query, fields):
+    """The whole listing as a JSON array, written out while the rows are read"""
+    def generate():
+        session = get_session()
+        try:
+            result = session.execute(query.execution_options(yield_per=STREAM_BATCH_SIZE))
+            yield "["
+            separator = ""
+            for row in result:
+                yield separator + json.dumps({f: getattr(row, f) for f in fields})
+                separator = ","
+            yield "]"
+        finally:
+            session.close()
+    return Response(generate(), mimetype="application/json")
+
+@channel_bp.route("/search", methods=["GET"])
+@login_required
+def search_channels():
+    """Best matches for ?q= by name, tvg name and group, best first - REQUIRES AUTH
+
+    Accepts the listing's playlist_id, group, favorites and fields parameters
+    and ?limit= (default 50).
+    """
+    q = request.args.get("q", "").strip()
+    if not q:
+        return jsonify({"error": "q parameter required"}), 400
+    try:
+        args = {k: v for k, v in request.args.items() if k != "search"}
+        filters = channel_filters(args)
+        fields = requested_fields(request.args)
+        limit = int(request.args.get("limit", 50))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    session = get_session()
+    try:
+        rows = session.execute(ranked_search([CHANNEL_COLUMNS[f] for f in fields], q, filters, limit)).all()
+        return jsonify([{f: getattr(row, f) for f in fields} for row in rows])
     finally:
         session.close()
 
 @channel_bp.route("/groups", methods=["GET"])
 @login_required
 def get_groups():
-    """Get channel groups - REQUIRES AUTH"""
+    """Get channel groups with their channel counts - REQUIRES AUTH
+
+    Answers If-None-Match with 304 while the groups are unchanged.
+    """
     session = get_session()
     try:
         playlist_id = request.args.get("playlist_id")
-        query = session.query(Channel.group_title).distinct()
-        if playlist_id:
-            query = query.filter(Channel.playlist_id == int(playlist_id))
-        groups = [g[0] for g in query.all() if g[0]]
-        return jsonify(groups)
+        query = groups_query(int(playlist_id) if playlist_id else None)
+        groups = [{"name": g.name, "channel_count": g.channel_count} for g in session.execute(query).all()]
     finally:
         session.close()
+    response = jsonify(groups)
+    # Cached by the browser, but revalidated on every use
+    response.headers["Cache-Control"] = "private, no-cache"
+    response.add_etag()
+    return response.make_conditional(request)
 
 @channel_bp.route("/<int:channel_id>/favorite", methods=["POST"])
 @login_required
@@ -108,6 +249,8 @@ def delete_channel(channel_id: int):
             return jsonify({"error": "Channel not found"}), 404
         
         session.delete(ch)
+        session.flush()
+        refresh_channel_groups(session, [ch.playlist_id])
         session.commit()
         print(f"Deleted channel: {ch.name} (ID: {channel_id})")
         return jsonify({"message": "Channel deleted", "id": channel_id})
@@ -131,7 +274,11 @@ def bulk_delete_channels():
     
     session = get_session()
     try:
+        playlist_ids = session.execute(
+            select(Channel.playlist_id).where(Channel.id.in_(channel_ids)).distinct()
+        ).scalars().all()
         deleted_count = session.query(Channel).filter(Channel.id.in_(channel_ids)).delete(synchronize_session=False)
+        refresh_channel_groups(session, playlist_ids)
         session.commit()
         print(f"Bulk deleted {deleted_count} channels")
         return jsonify({"message": f"Deleted {deleted_count} channels", "count": deleted_count})
@@ -1,25 +1,23 @@
 from flask import Blueprint, request, jsonify
 from datetime import datetime, timedelta
 from models.playlist import get_session, EPGSource
-from parsers.xmltv_parser import XMLTVParser
+from models.epg import (
+    MAX_BULK_CHANNELS,
+    source_to_dict,
+    refresh_epg_source_async,
+    get_programmes as query_programmes,
+    get_current_programme,
+    get_now_next,
+)
 
 epg_bp = Blueprint("epg", __name__)
 
-# Simple in-memory cache per URL
-_epg_cache = {}
-
 @epg_bp.route("/sources", methods=["GET"])
 def get_epg_sources():
     session = get_session()
     try:
         srcs = session.query(EPGSource).all()
-        return jsonify([{
-            "id": s.id,
-            "name": s.name,
-            "url": s.url,
-            "auto_update": s.auto_update,
-            "last_updated": s.last_updated.isoformat() if s.last_updated else None,
-        } for s in srcs])
+        return jsonify([source_to_dict(s) for s in srcs])
     finally:
         session.close()
 
@@ -31,10 +29,15 @@ def add_epg_source():
         s = EPGSource(
             name=data["name"],
             url=data["url"],
-            auto_update=data.get("auto_update", True),
+            enabled=data.get("enabled", data.get("auto_update", True)),
+            priority=int(data.get("priority", 0)),
         )
         session.add(s)
         session.commit()
+
+        # Load the guide in the background instead of inside the first viewer's request
+        if s.enabled:
+            refresh_epg_source_async(s.id)
         return jsonify({"id": s.id, "name": s.name}), 201
     except Exception as e:
         session.rollback()
@@ -42,38 +45,48 @@ def add_epg_source():
     finally:
         session.close()
 
+@epg_bp.route("/sources/<int:source_id>", methods=["POST"])
+def update_epg_source(source_id: int):
+    data = request.get_json(force=True)
+    session = get_session()
+    try:
+        s = session.get(EPGSource, source_id)
+        if not s:
+            return jsonify({"error": "EPG source not found"}), 404
+
+        if "enabled" in data:
+            s.enabled = bool(data["enabled"])
+        if "priority" in data:
+            s.priority = int(data["priority"])
+        session.commit()
+        return jsonify(source_to_dict(s))
+    except Exception as e:
+        session.rollback()
+        return jsonify({"error": str(e)}), 500
+    finally:
+        session.close()
+
+@epg_bp.route("/sources/<int:source_id>/refresh", methods=["POST"])
+def refresh_epg_source_now(source_id: int):
+    session = get_session()
+    try:
+        if not session.get(EPGSource, source_id):
+            return jsonify({"error": "EPG source not found"}), 404
+    finally:
+        session.close()
+
+    refresh_epg_source_async(source_id, force=request.args.get("force") == "true")
+    return jsonify({"message": "Refresh started", "id": source_id}), 202
+
 @epg_bp.route("/programmes", methods=["GET"])
 def get_programmes():
     channel_id = request.args.get("channel_id")
     if not channel_id:
         return jsonify({"error": "channel_id required"}), 400
 
-    parser = XMLTVParser()
-    session = get_session()
-    try:
-        for source in session.query(EPGSource).all():
-            try:
-                if source.url not in _epg_cache:
-                    _epg_cache[source.url] = XMLTVParser()
-                    _epg_cache[source.url].parse_from_url(source.url)
-                parser = _epg_cache[source.url]
-            except Exception:
-                continue
-
-        now = datetime.utcnow()
-        end = now + timedelta(days=7)
-        progs = parser.get_programmes_by_channel(channel_id, now, end)
-        return jsonify([{
-            "channel": p["channel"],
-            "start": p["start"].isoformat() if p["start"] else None,
-            "stop": p["stop"].isoformat() if p["stop"] else None,
-            "title": p["title"],
-            "desc": p["desc"],
-            "category": p["category"],
-            "icon": p["icon"],
-        } for p in progs])
-    finally:
-        session.close()
+    now = datetime.utcnow()
+    end = now + timedelta(days=7)
+    return jsonify(query_programmes(channel_id, now, end))
 
 @epg_bp.route("/current", methods=["GET"])
 def get_current():
@@ -81,29 +94,29 @@ def get_current():
     if not channel_id:
         return jsonify({"error": "channel_id required"}), 400
 
-    parser = XMLTVParser()
-    session = get_session()
-    try:
-        for source in session.query(EPGSource).all():
-            try:
-                if source.url not in _epg_cache:
-                    _epg_cache[source.url] = XMLTVParser()
-                    _epg_cache[source.url].parse_from_url(source.url)
-                parser = _epg_cache[source.url]
-            except Exception:
-                continue
-
-        p = parser.get_current_programme(channel_id)
-        if not p:
-            return jsonify(None)
-        return jsonify({
-            "channel": p["channel"],
-            "start": p["start"].isoformat() if p["start"] else None,
-            "stop": p["stop"].isoformat() if p["stop"] else None,
-            "title": p["title"],
-            "desc": p["desc"],
-            "category": p["category"],
-            "icon": p["icon"],
-        })
-    finally:
-        session.close()
+    return jsonify(get_current_programme(channel_id))
+
+@epg_bp.route("/now", methods=["GET", "POST"])
+def get_now_playing():
+    """Now/next for many channels at once, e.g. to decorate the channel list.
+
+    Accepts ?channel_ids=a,b,c or a JSON body {"channel_ids": [...]}.
+    """
+    if request.method == "POST":
+        data = request.get_json(silent=True)
+        channel_ids = data.get("channel_ids", []) if isinstance(data, dict) else []
+        # bool is an int subclass, but true/false are not channel IDs
+        if not isinstance(channel_ids, list) or not all(
+            isinstance(c, (str, int)) and not isinstance(c, bool) for c in channel_ids
+        ):
+            return jsonify({"error": "channel_ids must be a list of channel IDs"}), 400
+        channel_ids = [str(c) for c in channel_ids]
+    else:
+        channel_ids = [c for c in request.args.get("channel_ids", "").split(",") if c]
+
+    if not channel_ids:
+        return jsonify({"error": "channel_ids required"}), 400
+    if len(channel_ids) > MAX_BULK_CHANNELS:
+        return jsonify({"error": f"At most {MAX_BULK_CHANNELS} channel_ids per request"}), 400
+
+    return jsonify(get_now_next(channel_ids))
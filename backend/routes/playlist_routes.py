@@ -26,6 +26,13 @@ def get_playlists():
     finally:
         session.close()
 
+@playlist_bp.route("/update-report", methods=["GET"])
+@login_required
+def get_update_report():
+    """Timings of the last scheduled playlist refresh - REQUIRES AUTH"""
+    from models.playlist import get_app_state, UPDATE_REPORT_KEY
+    return jsonify(get_app_state(UPDATE_REPORT_KEY, []))
+
 @playlist_bp.route("/<int:playlist_id>", methods=["GET"])
 @login_required
 def get_playlist(playlist_id: int):
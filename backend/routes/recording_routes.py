@@ -2,14 +2,17 @@ from flask import Blueprint, request, jsonify, send_file
 import subprocess
 import os
 import json
+import signal
+import time
 from datetime import datetime
 import threading
+from sqlalchemy import update
 from middleware.auth_middleware import login_required, password_change_required
+from models.playlist import get_session
+from models.recording import Recording
 
 recording_bp = Blueprint("recording", __name__)
 
-active_recordings = {}
-
 RECORDINGS_DIR = "/app/data/recordings"
 os.makedirs(RECORDINGS_DIR, exist_ok=True)
 
@@ -41,24 +44,30 @@ def start_recording():
         output_path
     ]
     
+    recording_id = f"{channel_name}_{timestamp}"
+    session = get_session()
+    
     try:
+        # ffmpeg's output is not read; a pipe would fill up and stall the recording
         process = subprocess.Popen(
             cmd,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            universal_newlines=True
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL
         )
         
-        recording_id = f"{channel_name}_{timestamp}"
-        active_recordings[recording_id] = {
-            "process": process,
-            "filename": filename,
-            "output_path": output_path,
-            "channel_name": channel_name,
-            "started_at": datetime.now().isoformat(),
-            "duration": duration,
-            "status": "recording"
-        }
+        session.add(Recording(
+            id=recording_id,
+            channel_name=channel_name,
+            stream_url=stream_url,
+            filename=filename,
+            output_path=output_path,
+            duration=duration,
+            pid=process.pid,
+            status="recording"
+        ))
+        session.commit()
+        
+        threading.Thread(target=_watch_recording, args=(recording_id, process), daemon=True).start()
         
         print(f"[RECORDING] Started: {channel_name} -> {filename}")
         
@@ -70,36 +79,98 @@ def start_recording():
         }), 200
         
     except Exception as e:
+        session.rollback()
         print(f"[RECORDING] Error starting: {e}")
         return jsonify({"error": str(e)}), 500
+    finally:
+        session.close()
+
+def _watch_recording(recording_id, process):
+    """Reap the ffmpeg process started by this worker and record its completion"""
+    process.wait()
+    _finish(recording_id, "completed")
+
+def _finish(recording_id, status, only_if_recording=True):
+    session = get_session()
+    try:
+        query = update(Recording).where(Recording.id == recording_id)
+        if only_if_recording:
+            query = query.where(Recording.status == "recording")
+        session.execute(query.values(status=status, finished_at=datetime.utcnow()))
+        session.commit()
+    except Exception as e:
+        session.rollback()
+        print(f"[RECORDING] Error updating {recording_id}: {e}")
+    finally:
+        session.close()
+
+def _recording_alive(pid, output_path):
+    """Whether `pid` is still the ffmpeg process (possibly started by another worker) writing `output_path`.
+    
+    Pids are reused, e.g. after a container restart, so a stored pid is only
+    trusted - and signalled - while its command line is this recording's.
+    """
+    try:
+        with open(f"/proc/{pid}/cmdline", "rb") as f:
+            args = f.read().split(b'\0')
+        with open(f"/proc/{pid}/stat") as f:
+            state = f.read().rsplit(')', 1)[1].split()[0]
+    except (OSError, IndexError):
+        return False
+    
+    # A zombie nobody has reaped yet has finished recording
+    if state == 'Z':
+        return False
+    return os.path.basename(args[0]) == b'ffmpeg' and os.fsencode(output_path) in args
+
+def _current_recordings(session):
+    """All recording rows, with jobs whose ffmpeg has exited (e.g. before a restart) marked completed"""
+    recordings = session.query(Recording).order_by(Recording.started_at.desc()).all()
+    for rec in recordings:
+        if rec.status == "recording" and not (rec.pid and _recording_alive(rec.pid, rec.output_path)):
+            rec.status = "completed"
+            rec.finished_at = datetime.utcnow()
+    session.commit()
+    return recordings
 
 @recording_bp.route("/stop/<recording_id>", methods=["POST"])
 @login_required
 @password_change_required
 def stop_recording(recording_id):
     """Stop recording - REQUIRES AUTH"""
-    if recording_id not in active_recordings:
-        return jsonify({"error": "Recording not found"}), 404
-    
-    recording = active_recordings[recording_id]
-    process = recording["process"]
+    session = get_session()
+    try:
+        recording = session.get(Recording, recording_id)
+        if recording is None:
+            return jsonify({"error": "Recording not found"}), 404
+        filename = recording.filename
+        channel_name = recording.channel_name
+        pid = recording.pid
+        output_path = recording.output_path
+    finally:
+        session.close()
     
     try:
-        process.terminate()
-        process.wait(timeout=5)
+        # The process may belong to another worker, so it is signalled by pid
+        _finish(recording_id, "stopped", only_if_recording=False)
+        if pid and _recording_alive(pid, output_path):
+            os.kill(pid, signal.SIGTERM)
+            deadline = time.monotonic() + 5
+            while _recording_alive(pid, output_path) and time.monotonic() < deadline:
+                time.sleep(0.1)
+        
+            if _recording_alive(pid, output_path):
+                os.kill(pid, signal.SIGKILL)
+                _finish(recording_id, "killed", only_if_recording=False)
+                return jsonify({"message": "Recording force stopped"}), 200
         
-        recording["status"] = "stopped"
-        print(f"[RECORDING] Stopped: {recording['channel_name']}")
+        print(f"[RECORDING] Stopped: {channel_name}")
         
         return jsonify({
             "message": "Recording stopped",
-            "filename": recording["filename"]
+            "filename": filename
         }), 200
         
-    except subprocess.TimeoutExpired:
-        process.kill()
-        recording["status"] = "killed"
-        return jsonify({"message": "Recording force stopped"}), 200
     except Exception as e:
         print(f"[RECORDING] Error stopping: {e}")
         return jsonify({"error": str(e)}), 500
@@ -124,19 +195,15 @@ def list_recordings():
         
         files.sort(key=lambda x: x["created"], reverse=True)
         
+        session = get_session()
+        try:
+            active = [rec.to_dict() for rec in _current_recordings(session) if rec.status == "recording"]
+        finally:
+            session.close()
+        
         return jsonify({
             "recordings": files,
-            "active": [
-                {
-                    "id": rid,
-                    "channel": rec["channel_name"],
-                    "filename": rec["filename"],
-                    "started_at": rec["started_at"],
-                    "status": rec["status"]
-                }
-                for rid, rec in active_recordings.items()
-                if rec["status"] == "recording"
-            ]
+            "active": active
         }), 200
         
     except Exception as e:
@@ -176,21 +243,10 @@ def delete_recording(filename):
 @recording_bp.route("/status", methods=["GET"])
 def recording_status():
     """Get recording status - PUBLIC (for monitoring)"""
-    active = []
-    
-    for recording_id, rec in list(active_recordings.items()):
-        process = rec["process"]
-        
-        if process.poll() is not None:
-            rec["status"] = "completed"
-        
-        active.append({
-            "id": recording_id,
-            "channel": rec["channel_name"],
-            "filename": rec["filename"],
-            "status": rec["status"],
-            "started_at": rec["started_at"],
-            "duration": rec["duration"]
-        })
+    session = get_session()
+    try:
+        active = [rec.to_dict() for rec in _current_recordings(session)]
+    finally:
+        session.close()
     
     return jsonify({"active_recordings": active}), 200
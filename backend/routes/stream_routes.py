@@ -1,10 +1,95 @@
-from flask import Blueprint, request, Response, jsonify
-import requests
-from urllib.parse import urlparse, urljoin
+from flask import Blueprint, request, Response, jsonify, redirect, send_from_directory
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse, parse_qs
+import os
 import re
+import threading
+import time
+
+from http_client import http_session, pool_stats
+from segment_cache import segment_cache, SegmentFetchError
+from manifest_cache import manifest_cache, manifest_ttl
+from manifest_rewriter import rewrite_manifest, PROXY_SEGMENT_PREFIX
+from segment_prefetch import SegmentPrefetcher, live_segment_urls
+from zap_timing import zap_timings
+from upstream_limiter import upstream_limiter, UpstreamBusy
+from restream import restream_hub, RestreamBusy, hls_directory, hls_segmented_elsewhere, mark_hls_viewed, wait_for_hls
+from models.playlist import get_session, Channel
+from middleware.auth_middleware import login_required
 
 stream_bp = Blueprint("stream", __name__)
 
+# Extra counters reported by /stats, e.g. from the asyncio proxy engine (asgi.py)
+stats_providers = {}
+
+# Warms the segment cache with the newest segments of live playlists being watched
+segment_prefetcher = SegmentPrefetcher(segment_cache)
+
+# hls.js starts a live stream this many segments from the end (liveSyncDurationCount)
+LIVE_START_SEGMENTS = 3
+# Channels warmed per /warm request, and warm-ups running at once
+WARM_MAX_CHANNELS = int(os.environ.get("WARM_MAX_CHANNELS", 4))
+WARM_WORKERS = int(os.environ.get("WARM_WORKERS", 4))
+
+def upstream_headers(url):
+    return {
+        "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36",
+        "Referer": urlparse(url).scheme + "://" + urlparse(url).netloc + "/",
+        "Accept": "*/*",
+    }
+
+def playlist_targets(content):
+    """Upstream URLs of the entries of a rewritten playlist, in order"""
+    targets = []
+    for line in content.split('\n'):
+        if line.startswith(PROXY_SEGMENT_PREFIX):
+            targets.extend(parse_qs(urlparse(line).query).get('url', []))
+    return targets
+
+def is_master_playlist(content):
+    return '#EXT-X-STREAM-INF' in content
+
+def first_segment_url(content):
+    """The segment a player starting this (rewritten) media playlist requests first"""
+    targets = playlist_targets(content)
+    if not targets:
+        return None
+    if '#EXT-X-ENDLIST' in content:
+        return targets[0]
+    return targets[max(len(targets) - LIVE_START_SEGMENTS, 0)]
+
+def _cached_manifest(url, headers, queue=True):
+    """Rewritten playlist for `url`, shared by all viewers until its TTL runs out.
+    
+    With queue=False a fetch only uses a spare provider connection and raises
+    UpstreamBusy otherwise.
+    """
+    def fetch():
+        print(f"[MANIFEST] Fetching: {url}")
+        with upstream_limiter.slot(url, queue):
+            resp = http_session.get(url, headers=headers, timeout=15)
+            resp.raise_for_status()
+            content = resp.text
+        segment_prefetcher.schedule(url, live_segment_urls(content, url), upstream_headers)
+        return rewrite_manifest(content, url), manifest_ttl(content)
+    
+    segment_prefetcher.touch(url)
+    return manifest_cache.get(url, fetch)
+
+def _viewer_manifest(url, headers):
+    """Cached playlist for a viewer request, timed as a zap phase"""
+    started = time.monotonic()
+    content = _cached_manifest(url, headers)
+    phase = 'master_manifest' if is_master_playlist(content) else 'media_manifest'
+    zap_timings.record(phase, time.monotonic() - started)
+    return content
+
+def _manifest_response(content):
+    response = Response(content, mimetype='application/vnd.apple.mpegurl')
+    response.headers['Access-Control-Allow-Origin'] = '*'
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
 @stream_bp.route("/manifest", methods=["GET"])
 def stream_manifest():
     """
@@ -14,57 +99,12 @@ def stream_manifest():
     if not url:
         return jsonify({"error": "URL parameter required"}), 400
     
-    print(f"[MANIFEST] Fetching: {url}")
-    
     try:
-        headers = {
-            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36",
-            "Referer": urlparse(url).scheme + "://" + urlparse(url).netloc + "/",
-            "Accept": "*/*",
-        }
-        
-        resp = requests.get(url, headers=headers, timeout=15)
-        resp.raise_for_status()
-        
-        content = resp.text
-        print(f"[MANIFEST] Received {len(content)} bytes")
-        
-        # Get base URL for relative paths
-        base_url = url.rsplit('/', 1)[0] + '/'
-        
-        # Rewrite URLs in the manifest
-        lines = content.split('\n')
-        new_lines = []
-        
-        for line in lines:
-            line = line.strip()
-            
-            # Skip comments and empty lines
-            if line.startswith('#') or not line:
-                new_lines.append(line)
-                continue
-            
-            # This is a URL line
-            if line.startswith('http://') or line.startswith('https://'):
-                # Already absolute URL
-                absolute_url = line
-            else:
-                # Relative URL - make it absolute
-                absolute_url = urljoin(base_url, line)
-            
-            # Rewrite to go through our segment proxy
-            proxied_url = f"/hls-proxy/segment?url={requests.utils.quote(absolute_url, safe='')}"
-            new_lines.append(proxied_url)
-            print(f"[MANIFEST] Rewrite: {line} -> {proxied_url}")
-        
-        rewritten_content = '\n'.join(new_lines)
-        
-        response = Response(rewritten_content, mimetype='application/vnd.apple.mpegurl')
-        response.headers['Access-Control-Allow-Origin'] = '*'
-        response.headers['Cache-Control'] = 'no-cache'
-        
-        print(f"[MANIFEST] Returning rewritten manifest")
-        return response
+        return _manifest_response(_viewer_manifest(url, upstream_headers(url)))
+    
+    except UpstreamBusy as e:
+        print(f"[MANIFEST] Error: {e}")
+        return jsonify({"error": str(e)}), e.status
         
     except Exception as e:
         print(f"[MANIFEST] Error: {e}")
@@ -85,18 +125,31 @@ def stream_segment():
     print(f"[SEGMENT] Fetching: {url}")
     
     try:
-        headers = {
-            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36",
-            "Referer": urlparse(url).scheme + "://" + urlparse(url).netloc + "/",
-            "Accept": "*/*",
-        }
+        headers = upstream_headers(url)
         
         # Add Range header if present
         if request.headers.get('Range'):
             headers['Range'] = request.headers.get('Range')
         
-        resp = requests.get(url, headers=headers, stream=True, timeout=30)
-        resp.raise_for_status()
+        # Nested (media) playlists are reloaded by every viewer; serve them
+        # from the manifest cache
+        elif urlparse(url).path.endswith('.m3u8'):
+            return _manifest_response(_viewer_manifest(url, headers))
+        
+        # Whole segments are shared between viewers through the segment cache;
+        # byte ranges go straight to the upstream
+        else:
+            response = _cached_segment_response(url, headers)
+            if response is not None:
+                return response
+        
+        host = upstream_limiter.acquire(url)
+        try:
+            resp = http_session.get(url, headers=headers, stream=True, timeout=30)
+            resp.raise_for_status()
+        except Exception:
+            upstream_limiter.release(host)
+            raise
         
         print(f"[SEGMENT] Got response: {resp.status_code}, Content-Type: {resp.headers.get('Content-Type')}")
         
@@ -104,31 +157,11 @@ def stream_segment():
         content_type = resp.headers.get('Content-Type', '')
         if 'mpegurl' in content_type or url.endswith('.m3u8'):
             # This is a nested manifest, rewrite it too
-            content = resp.text
-            base_url = url.rsplit('/', 1)[0] + '/'
-            
-            lines = content.split('\n')
-            new_lines = []
-            
-            for line in lines:
-                line = line.strip()
-                if line.startswith('#') or not line:
-                    new_lines.append(line)
-                    continue
-                
-                if line.startswith('http://') or line.startswith('https://'):
-                    absolute_url = line
-                else:
-                    absolute_url = urljoin(base_url, line)
-                
-                proxied_url = f"/hls-proxy/segment?url={requests.utils.quote(absolute_url, safe='')}"
-                new_lines.append(proxied_url)
-            
-            rewritten_content = '\n'.join(new_lines)
-            response = Response(rewritten_content, mimetype='application/vnd.apple.mpegurl')
-            response.headers['Access-Control-Allow-Origin'] = '*'
-            response.headers['Cache-Control'] = 'no-cache'
-            return response
+            try:
+                content = resp.text
+            finally:
+                upstream_limiter.release(host)
+            return _manifest_response(rewrite_manifest(content, url))
         
         # Regular segment - stream it
         def generate():
@@ -136,7 +169,14 @@ def stream_segment():
                 if chunk:
                     yield chunk
         
+        def close():
+            # Runs when the response ends, also on client disconnect: hands the
+            # connection back to the pool and the slot to the next request
+            resp.close()
+            upstream_limiter.release(host)
+        
         response = Response(generate(), status=resp.status_code)
+        response.call_on_close(close)
         
         # Copy headers
         for header in ['Content-Type', 'Content-Length', 'Content-Range', 'Accept-Ranges']:
@@ -149,8 +189,237 @@ def stream_segment():
         print(f"[SEGMENT] Streaming segment")
         return response
         
+    except (SegmentFetchError, UpstreamBusy) as e:
+        print(f"[SEGMENT] Error: {e}")
+        return jsonify({"error": str(e)}), e.status
+    
     except Exception as e:
         print(f"[SEGMENT] Error: {e}")
         import traceback
         traceback.print_exc()
         return jsonify({"error": str(e)}), 500
+
+
+def _cached_segment_response(url, headers):
+    """Stream a segment through the shared cache, or None if it turns out to be a playlist"""
+    started = time.monotonic()
+    entry = segment_cache.open(url, headers)
+    status, segment_headers = segment_cache.wait_headers(entry)
+    
+    if 'mpegurl' in segment_headers.get('Content-Type', ''):
+        segment_cache.discard(entry)
+        return None
+    
+    zap_timings.record('segment_first_byte', time.monotonic() - started)
+    
+    response = Response(segment_cache.iter_body(entry), status=status)
+    for header, value in segment_headers.items():
+        response.headers[header] = value
+    
+    response.headers['Access-Control-Allow-Origin'] = '*'
+    response.headers['Cache-Control'] = 'public, max-age=3600'
+    return response
+
+
+def is_restreamable(url):
+    """Whether `url` may be restreamed: the http(s) stream URL of a stored channel"""
+    if urlparse(url).scheme not in ('http', 'https'):
+        return False
+    if restream_hub.running(url):
+        return True
+    
+    session = get_session()
+    try:
+        return session.query(Channel.id).filter(Channel.stream_url == url).first() is not None
+    finally:
+        session.close()
+
+
+@stream_bp.route("/restream", methods=["GET"])
+@login_required
+def restream():
+    """
+    Serve a raw MPEG-TS channel from its shared restream, so all viewers of
+    the channel cost one upstream connection.
+    """
+    url = request.args.get("url")
+    if not url:
+        return jsonify({"error": "URL parameter required"}), 400
+    if not is_restreamable(url):
+        return jsonify({"error": "Not a channel stream URL"}), 403
+    
+    try:
+        channel = restream_hub.channel(url)
+    except RestreamBusy as e:
+        return jsonify({"error": str(e)}), e.status
+    response = Response(channel.iter_chunks(), mimetype='video/mp2t')
+    response.headers['Access-Control-Allow-Origin'] = '*'
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+
+@stream_bp.route("/restream/hls", methods=["GET"])
+@login_required
+def restream_hls():
+    """
+    Local HLS playlist of a restreamed TS channel, for players that only speak HLS.
+    """
+    url = request.args.get("url")
+    if not url:
+        return jsonify({"error": "URL parameter required"}), 400
+    if not is_restreamable(url):
+        return jsonify({"error": "Not a channel stream URL"}), 403
+    
+    key = restream_hub.channel_key(url)
+    if restream_hub.get(key) is None and hls_segmented_elsewhere(key):
+        # Another server process is restreaming it; its files are shared
+        channel = None
+    else:
+        try:
+            channel = restream_hub.channel(url, hls=True)
+        except RestreamBusy as e:
+            return jsonify({"error": str(e)}), e.status
+    
+    if not wait_for_hls(key, channel):
+        error = channel.error if channel is not None else None
+        return jsonify({"error": error or "Restream did not start in time"}), 504
+    
+    # Relative, so it also resolves behind the /hls-proxy/ prefix
+    return redirect(f"{key}/index.m3u8")
+
+
+@stream_bp.route("/restream/<key>/<name>", methods=["GET"])
+@login_required
+def restream_hls_file(key, name):
+    """Playlist and segments written by a restream's HLS segmenter"""
+    # Keys are hashes; anything else could point outside the restream directory
+    if not re.fullmatch(r'[0-9a-f]{16}', key):
+        return jsonify({"error": "Restream not running"}), 404
+    
+    directory = hls_directory(key)
+    if not os.path.isdir(directory):
+        return jsonify({"error": "Restream not running"}), 404
+    
+    # HLS viewers keep the channel alive by fetching, whichever process serves them
+    mark_hls_viewed(key)
+    if name.endswith('.m3u8'):
+        response = send_from_directory(directory, name, mimetype='application/vnd.apple.mpegurl')
+        response.headers['Cache-Control'] = 'no-cache'
+    else:
+        response = send_from_directory(directory, name, mimetype='video/mp2t')
+    response.headers['Access-Control-Allow-Origin'] = '*'
+    return response
+
+
+@stream_bp.route("/stats", methods=["GET"])
+@login_required
+def stream_stats():
+    """Upstream connection pool and limits, cache, prefetch, restream and channel switch timing counters"""
+    stats = {
+        "http_pool": pool_stats(),
+        "segment_cache": segment_cache.stats(),
+        "manifest_cache": manifest_cache.stats(),
+        "segment_prefetch": segment_prefetcher.stats(),
+        "zap_timings": zap_timings.stats(),
+        "upstream_limits": upstream_limiter.stats(),
+        "restream": restream_hub.stats(),
+    }
+    for name, provider in stats_providers.items():
+        stats[name] = provider()
+    return jsonify(stats)
+
+
+def warm_channel(url):
+    """Resolve a channel's master and variant playlists and fetch the segment a player starts with.
+    
+    Afterwards switching to the channel is served from the caches, with the
+    upstream connections already open. Other worker processes find the
+    segment too when SEGMENT_CACHE_DIR is set; the playlists stay per process.
+    Like prefetches, warm-ups only use spare provider connections: UpstreamBusy
+    ends one when none is free.
+    """
+    started = time.monotonic()
+    content = _cached_manifest(url, upstream_headers(url), queue=False)
+    
+    if is_master_playlist(content):
+        zap_timings.record('warm_master_manifest', time.monotonic() - started)
+        variants = playlist_targets(content)
+        if not variants:
+            return
+        
+        # hls.js starts with the first variant listed
+        phase_started = time.monotonic()
+        content = _cached_manifest(variants[0], upstream_headers(variants[0]), queue=False)
+    else:
+        phase_started = started
+    zap_timings.record('warm_media_manifest', time.monotonic() - phase_started)
+    
+    segment = first_segment_url(content)
+    if segment:
+        phase_started = time.monotonic()
+        # Possibly already downloading through the playlist's prefetch
+        entry = segment_cache.prefetch(segment, upstream_headers(segment)) or segment_cache.get(segment)
+        if entry is not None:
+            segment_cache.wait_done(entry)
+        zap_timings.record('warm_first_segment', time.monotonic() - phase_started)
+    
+    zap_timings.record('warm_total', time.monotonic() - started)
+
+# The asyncio engine (async_proxy) replaces this so channels are warmed in
+# the caches that serve its requests
+channel_warmer = warm_channel
+
+warm_executor = ThreadPoolExecutor(max_workers=WARM_WORKERS, thread_name_prefix='warm')
+_warming = set()
+_warming_lock = threading.Lock()
+
+def _warm_in_background(url):
+    try:
+        channel_warmer(url)
+    except UpstreamBusy:
+        print(f"[WARM] Skipped {url}: no spare provider connection")
+    except Exception as e:
+        print(f"[WARM] Error warming {url}: {e}")
+    finally:
+        with _warming_lock:
+            _warming.discard(url)
+
+@stream_bp.route("/warm", methods=["POST"])
+@login_required
+def warm_channels():
+    """Warm up channels the viewer is likely to switch to next, e.g. the ones next to the current channel"""
+    data = request.get_json(silent=True)
+    channel_ids = data.get("channel_ids", []) if isinstance(data, dict) else []
+    
+    # A string would be iterated by character; true/false are not channel IDs
+    if not isinstance(channel_ids, list) or any(isinstance(i, bool) for i in channel_ids):
+        return jsonify({"error": "channel_ids must be a list of channel IDs"}), 400
+    try:
+        channel_ids = [int(i) for i in channel_ids][:WARM_MAX_CHANNELS]
+    except (TypeError, ValueError):
+        return jsonify({"error": "channel_ids must be a list of channel IDs"}), 400
+    
+    if not channel_ids:
+        return jsonify({"error": "No channel IDs provided"}), 400
+    
+    session = get_session()
+    try:
+        rows = session.query(Channel.id, Channel.stream_url).filter(Channel.id.in_(channel_ids)).all()
+    finally:
+        session.close()
+    
+    warming = []
+    for channel_id, url in rows:
+        # Only HLS playlists; fetching a raw MPEG-TS stream as a playlist never finishes
+        if not url or not urlparse(url).path.endswith('.m3u8'):
+            continue
+        
+        with _warming_lock:
+            if url in _warming:
+                continue
+            _warming.add(url)
+        
+        warm_executor.submit(_warm_in_background, url)
+        warming.append(channel_id)
+    
+    return jsonify({"warming": warming}), 202
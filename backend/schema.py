@@ -0,0 +1,77 @@
+"""
+Versioned schema upgrades for the SQLite database.
+
+create_all() creates missing tables together with their indexes, but leaves
+tables that already exist alone, and migrate_db.py only adds missing columns.
+This layer covers the rest on every start:
+
+- indexes declared on the models (Index in __table_args__) are created on
+  existing tables that lack them;
+- numbered migrations for everything else (backfills, table rewrites) run
+  once each, in order, tracked in SQLite's user_version.
+
+To change the schema, declare new indexes on the model, or append a
+migration with the next version number; never renumber or edit one that has
+shipped.
+"""
+
+from sqlalchemy import inspect, select, text
+
+MIGRATIONS = []
+
+def migration(version, description):
+    """Register `func(conn)` as the upgrade to schema `version`"""
+    def register(func):
+        MIGRATIONS.append((version, description, func))
+        return func
+    return register
+
+def schema_version(conn):
+    return conn.execute(text("PRAGMA user_version")).scalar()
+
+def ensure_indexes(conn, metadata):
+    """Create the declared indexes missing from existing tables; returns their names"""
+    inspector = inspect(conn)
+    tables = set(inspector.get_table_names())
+    created = []
+
+    for table in metadata.sorted_tables:
+        if table.name not in tables:
+            continue
+        existing = {index['name'] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing:
+                print(f"Creating index {index.name}...")
+                index.create(conn)
+                created.append(index.name)
+
+    return created
+
+def upgrade(engine):
+    """Bring the database schema up to date"""
+    from models.playlist import Base
+
+    with engine.begin() as conn:
+        created = ensure_indexes(conn, Base.metadata)
+        current = schema_version(conn)
+
+        for version, description, func in sorted(MIGRATIONS, key=lambda m: m[0]):
+            if version <= current:
+                continue
+            print(f"Upgrading schema to version {version}: {description}...")
+            func(conn)
+            conn.execute(text(f"PRAGMA user_version = {int(version)}"))
+            current = version
+
+        if created:
+            # Statistics let the planner choose between the new indexes
+            conn.execute(text("ANALYZE"))
+
+    print(f"✓ Database schema at version {current}")
+    return current
+
+@migration(1, "build the channel group catalogue")
+def _build_channel_groups(conn):
+    from models.playlist import Playlist, refresh_channel_groups
+
+    refresh_channel_groups(conn, conn.execute(select(Playlist.id)).scalars().all())
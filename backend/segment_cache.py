@@ -0,0 +1,429 @@
+"""
+Shared cache for proxied HLS segments.
+
+Viewers of the same live channel request the same segment URLs within a few
+seconds of each other. The first request starts a single upstream fetch; every
+request for that URL (including ones arriving while it is still downloading)
+streams from the same buffer. Finished segments are kept in an LRU bounded by
+size and a TTL roughly the length of a live window, optionally on disk.
+
+On disk (SEGMENT_CACHE_DIR) a finished segment is published under a name
+derived from its URL, and a process that misses in its own index adopts a
+copy another worker published before going upstream. Segments fetched by a
+/warm request or a prefetch in one worker process therefore serve viewers
+whose requests land on another; playlists are still cached per process.
+
+A body larger than SEGMENT_CACHE_MAX_ENTRY_MB (a VOD file, or a raw TS stream
+that never ends) is not a segment worth sharing: the fetch stops and leaves
+the cache, and each of its readers continues with its own upstream request.
+"""
+
+from collections import OrderedDict, namedtuple
+import glob
+import hashlib
+import json
+import os
+import threading
+import time
+
+from http_client import http_session
+from upstream_limiter import upstream_limiter, UpstreamBusy
+
+# Total size of cached segments and how long one stays useful (about one live window)
+SEGMENT_CACHE_MAX_BYTES = int(os.environ.get("SEGMENT_CACHE_MAX_MB", 256)) * 1024 * 1024
+SEGMENT_CACHE_TTL = int(os.environ.get("SEGMENT_CACHE_TTL", 60))
+# When set, finished segments are written here instead of kept in memory, shared by all worker processes
+SEGMENT_CACHE_DIR = os.environ.get("SEGMENT_CACHE_DIR", "")
+# Largest body buffered for sharing; anything bigger is passed through
+SEGMENT_CACHE_MAX_ENTRY_BYTES = int(os.environ.get("SEGMENT_CACHE_MAX_ENTRY_MB", 32)) * 1024 * 1024
+
+FETCH_CHUNK_SIZE = 64 * 1024
+# Upstream response headers kept with a segment and replayed to clients
+KEPT_HEADERS = ('Content-Type', 'Content-Length', 'Accept-Ranges')
+
+class SegmentFetchError(Exception):
+    def __init__(self, message, status=502):
+        super().__init__(message)
+        self.status = status
+
+# A segment found in the shared directory; `file` is positioned at the body
+PublishedSegment = namedtuple('PublishedSegment', 'file path status headers size age')
+
+def _published_path(directory, url):
+    return os.path.join(directory, hashlib.sha1(url.encode('utf-8')).hexdigest() + '.seg')
+
+def publish_segment(directory, url, status, headers, body):
+    """Write a finished segment for every worker process; returns (path, inode) for remove_published"""
+    path = _published_path(directory, url)
+    tmp = f"{path}.{os.urandom(4).hex()}.tmp"
+    with open(tmp, 'wb') as f:
+        # One JSON line with the response metadata, then the body
+        f.write(json.dumps({'status': status, 'headers': headers}).encode('utf-8') + b'\n')
+        f.write(body)
+    inode = os.stat(tmp).st_ino
+    os.replace(tmp, path)
+    return path, inode
+
+def open_published(directory, url, ttl):
+    """The segment published for `url` if it is younger than `ttl`, else None"""
+    path = _published_path(directory, url)
+    try:
+        f = open(path, 'rb')
+    except OSError:
+        return None
+    try:
+        st = os.fstat(f.fileno())
+        age = time.time() - st.st_mtime
+        meta = json.loads(f.readline()) if age <= ttl else None
+    except (OSError, ValueError):
+        meta = None
+    if meta is None:
+        f.close()
+        return None
+    return PublishedSegment(f, path, meta['status'], meta['headers'], st.st_size - f.tell(), age)
+
+def remove_published(path, inode):
+    """Delete a segment this process published, unless another one has replaced it since"""
+    try:
+        if os.stat(path).st_ino == inode:
+            os.remove(path)
+    except OSError:
+        pass
+
+def sweep_published(directory, ttl):
+    """Delete expired segments and partial writes, e.g. left behind by a worker that exited"""
+    cutoff = time.time() - ttl
+    for path in glob.glob(os.path.join(directory, '*.seg')) + glob.glob(os.path.join(directory, '*.tmp')):
+        try:
+            if os.stat(path).st_mtime < cutoff:
+                os.remove(path)
+        except OSError:
+            pass
+
+class CachedSegment:
+    """One segment, possibly still downloading. Readers wait on `cond` for more data."""
+
+    def __init__(self, url):
+        self.url = url
+        self.buffer = bytearray()
+        self.path = None
+        # (path, inode) of the file this process published, removed with the entry
+        self.published = None
+        self.status = None
+        self.headers = {}
+        self.error = None
+        self.done = False
+        # Too large to cache; readers pass the rest through from upstream
+        self.oversized = False
+        self.request_headers = {}
+        self.size = 0
+        self.accounted = 0
+        self.created = time.monotonic()
+        self.cond = threading.Condition()
+
+class SegmentIndex:
+    """Cached segments by URL, with the expiry and size limits of the cache.
+
+    The policy shared by SegmentCache and the asyncio engine (async_proxy),
+    whose entries have the same fields (url, done, error, created, accounted,
+    published). Not locked: SegmentCache calls it under its lock, the asyncio
+    engine from the event loop. `remove` deletes a published copy; the
+    asyncio engine passes one that does not block the loop.
+    """
+
+    def __init__(self, max_bytes=SEGMENT_CACHE_MAX_BYTES, ttl=SEGMENT_CACHE_TTL, remove=remove_published):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.bytes = 0
+        self.evictions = 0
+        self._remove = remove
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def lookup(self, url):
+        """The live entry for `url`, or None; failed and expired ones are dropped"""
+        entry = self._entries.get(url)
+        if entry is not None and (entry.error or (entry.done and self.expired(entry))):
+            self.drop(entry)
+            return None
+        return entry
+
+    def expired(self, entry):
+        return time.monotonic() - entry.created > self.ttl
+
+    def add(self, entry):
+        self._entries[entry.url] = entry
+
+    def touch(self, entry):
+        self._entries.move_to_end(entry.url)
+
+    def holds(self, entry):
+        return self._entries.get(entry.url) is entry
+
+    def account(self, entry, size):
+        """Count a finished entry and evict what no longer fits; False if it was dropped meanwhile"""
+        if not self.holds(entry):
+            return False
+        entry.accounted = size
+        self.bytes += size
+        self.evict()
+        return True
+
+    def drop(self, entry):
+        """Forget the entry, and delete the copy it published, if any"""
+        if self.holds(entry):
+            del self._entries[entry.url]
+            self.bytes -= entry.accounted
+        if entry.published:
+            self._remove(*entry.published)
+            entry.published = None
+
+    def evict(self):
+        for entry in [e for e in self._entries.values() if e.done and self.expired(e)]:
+            self.drop(entry)
+            self.evictions += 1
+
+        while self.bytes > self.max_bytes:
+            oldest = next((e for e in self._entries.values() if e.done), None)
+            if oldest is None:
+                break
+            self.drop(oldest)
+            self.evictions += 1
+
+class SegmentCache:
+    def __init__(self, max_bytes=SEGMENT_CACHE_MAX_BYTES, ttl=SEGMENT_CACHE_TTL, directory=SEGMENT_CACHE_DIR,
+                 max_entry_bytes=SEGMENT_CACHE_MAX_ENTRY_BYTES):
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes
+        self.ttl = ttl
+        self.directory = directory or None
+        if self.directory:
+            os.makedirs(self.directory, exist_ok=True)
+            sweep_published(self.directory, ttl)
+
+        self._index = SegmentIndex(max_bytes, ttl)
+        self._lock = threading.Lock()
+        self._counters = {'hits': 0, 'misses': 0, 'coalesced': 0, 'prefetches': 0, 'errors': 0,
+                          'oversized': 0, 'shared_hits': 0}
+
+    def open(self, url, headers):
+        """Return the entry for `url`, starting an upstream fetch on a miss"""
+        with self._lock:
+            entry = self._index.lookup(url)
+            if entry is not None:
+                self._index.touch(entry)
+                self._counters['hits' if entry.done else 'coalesced'] += 1
+                return entry
+
+            entry = CachedSegment(url)
+            self._index.add(entry)
+            self._counters['misses'] += 1
+
+        threading.Thread(target=self._fetch, args=(entry, headers), daemon=True).start()
+        return entry
+
+    def prefetch(self, url, headers):
+        """Start fetching `url` ahead of any request; returns None if it is already cached or downloading"""
+        with self._lock:
+            if self._index.lookup(url) is not None:
+                return None
+            entry = CachedSegment(url)
+            self._index.add(entry)
+            self._counters['prefetches'] += 1
+
+        # Prefetches only use spare provider connections
+        threading.Thread(target=self._fetch, args=(entry, headers, False), daemon=True).start()
+        return entry
+
+    def get(self, url):
+        """The entry cached or downloading for `url`, or None; not counted as a lookup"""
+        with self._lock:
+            return self._index.lookup(url)
+
+    def wait_done(self, entry, timeout=60):
+        """Block until the download finishes; True if it completed successfully"""
+        with entry.cond:
+            entry.cond.wait_for(lambda: entry.done or entry.error or entry.oversized, timeout)
+            return entry.done and not entry.error
+
+    def wait_headers(self, entry, timeout=30):
+        """Block until the upstream status is known; raises SegmentFetchError on failure"""
+        with entry.cond:
+            entry.cond.wait_for(lambda: entry.status is not None or entry.error, timeout)
+        if entry.error:
+            raise SegmentFetchError(entry.error, entry.status or 502)
+        if entry.status is None:
+            raise SegmentFetchError("Timed out waiting for upstream", 504)
+        return entry.status, entry.headers
+
+    def iter_body(self, entry):
+        """Yield the segment body, following the download while it is in progress"""
+        with entry.cond:
+            buffer = entry.buffer
+
+        pos = 0
+        while True:
+            with entry.cond:
+                entry.cond.wait_for(lambda: len(buffer) > pos or entry.done or entry.error or entry.oversized)
+                if entry.error and len(buffer) <= pos:
+                    raise SegmentFetchError(entry.error, entry.status or 502)
+                chunk = bytes(buffer[pos:])
+                finished = entry.done
+                oversized = entry.oversized
+                # Written to disk before this reader started, or adopted from another worker
+                on_disk = entry.path is not None and buffer is entry.buffer
+            if chunk:
+                pos += len(chunk)
+                yield chunk
+            elif on_disk:
+                yield from self._iter_file(entry)
+                return
+            elif oversized:
+                yield from self._passthrough(entry)
+                return
+            elif finished:
+                return
+
+    def _iter_file(self, entry):
+        try:
+            f = open(entry.path, 'rb')
+            f.readline()
+        except OSError:
+            # Evicted by another worker process in the meantime
+            yield from self._passthrough(entry)
+            return
+        with f:
+            for chunk in iter(lambda: f.read(FETCH_CHUNK_SIZE), b''):
+                yield chunk
+
+    def _passthrough(self, entry):
+        """The rest of an oversized body, read straight from upstream.
+
+        A body with a known length is found oversized before any of it is
+        read, so it is simply fetched again. One without a length outgrows
+        the cache while readers are part way through; that is a live stream,
+        which just continues where the new request joins it.
+        """
+        with upstream_limiter.slot(entry.url), \
+                http_session.get(entry.url, headers=entry.request_headers, stream=True, timeout=30) as resp:
+            if resp.status_code >= 400:
+                raise SegmentFetchError(f"Upstream returned {resp.status_code}", resp.status_code)
+            for chunk in resp.iter_content(chunk_size=FETCH_CHUNK_SIZE):
+                if chunk:
+                    yield chunk
+
+    def discard(self, entry):
+        """Forget an entry that should not be shared (e.g. a playlist)"""
+        with self._lock:
+            self._index.drop(entry)
+
+    def _fetch(self, entry, headers, queue=True):
+        entry.request_headers = headers
+        if self.directory and self._adopt(entry):
+            return
+        try:
+            with upstream_limiter.slot(entry.url, queue), \
+                    http_session.get(entry.url, headers=headers, stream=True, timeout=30) as resp:
+                if resp.status_code >= 400:
+                    raise SegmentFetchError(f"Upstream returned {resp.status_code}", resp.status_code)
+
+                with entry.cond:
+                    entry.headers = {h: resp.headers[h] for h in KEPT_HEADERS if h in resp.headers}
+                    entry.status = resp.status_code
+                    entry.cond.notify_all()
+
+                length = resp.headers.get('Content-Length', '')
+                if length.isdigit() and int(length) > self.max_entry_bytes:
+                    return self._oversize(entry)
+
+                for chunk in resp.iter_content(chunk_size=FETCH_CHUNK_SIZE):
+                    if chunk:
+                        with entry.cond:
+                            entry.buffer.extend(chunk)
+                            entry.cond.notify_all()
+                        if len(entry.buffer) > self.max_entry_bytes:
+                            return self._oversize(entry)
+
+            self._complete(entry)
+
+        except Exception as e:
+            with entry.cond:
+                entry.error = str(e)
+                if isinstance(e, (SegmentFetchError, UpstreamBusy)):
+                    entry.status = e.status
+                entry.cond.notify_all()
+            with self._lock:
+                self._counters['errors'] += 1
+                self._index.drop(entry)
+
+    def _oversize(self, entry):
+        """Stop fetching a body too large to cache; its readers pass the rest through"""
+        with entry.cond:
+            entry.oversized = True
+            entry.cond.notify_all()
+        with self._lock:
+            self._counters['oversized'] += 1
+            self._index.drop(entry)
+        print(f"[SEGMENT-CACHE] Too large to cache, passing through: {entry.url}")
+
+    def _adopt(self, entry):
+        """Use the copy of a segment another worker process published, if there is one"""
+        published = open_published(self.directory, entry.url, self.ttl)
+        if published is None:
+            return False
+        published.file.close()
+
+        with entry.cond:
+            entry.status = published.status
+            entry.headers = published.headers
+            entry.size = published.size
+            entry.created = time.monotonic() - published.age
+            entry.path = published.path
+            entry.done = True
+            entry.cond.notify_all()
+
+        with self._lock:
+            self._counters['shared_hits'] += 1
+            self._index.account(entry, entry.size)
+        return True
+
+    def _complete(self, entry):
+        path = None
+        if self.directory:
+            # A refetched URL replaces the file; the entry it replaces only removes its own
+            entry.published = publish_segment(self.directory, entry.url, entry.status, entry.headers, entry.buffer)
+            path = entry.published[0]
+
+        with entry.cond:
+            entry.size = len(entry.buffer)
+            entry.created = time.monotonic()
+            entry.done = True
+            if path:
+                # Readers already streaming keep their reference to the buffer
+                entry.path = path
+                entry.buffer = bytearray()
+            entry.cond.notify_all()
+
+        with self._lock:
+            if not self._index.account(entry, entry.size):
+                # Dropped while it was being written
+                self._index.drop(entry)
+
+    def stats(self):
+        with self._lock:
+            lookups = self._counters['hits'] + self._counters['coalesced'] + self._counters['misses']
+            return {
+                **self._counters,
+                'evictions': self._index.evictions,
+                'hit_rate': round((lookups - self._counters['misses']) / lookups, 3) if lookups else None,
+                'entries': len(self._index),
+                'bytes': self._index.bytes,
+                'max_bytes': self.max_bytes,
+                'max_entry_bytes': self.max_entry_bytes,
+                'ttl': self.ttl,
+                'disk': self.directory is not None,
+            }
+
+segment_cache = SegmentCache()
@@ -0,0 +1,169 @@
+"""
+Background prefetch of live HLS segments.
+
+A player only starts downloading a segment once it asks for it, so a slow
+upstream response stalls playback. When the proxy fetches a live media
+playlist it can warm the segment cache with the newest segments, which are the
+ones a joining viewer requests first and the ones every viewer requests next.
+
+Prefetching is bounded per channel (at most SEGMENT_PREFETCH_COUNT segments
+queued, downloaded one at a time) and stops once nobody has requested the
+channel's playlist for SEGMENT_PREFETCH_IDLE seconds.
+"""
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import os
+import threading
+import time
+from urllib.parse import urljoin
+
+# Newest segments to prefetch per live playlist (0 disables prefetching)
+SEGMENT_PREFETCH_COUNT = int(os.environ.get("SEGMENT_PREFETCH_COUNT", 3))
+# Seconds without a playlist request after which a channel's prefetching stops
+SEGMENT_PREFETCH_IDLE = int(os.environ.get("SEGMENT_PREFETCH_IDLE", 30))
+# Channels prefetching at the same time
+SEGMENT_PREFETCH_WORKERS = int(os.environ.get("SEGMENT_PREFETCH_WORKERS", 8))
+
+def live_segment_urls(content, url, count=SEGMENT_PREFETCH_COUNT):
+    """Absolute URLs of the newest `count` segments of a live media playlist.
+
+    Master playlists and finished (VOD) playlists give an empty list; a VOD
+    viewer starts at the beginning, not the end.
+    """
+    if count <= 0 or '#EXT-X-ENDLIST' in content or '#EXT-X-STREAM-INF' in content:
+        return []
+
+    base_url = url.rsplit('/', 1)[0] + '/'
+    segments = []
+    after_extinf = False
+    for line in content.split('\n'):
+        line = line.strip()
+        if line.startswith('#EXTINF'):
+            after_extinf = True
+        elif line and not line.startswith('#') and after_extinf:
+            segments.append(urljoin(base_url, line))
+            after_extinf = False
+    return segments[-count:]
+
+class PrefetchChannel:
+    """Prefetch state of one live playlist"""
+
+    def __init__(self):
+        self.last_requested = time.monotonic()
+        self.pending = deque()
+        self.running = False
+
+    def idle(self, idle_seconds=SEGMENT_PREFETCH_IDLE):
+        return time.monotonic() - self.last_requested > idle_seconds
+
+class PrefetchChannels:
+    """Which segments to prefetch next, per live playlist.
+
+    The policy shared by SegmentPrefetcher (worker threads) and the asyncio
+    engine (async_proxy), which only differ in how they download a segment.
+    """
+
+    def __init__(self, idle_seconds=SEGMENT_PREFETCH_IDLE):
+        self.idle_seconds = idle_seconds
+        self._channels = {}
+        self._lock = threading.Lock()
+        self._counters = {'scheduled': 0, 'prefetched': 0, 'cancelled': 0, 'errors': 0}
+
+    def touch(self, playlist_url):
+        """Record that a viewer requested the playlist"""
+        with self._lock:
+            channel = self._channels.get(playlist_url)
+            if channel is not None:
+                channel.last_requested = time.monotonic()
+
+    def schedule(self, playlist_url, segment_urls):
+        """Queue the newest segments of a freshly fetched playlist.
+
+        Returns the channel if a downloader has to be started for it, None if
+        one is already running or there is nothing to fetch.
+        """
+        if not segment_urls:
+            return None
+
+        with self._lock:
+            for url in [u for u, c in self._channels.items() if not c.running and c.idle(self.idle_seconds)]:
+                del self._channels[url]
+
+            channel = self._channels.get(playlist_url)
+            if channel is None:
+                channel = self._channels[playlist_url] = PrefetchChannel()
+            channel.last_requested = time.monotonic()
+            # Segments still queued from the previous playlist are replaced by the newest ones
+            channel.pending = deque(segment_urls)
+            self._counters['scheduled'] += len(segment_urls)
+
+            if channel.running:
+                return None
+            channel.running = True
+            return channel
+
+    def next_url(self, channel):
+        """The segment the channel's downloader fetches next, or None when it should stop"""
+        with self._lock:
+            if channel.pending and channel.idle(self.idle_seconds):
+                self._counters['cancelled'] += len(channel.pending)
+                channel.pending.clear()
+            if not channel.pending:
+                channel.running = False
+                return None
+            return channel.pending.popleft()
+
+    def record(self, prefetched):
+        """Count a finished download: complete, or failed (also too large to cache)"""
+        with self._lock:
+            self._counters['prefetched' if prefetched else 'errors'] += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                **self._counters,
+                'channels': len(self._channels),
+                'active': sum(1 for c in self._channels.values() if c.running),
+                'count': SEGMENT_PREFETCH_COUNT,
+            }
+
+class SegmentPrefetcher:
+    """Warms a SegmentCache from worker threads"""
+
+    def __init__(self, cache, workers=SEGMENT_PREFETCH_WORKERS, idle_seconds=SEGMENT_PREFETCH_IDLE):
+        self.cache = cache
+        self.channels = PrefetchChannels(idle_seconds)
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='prefetch')
+
+    def touch(self, playlist_url):
+        """Record that a viewer requested the playlist"""
+        self.channels.touch(playlist_url)
+
+    def schedule(self, playlist_url, segment_urls, headers_for):
+        """Queue the newest segments of a freshly fetched playlist.
+
+        `headers_for(url)` gives the upstream request headers for a segment.
+        """
+        channel = self.channels.schedule(playlist_url, segment_urls)
+        if channel is not None:
+            self._executor.submit(self._run, channel, headers_for)
+
+    def _run(self, channel, headers_for):
+        while True:
+            url = self.channels.next_url(channel)
+            if url is None:
+                return
+
+            try:
+                entry = self.cache.prefetch(url, headers_for(url))
+                if entry is None:
+                    continue
+                prefetched = self.cache.wait_done(entry)
+            except Exception as e:
+                print(f"[PREFETCH] Error: {e}")
+                prefetched = False
+            self.channels.record(prefetched)
+
+    def stats(self):
+        return self.channels.stats()
@@ -0,0 +1,326 @@
+"""
+Per-provider cap on concurrent upstream requests.
+
+IPTV providers limit how many connections an account may hold and answer
+403/509 beyond that, so the proxy keeps the requests it has in flight to each
+upstream host under a configured cap. Requests over the cap wait in a FIFO
+queue for a slot (up to UPSTREAM_QUEUE_TIMEOUT) instead of being sent and
+refused; a freed slot goes straight to the next waiter. Requests for the same
+segment or playlist are already shared by the segment and manifest caches, so
+a queued request is one no other viewer is waiting for.
+
+The same limiter serves the threaded routes and the asyncio engine, so both
+count against one budget. Each server process (WEB_CONCURRENCY) gets an equal
+share of a host's cap. A cap that does not divide evenly between the processes
+(e.g. 3 for 2 processes, or 1 for 4) is instead held as that many lock files
+in UPSTREAM_LOCK_DIR, which the processes take in turns; each process sends at
+most its rounded-up share at a time. Prefetches never queue: they only use
+spare slots.
+"""
+
+import asyncio
+from collections import deque
+import os
+import re
+import threading
+import time
+from urllib.parse import urlsplit
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# Concurrent requests per upstream host (0 = unlimited), with per-host overrides
+# as "host=limit,host=limit"
+UPSTREAM_MAX_CONNECTIONS = int(os.environ.get("UPSTREAM_MAX_CONNECTIONS", 0))
+UPSTREAM_CONNECTION_LIMITS = os.environ.get("UPSTREAM_CONNECTION_LIMITS", "")
+# Seconds a request waits for a free slot before giving up with 503
+UPSTREAM_QUEUE_TIMEOUT = float(os.environ.get("UPSTREAM_QUEUE_TIMEOUT", 15))
+WEB_CONCURRENCY = int(os.environ.get("WEB_CONCURRENCY", 1))
+# Lock files of caps shared between processes
+UPSTREAM_LOCK_DIR = os.environ.get("UPSTREAM_LOCK_DIR", "./data/upstream")
+# How often a request waiting for a shared slot tries again
+SHARED_SLOT_POLL_SECONDS = 0.05
+
+class UpstreamBusy(Exception):
+    """No connection slot for the provider became free in time"""
+    status = 503
+
+def parse_limits(spec):
+    limits = {}
+    for item in spec.split(','):
+        host, _, limit = item.strip().partition('=')
+        if host and limit.strip().isdigit():
+            limits[host.strip().lower()] = int(limit)
+    return limits
+
+class _Waiter:
+    def __init__(self, loop=None):
+        self.granted = False
+        self.queued_at = time.monotonic()
+        if loop is None:
+            self.event = threading.Event()
+            self.future = None
+        else:
+            self.event = None
+            self.loop = loop
+            self.future = loop.create_future()
+
+    def wake(self):
+        if self.event is not None:
+            self.event.set()
+        else:
+            self.loop.call_soon_threadsafe(_resolve, self.future)
+
+def _resolve(future):
+    if not future.done():
+        future.set_result(None)
+
+class _Host:
+    def __init__(self, limit, shared=0):
+        self.limit = limit
+        # Slots shared with the other processes through lock files (0 = not shared)
+        self.shared = shared
+        # Lock files of the shared slots this process holds, one per request
+        self.lock_files = []
+        self.active = 0
+        self.waiters = deque()
+        self.peak = 0
+        self.requests = 0
+        self.queued = 0
+        self.handed_over = 0
+        self.rejected = 0
+        self.skipped = 0
+        self.wait_seconds = 0.0
+
+class UpstreamLimiter:
+    def __init__(self, default_limit=UPSTREAM_MAX_CONNECTIONS, limits=None,
+                 timeout=UPSTREAM_QUEUE_TIMEOUT, processes=WEB_CONCURRENCY):
+        self.default_limit = default_limit
+        self.limits = parse_limits(UPSTREAM_CONNECTION_LIMITS) if limits is None else limits
+        self.timeout = timeout
+        self.processes = max(processes, 1)
+        self._hosts = {}
+        self._lock = threading.Lock()
+
+    def _host_locked(self, host):
+        state = self._hosts.get(host)
+        if state is None:
+            limit = self.limits.get(host.split(':')[0], self.limits.get(host, self.default_limit))
+            shared = 0
+            if limit and limit % self.processes:
+                if fcntl:
+                    print(f"[UPSTREAM] Cap of {limit} for {host} is shared by {self.processes} processes")
+                    shared = limit
+                    limit = -(-limit // self.processes)
+                elif limit < self.processes:
+                    print(f"[UPSTREAM] Cap of {limit} for {host} is below {self.processes} processes; "
+                          f"up to {self.processes} connections may be opened")
+                    limit = 1
+                else:
+                    print(f"[UPSTREAM] Cap of {limit} for {host} is not divisible by {self.processes} processes; "
+                          f"{limit // self.processes * self.processes} connections are used")
+                    limit = limit // self.processes
+            elif limit:
+                # This process's share of the provider's cap
+                limit = limit // self.processes
+            state = self._hosts[host] = _Host(limit, shared)
+        return state
+
+    def _enter_locked(self, state, queue, loop=None):
+        """Take a free slot, or queue a waiter; returns the waiter or None if the slot was taken"""
+        state.requests += 1
+        if not state.limit or (state.active < state.limit and not state.waiters):
+            state.active += 1
+            state.peak = max(state.peak, state.active)
+            return None
+
+        if not queue:
+            state.requests -= 1
+            state.skipped += 1
+            raise UpstreamBusy("Provider connection limit reached")
+
+        waiter = _Waiter(loop)
+        state.waiters.append(waiter)
+        state.queued += 1
+        return waiter
+
+    def _give_up(self, state, waiter, rejected=True):
+        """Stop waiting, unless a slot was handed over in the meantime; True if none was"""
+        with self._lock:
+            if waiter.granted:
+                return False
+            state.waiters.remove(waiter)
+            if rejected:
+                state.rejected += 1
+            return True
+
+    def _try_shared(self, host, state):
+        """Lock a free one of the host's shared slot files; False if they are all held.
+
+        A file this process holds already fails to lock again as well, since
+        flock locks belong to the open file.
+        """
+        os.makedirs(UPSTREAM_LOCK_DIR, exist_ok=True)
+        name = re.sub(r'[^a-z0-9.-]', '_', host)
+        for i in range(state.shared):
+            f = open(os.path.join(UPSTREAM_LOCK_DIR, f"{name}.{i}.lock"), 'a')
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                f.close()
+                continue
+            with self._lock:
+                state.lock_files.append(f)
+            return True
+        return False
+
+    def _shared_busy(self, host, state, queue):
+        with self._lock:
+            if queue:
+                state.rejected += 1
+            else:
+                state.skipped += 1
+        return UpstreamBusy(f"All {state.shared} connections to {host} are busy")
+
+    def _take_shared(self, host, state, queue, deadline, handed_over):
+        """Wait for a shared slot after taking this process's slot, which is given back on failure.
+
+        A slot handed over by a request of this process that just gave up its
+        shared slot first waits one poll, so the other processes get a turn.
+        """
+        try:
+            if handed_over:
+                time.sleep(SHARED_SLOT_POLL_SECONDS * 2)
+            while not self._try_shared(host, state):
+                if not queue or time.monotonic() >= deadline:
+                    raise self._shared_busy(host, state, queue)
+                time.sleep(SHARED_SLOT_POLL_SECONDS)
+        except BaseException:
+            self._release_slot(host)
+            raise
+
+    async def _take_shared_async(self, host, state, queue, deadline, handed_over):
+        try:
+            if handed_over:
+                await asyncio.sleep(SHARED_SLOT_POLL_SECONDS * 2)
+            while not self._try_shared(host, state):
+                if not queue or time.monotonic() >= deadline:
+                    raise self._shared_busy(host, state, queue)
+                await asyncio.sleep(SHARED_SLOT_POLL_SECONDS)
+        except BaseException:
+            self._release_slot(host)
+            raise
+
+    def acquire(self, url, queue=True):
+        """Block until a slot for the URL's host is free; returns the host to release"""
+        deadline = time.monotonic() + self.timeout
+        host = urlsplit(url).netloc.lower()
+        with self._lock:
+            state = self._host_locked(host)
+            waiter = self._enter_locked(state, queue)
+
+        if waiter is not None:
+            if not waiter.event.wait(self.timeout) and self._give_up(state, waiter):
+                raise UpstreamBusy(f"All {state.limit} connections to {host} are busy")
+        if state.shared:
+            self._take_shared(host, state, queue, deadline, waiter is not None)
+        return host
+
+    async def acquire_async(self, url, queue=True):
+        """acquire() for the event loop"""
+        deadline = time.monotonic() + self.timeout
+        host = urlsplit(url).netloc.lower()
+        with self._lock:
+            state = self._host_locked(host)
+            waiter = self._enter_locked(state, queue, asyncio.get_running_loop())
+
+        if waiter is not None:
+            try:
+                await asyncio.wait_for(asyncio.shield(waiter.future), self.timeout)
+            except asyncio.TimeoutError:
+                if self._give_up(state, waiter):
+                    raise UpstreamBusy(f"All {state.limit} connections to {host} are busy")
+            except asyncio.CancelledError:
+                # The viewer went away while queued; pass on a slot it may have been given
+                if not self._give_up(state, waiter, rejected=False):
+                    self.release(host)
+                raise
+        if state.shared:
+            await self._take_shared_async(host, state, queue, deadline, waiter is not None)
+        return host
+
+    def release(self, host):
+        with self._lock:
+            state = self._hosts[host]
+            if state.lock_files:
+                # Any of them: closing the file drops its lock for the other processes
+                state.lock_files.pop().close()
+        self._release_slot(host)
+
+    def _release_slot(self, host):
+        """Give this process's slot to the next waiter, without a shared slot"""
+        with self._lock:
+            state = self._hosts[host]
+            if state.waiters:
+                # Hand the slot straight to the next waiter
+                waiter = state.waiters.popleft()
+                waiter.granted = True
+                state.handed_over += 1
+                state.wait_seconds += time.monotonic() - waiter.queued_at
+                waiter.wake()
+            else:
+                state.active -= 1
+
+    def slot(self, url, queue=True):
+        return _Slot(self, url, queue)
+
+    def stats(self):
+        """Current usage per upstream host"""
+        with self._lock:
+            hosts = {
+                host: {
+                    'limit': state.limit or None,
+                    'shared_limit': state.shared or None,
+                    'active': state.active,
+                    'waiting': len(state.waiters),
+                    'peak': state.peak,
+                    'requests': state.requests,
+                    'queued': state.queued,
+                    'rejected': state.rejected,
+                    'prefetch_skipped': state.skipped,
+                    'avg_wait_ms': round(state.wait_seconds * 1000 / state.handed_over, 1) if state.handed_over else 0,
+                }
+                for host, state in self._hosts.items()
+            }
+        return {
+            'default_limit': self.default_limit or None,
+            'processes': self.processes,
+            'hosts': hosts,
+        }
+
+class _Slot:
+    """Context manager holding one upstream slot, sync or async"""
+
+    def __init__(self, limiter, url, queue):
+        self.limiter = limiter
+        self.url = url
+        self.queue = queue
+        self.host = None
+
+    def __enter__(self):
+        self.host = self.limiter.acquire(self.url, self.queue)
+        return self
+
+    def __exit__(self, *exc):
+        self.limiter.release(self.host)
+
+    async def __aenter__(self):
+        self.host = await self.limiter.acquire_async(self.url, self.queue)
+        return self
+
+    async def __aexit__(self, *exc):
+        self.limiter.release(self.host)
+
+upstream_limiter = UpstreamLimiter()
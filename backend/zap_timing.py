@@ -0,0 +1,49 @@
+"""
+Timings of the phases of a channel switch.
+
+Starting a channel costs a master playlist fetch, a variant playlist fetch and
+the first segment's time to first byte, one after the other. Each phase is
+recorded as seen by the proxy (cache hits included), separately for viewer
+requests and for warm-ups, so /api/stream/stats shows where switch time goes.
+"""
+
+from collections import deque
+import os
+import threading
+
+# Recent samples kept per phase
+ZAP_TIMING_SAMPLES = int(os.environ.get("ZAP_TIMING_SAMPLES", 500))
+
+class ZapTimings:
+    def __init__(self, samples=ZAP_TIMING_SAMPLES):
+        self.samples = samples
+        self._phases = {}
+        self._counts = {}
+        self._lock = threading.Lock()
+
+    def record(self, phase, seconds):
+        with self._lock:
+            if phase not in self._phases:
+                self._phases[phase] = deque(maxlen=self.samples)
+                self._counts[phase] = 0
+            self._phases[phase].append(seconds * 1000)
+            self._counts[phase] += 1
+
+    def stats(self):
+        """Count and recent average/p50/p95/max in milliseconds, per phase"""
+        with self._lock:
+            phases = {phase: sorted(values) for phase, values in self._phases.items()}
+            counts = dict(self._counts)
+
+        result = {}
+        for phase, values in phases.items():
+            result[phase] = {
+                'count': counts[phase],
+                'avg_ms': round(sum(values) / len(values), 1),
+                'p50_ms': round(values[len(values) // 2], 1),
+                'p95_ms': round(values[min(int(len(values) * 0.95), len(values) - 1)], 1),
+                'max_ms': round(values[-1], 1),
+            }
+        return result
+
+zap_timings = ZapTimings()
@@ -1,5 +1,10 @@
 // Use API_BASE from auth.js
 
+// Channels are listed a page at a time, with only the columns the list uses
+const CHANNEL_PAGE_SIZE = 300;
+const CHANNEL_LIST_FIELDS = 'id,name,tvg_name,tvg_logo,stream_url,is_favorite';
+const SEARCH_RESULT_LIMIT = 200;
+
 class IPTVApp {
     constructor() {
         this.currentPlaylist = null;
@@ -9,6 +14,14 @@ class IPTVApp {
         this.selectedChannels = new Set();
         this.activeRecordingId = null;
         this.contextMenuChannel = null;
+        this.warmTimer = null;
+        this.currentGroup = null;
+        this.currentSearch = '';
+        this.channelCursor = null;
+        this.channelListUrl = null;
+        this.loadingChannelPage = false;
+        this.searchTimer = null;
+        this.groupsEtag = null;
         
         // Wait for DOM to be ready
         if (document.readyState === 'loading') {
@@ -216,6 +229,16 @@ class IPTVApp {
             });
         }
         
+        // Load the next page of channels when scrolling near the end of the list
+        const channelsTab = document.getElementById('channels-tab');
+        if (channelsTab) {
+            channelsTab.addEventListener('scroll', () => {
+                if (channelsTab.scrollTop + channelsTab.clientHeight > channelsTab.scrollHeight - 600) {
+                    this.loadMoreChannels();
+                }
+            });
+        }
+        
         // Modal
         const modalClose = document.getElementById('modal-close');
         if (modalClose) {
@@ -683,31 +706,77 @@ class IPTVApp {
         }
     }
     
-    async loadChannels(playlistId, groupTitle = null) {
+    async loadChannels(playlistId, groupTitle = null, search = '') {
+        this.currentGroup = groupTitle;
+        this.currentSearch = search;
+        
+        // Searches return the best matches first rather than pages in channel order
+        let url = search
+            ? `${API_BASE}/channels/search?q=${encodeURIComponent(search)}&playlist_id=${playlistId}&limit=${SEARCH_RESULT_LIMIT}&fields=${CHANNEL_LIST_FIELDS}`
+            : `${API_BASE}/channels?playlist_id=${playlistId}&limit=${CHANNEL_PAGE_SIZE}&fields=${CHANNEL_LIST_FIELDS}`;
+        if (groupTitle) {
+            url += `&group=${encodeURIComponent(groupTitle)}`;
+        }
+        
+        // Pages of an older listing that arrive late are dropped
+        this.channelListUrl = url;
+        this.channelCursor = null;
+        this.loadingChannelPage = false;
+        
         try {
-            let url = `${API_BASE}/channels?playlist_id=${playlistId}`;
-            if (groupTitle) {
-                url += `&group=${encodeURIComponent(groupTitle)}`;
-            }
-            
-            const response = await fetch(url, {
-                credentials: 'include'
-            });
-            
-            if (response.status === 401) {
-                window.location.href = '/login.html';
-                return;
-            }
+            const channels = await this.fetchChannelPage(url);
+            if (!channels) return;
             
-            this.channels = await response.json();
-            console.log(`Loaded ${this.channels.length} channels`);
+            this.channels = channels;
             this.renderChannels(this.channels);
-            await this.loadGroups(playlistId);
+            if (!search) {
+                await this.loadGroups(playlistId);
+            }
         } catch (error) {
             console.error('Error loading channels:', error);
         }
     }
     
+    async loadMoreChannels() {
+        if (!this.channelCursor || this.loadingChannelPage) return;
+        
+        this.loadingChannelPage = true;
+        try {
+            const url = this.channelListUrl;
+            const channels = await this.fetchChannelPage(`${url}&cursor=${this.channelCursor}`, url);
+            if (!channels) return;
+            
+            const start = this.channels.length;
+            this.channels = this.channels.concat(channels);
+            this.appendChannelItems(channels, start);
+        } catch (error) {
+            console.error('Error loading more channels:', error);
+        } finally {
+            this.loadingChannelPage = false;
+        }
+    }
+    
+    async fetchChannelPage(url, listUrl = url) {
+        const response = await fetch(url, {
+            credentials: 'include'
+        });
+        
+        if (response.status === 401) {
+            window.location.href = '/login.html';
+            return null;
+        }
+        
+        const channels = await response.json();
+        if (listUrl !== this.channelListUrl) return null;
+        
+        this.channelCursor = response.headers.get('X-Next-Cursor');
+        const total = response.headers.get('X-Total-Count');
+        if (total !== null) {
+            console.log(`Loaded ${channels.length} of ${total} channels`);
+        }
+        return channels;
+    }
+    
     renderChannels(channels) {
         const container = document.getElementById('channel-list');
         container.innerHTML = '';
@@ -717,7 +786,15 @@ class IPTVApp {
             return;
         }
         
-        channels.forEach((channel, index) => {
+        this.appendChannelItems(channels, 0);
+    }
+    
+    appendChannelItems(channels, start) {
+        const container = document.getElementById('channel-list');
+        const fragment = document.createDocumentFragment();
+        
+        channels.forEach((channel, offset) => {
+            const index = start + offset;
             const item = document.createElement('div');
             item.className = 'channel-item';
             item.dataset.channelId = channel.id;
@@ -761,8 +838,10 @@ class IPTVApp {
                 this.deleteChannel(channel.id);
             });
             
-            container.appendChild(item);
+            fragment.appendChild(item);
         });
+        
+        container.appendChild(fragment);
     }
     
     showContextMenu(x, y, channel) {
@@ -795,7 +874,13 @@ class IPTVApp {
                 return;
             }
             
+            // Revalidated with the server's ETag; skip re-rendering unchanged
+            // groups so the selected one stays highlighted
+            const etag = `${playlistId}:${response.headers.get('ETag')}`;
+            if (etag === this.groupsEtag) return;
+            
             const groups = await response.json();
+            this.groupsEtag = etag;
             this.renderGroups(groups);
         } catch (error) {
             console.error('Error loading groups:', error);
@@ -828,17 +913,26 @@ class IPTVApp {
         });
         container.appendChild(allItem);
         
+        const fragment = document.createDocumentFragment();
         groups.forEach(group => {
             const item = document.createElement('div');
             item.className = 'group-item';
-            item.textContent = group;
+            
+            const name = document.createElement('span');
+            name.textContent = group.name;
+            const count = document.createElement('span');
+            count.className = 'group-count';
+            count.textContent = group.channel_count;
+            item.append(name, count);
+            
             item.addEventListener('click', () => {
                 document.querySelectorAll('.group-item').forEach(g => g.classList.remove('active'));
                 item.classList.add('active');
-                this.loadChannels(this.currentPlaylist, group);
+                this.loadChannels(this.currentPlaylist, group.name);
             });
-            container.appendChild(item);
+            fragment.appendChild(item);
         });
+        container.appendChild(fragment);
     }
     
     playChannel(channel, element) {
@@ -857,6 +951,35 @@ class IPTVApp {
         if (window.player) {
             window.player.loadStream(channel.stream_url);
         }
+        
+        this.warmAdjacentChannels(channel);
+    }
+    
+    warmAdjacentChannels(channel) {
+        // Ask the server to pre-resolve the channels next to this one, so
+        // switching up or down starts from warm caches. Delayed so it does not
+        // compete with the channel starting now, and skipped while zapping fast.
+        clearTimeout(this.warmTimer);
+        this.warmTimer = setTimeout(async () => {
+            const index = this.channels.findIndex(ch => ch.id === channel.id);
+            if (index === -1) return;
+            
+            const channelIds = [this.channels[index + 1], this.channels[index - 1]]
+                .filter(ch => ch && ch.id !== channel.id)
+                .map(ch => ch.id);
+            if (channelIds.length === 0) return;
+            
+            try {
+                await fetch(`${API_BASE}/stream/warm`, {
+                    method: 'POST',
+                    headers: { 'Content-Type': 'application/json' },
+                    credentials: 'include',
+                    body: JSON.stringify({ channel_ids: channelIds })
+                });
+            } catch (error) {
+                console.warn('Channel warm-up failed:', error);
+            }
+        }, 2000);
     }
     
     async loadFavorites() {
@@ -906,17 +1029,13 @@ class IPTVApp {
     }
     
     searchChannels(query) {
-        if (!query) {
-            this.renderChannels(this.channels);
-            return;
-        }
-        
-        const filtered = this.channels.filter(channel =>
-            channel.name.toLowerCase().includes(query.toLowerCase()) ||
-            (channel.tvg_name && channel.tvg_name.toLowerCase().includes(query.toLowerCase()))
-        );
-        
-        this.renderChannels(filtered);
+        // Searched on the server, as only part of the list may be loaded
+        clearTimeout(this.searchTimer);
+        this.searchTimer = setTimeout(() => {
+            if (this.currentPlaylist) {
+                this.loadChannels(this.currentPlaylist, this.currentGroup, query.trim());
+            }
+        }, 250);
     }
     
     showAddPlaylistModal() {
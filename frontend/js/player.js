@@ -3,6 +3,15 @@ class VideoPlayer {
         this.video = document.getElementById('video-player');
         this.hls = null;
         this.currentUrl = null;
+        this.onZapPlaying = null;
+    }
+    
+    isRawTransportStream(url) {
+        try {
+            return new URL(url).pathname.toLowerCase().endsWith('.ts');
+        } catch (e) {
+            return false;
+        }
     }
     
     loadStream(url) {
@@ -10,14 +19,25 @@ class VideoPlayer {
         
         console.log(`Loading stream: ${url}`);
         
+        // Channel switch timing: playlist, first fragment and first frame
+        const zapStarted = performance.now();
+        const zapElapsed = () => `${Math.round(performance.now() - zapStarted)} ms`;
+        let firstFragment = true;
+        this.video.removeEventListener('playing', this.onZapPlaying);
+        this.onZapPlaying = () => console.log(`[ZAP] Playing after ${zapElapsed()}`);
+        this.video.addEventListener('playing', this.onZapPlaying, { once: true });
+        
         // Clean up existing player
         if (this.hls) {
             this.hls.destroy();
             this.hls = null;
         }
         
-        // Always use proxy to bypass CORS
-        const proxyUrl = `/hls-proxy/manifest?url=${encodeURIComponent(url)}`;
+        // Always use proxy to bypass CORS; raw MPEG-TS channels are restreamed
+        // as HLS so every viewer shares one upstream connection
+        const proxyUrl = this.isRawTransportStream(url)
+            ? `/hls-proxy/restream/hls?url=${encodeURIComponent(url)}`
+            : `/hls-proxy/manifest?url=${encodeURIComponent(url)}`;
         console.log(`Using proxy: ${proxyUrl}`);
         
         if (Hls.isSupported()) {
@@ -37,7 +57,7 @@ class VideoPlayer {
             this.hls.attachMedia(this.video);
             
             this.hls.on(Hls.Events.MANIFEST_PARSED, () => {
-                console.log('✓ Stream manifest loaded successfully');
+                console.log(`✓ Stream manifest loaded successfully (${zapElapsed()})`);
                 document.getElementById('video-overlay').classList.add('hidden');
                 this.video.play().catch(e => {
                     console.log('Autoplay prevented, user interaction needed');
@@ -46,6 +66,10 @@ class VideoPlayer {
             
             this.hls.on(Hls.Events.FRAG_LOADED, (event, data) => {
                 console.log(`✓ Loaded fragment: ${data.frag.sn}`);
+                if (firstFragment) {
+                    firstFragment = false;
+                    console.log(`[ZAP] First fragment after ${zapElapsed()}`);
+                }
             });
             
             this.hls.on(Hls.Events.ERROR, (event, data) => {